@@ -1,6 +1,8 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { Routes, Route, Link, useLocation, useNavigate } from 'react-router-dom';
 import { useAuth } from './AuthContext'; // NEW: AuthContextをインポート
+import { ensureFreshAccessToken, logoutSession, clearTokens, startTokenRefresh } from './authTokens';
+import { createSessionPatch, sessionETag, toJsonValue, SyncedSession } from './sessionSync';
 import {
   Typography,
   Container,
@@ -114,6 +116,9 @@ function App() {
     setSnackbarOpen(true);
   }, [setSnackbarMessage, setSnackbarSeverity, setSnackbarOpen]);
 
+  // 最後にサーバーと同期した作業状態（差分の計算と If-Match / If-None-Match に使う）
+  const syncedSessionRef = useRef<SyncedSession<SessionState> | null>(null);
+
   const saveSession = useCallback(async () => {
     const token = localStorage.getItem('access_token');
     if (!token || !isLoggedIn) {
@@ -131,16 +136,42 @@ function App() {
       selectedTeamId,
     };
 
+    const nextState = toJsonValue(sessionState);
+    const synced = syncedSessionRef.current;
+
     try {
-      await fetch(`${API_BASE}/api/session`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`,
-        },
-        body: JSON.stringify({ session_data: JSON.stringify(sessionState) }),
-      });
-      console.log('Session data saved successfully.');
+      let response: Response | null = null;
+      if (synced) {
+        const operations = createSessionPatch(synced.state, nextState);
+        if (operations.length === 0) {
+          return; // 前回の同期から変わっていない
+        }
+        response = await fetch(`${API_BASE}/api/session`, {
+          method: 'PATCH',
+          headers: {
+            'Content-Type': 'application/json-patch+json',
+            'Authorization': `Bearer ${token}`,
+            'If-Match': sessionETag(synced.version),
+          },
+          body: JSON.stringify(operations),
+        });
+      }
+      if (!response || !response.ok) {
+        // 未同期、または他のタブなどで更新されていた（412）場合は丸ごと保存する
+        response = await fetch(`${API_BASE}/api/session`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${token}`,
+          },
+          body: JSON.stringify({ session_data: JSON.stringify(nextState) }),
+        });
+      }
+      if (response.ok) {
+        const data = await response.json();
+        syncedSessionRef.current = { version: data.version, state: nextState };
+        console.log('Session data saved successfully.');
+      }
     } catch (error) {
       console.error('Failed to save session data:', error);
     }
@@ -153,16 +184,25 @@ function App() {
     }
 
     try {
+      const synced = syncedSessionRef.current;
       const response = await fetch(`${API_BASE}/api/session`, {
         headers: {
           'Authorization': `Bearer ${token}`,
+          ...(synced ? { 'If-None-Match': sessionETag(synced.version) } : {}),
         },
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        if (data.session_data && data.session_data !== "{}") {
-          const sessionState: SessionState = JSON.parse(data.session_data);
+      if (response.ok || response.status === 304) {
+        let sessionData: string;
+        if (response.status === 304 && synced) {
+          sessionData = JSON.stringify(synced.state); // 前回の同期から変わっていない
+        } else {
+          const data = await response.json();
+          sessionData = data.session_data;
+          syncedSessionRef.current = { version: data.version, state: JSON.parse(data.session_data || '{}') };
+        }
+        if (sessionData && sessionData !== "{}") {
+          const sessionState: SessionState = JSON.parse(sessionData);
           // 前回の作業内容が空でない場合にのみダイアログを表示
           if (sessionState.pdfSummary !== '' || sessionState.chatMessages.length > 0) {
             setLoadedSessionState(sessionState); // Store the loaded state
@@ -171,7 +211,7 @@ function App() {
           } else {
             console.log('Session data found but empty, not prompting for restore.');
           }
-        } else { // This 'else' belongs to 'if (data.session_data && data.session_data !== "{}")'
+        } else { // This 'else' belongs to 'if (sessionData && sessionData !== "{}")'
           console.log('No session data found or empty.');
         }
       } else { // This 'else' belongs to 'if (response.ok)'
@@ -192,7 +232,8 @@ function App() {
   const [previousViewMode, setPreviousViewMode] = useState<'new' | 'history' | 'current' | undefined>(undefined);
 
   const checkAuth = useCallback(async () => {
-    const token = localStorage.getItem('access_token');
+    // アクセストークンは短命なので、期限切れならリフレッシュトークンで更新してから確認する
+    const token = await ensureFreshAccessToken();
     if (token) {
       try {
         const response = await fetch(`${API_BASE}/api/users/me`, {
@@ -205,14 +246,14 @@ function App() {
           loadSession(); // ログイン成功時にセッションをロード
         } else {
           // トークンが無効な場合はログアウト状態にする
-          localStorage.removeItem('access_token');
+          clearTokens();
           setIsLoggedIn(false);
           setUsername(null);
           showSnackbar('セッションの有効期限が切れました。再度ログインしてください。', 'warning');
         }
       } catch (error) {
         console.error('Error checking auth:', error);
-        localStorage.removeItem('access_token');
+        clearTokens();
         setIsLoggedIn(false);
         setUsername(null);
       }
@@ -226,6 +267,12 @@ function App() {
     checkAuth();
   }, [checkAuth]);
 
+  // ログイン中はアクセストークンを期限切れ前に更新し続ける
+  useEffect(() => {
+    if (!isLoggedIn) return;
+    return startTokenRefresh();
+  }, [isLoggedIn]);
+
   // beforeunload イベントでセッションを保存
   useEffect(() => {
     window.addEventListener('beforeunload', saveSession);
@@ -337,7 +384,8 @@ function App() {
 
   const handleLogout = () => {
     saveSession(); // ログアウト前にセッションを保存
-    localStorage.removeItem('access_token');
+    logoutSession(); // サーバー側のセッション（リフレッシュトークン）も失効させる
+    syncedSessionRef.current = null; // 次にログインするユーザーの状態と混ざらないようにする
     handleCloseMenu();
     checkAuth(); // 認証状態を再チェック
     showSnackbar('ログアウトしました。', 'info');
@@ -1,4 +1,5 @@
 import React, { createContext, useContext, useState, ReactNode } from 'react';
+import { ACCESS_TOKEN_REFRESHED_EVENT } from './authTokens';
 
 interface AuthContextType {
   authToken: string | null;
@@ -21,6 +22,13 @@ export const AuthProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
     }
   }, [authToken]);
 
+  // authTokens がトークンを更新（ログイン・リフレッシュ）したら追従する
+  React.useEffect(() => {
+    const handleRefreshed = (event: Event) => setAuthToken((event as CustomEvent<string>).detail);
+    window.addEventListener(ACCESS_TOKEN_REFRESHED_EVENT, handleRefreshed);
+    return () => window.removeEventListener(ACCESS_TOKEN_REFRESHED_EVENT, handleRefreshed);
+  }, []);
+
   return (
     <AuthContext.Provider value={{ authToken, setAuthToken, isLoggedIn }}>
       {children}
@@ -0,0 +1,107 @@
+// アクセストークン（短命）とリフレッシュトークンの保存と更新
+// 各画面は localStorage の access_token をその都度読むため、期限が切れる前にここで更新しておく
+
+const API_BASE = process.env.REACT_APP_API_BASE_URL || '';
+const ACCESS_TOKEN_KEY = 'access_token';
+const REFRESH_TOKEN_KEY = 'refresh_token';
+const REFRESH_MARGIN_MS = 60 * 1000; // 期限の1分前に更新する
+const REFRESH_CHECK_INTERVAL_MS = 30 * 1000;
+export const ACCESS_TOKEN_REFRESHED_EVENT = 'access-token-refreshed';
+
+interface TokenResponse {
+  access_token: string;
+  refresh_token?: string;
+}
+
+export const storeTokens = (data: TokenResponse) => {
+  localStorage.setItem(ACCESS_TOKEN_KEY, data.access_token);
+  if (data.refresh_token) {
+    localStorage.setItem(REFRESH_TOKEN_KEY, data.refresh_token);
+  }
+  window.dispatchEvent(new CustomEvent(ACCESS_TOKEN_REFRESHED_EVENT, { detail: data.access_token }));
+};
+
+export const clearTokens = () => {
+  localStorage.removeItem(ACCESS_TOKEN_KEY);
+  localStorage.removeItem(REFRESH_TOKEN_KEY);
+};
+
+const accessTokenExpiresAt = (token: string): number | null => {
+  try {
+    const payload = JSON.parse(atob(token.split('.')[1].replace(/-/g, '+').replace(/_/g, '/')));
+    return typeof payload.exp === 'number' ? payload.exp * 1000 : null;
+  } catch {
+    return null;
+  }
+};
+
+let refreshInFlight: Promise<string | null> | null = null;
+
+// リフレッシュトークンで新しいトークンを取得する（同時に呼ばれても1回だけ送る）
+export const refreshAccessToken = (): Promise<string | null> => {
+  if (refreshInFlight) return refreshInFlight;
+  refreshInFlight = (async () => {
+    const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+    if (!refreshToken) return null;
+    try {
+      const response = await fetch(`${API_BASE}/api/token/refresh`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ refresh_token: refreshToken }),
+      });
+      if (response.ok) {
+        const data: TokenResponse = await response.json();
+        storeTokens(data);
+        return data.access_token;
+      }
+      if (response.status === 409) {
+        // 別のタブが先に更新した。そのタブが保存したトークンを使う
+        return localStorage.getItem(ACCESS_TOKEN_KEY);
+      }
+      if (response.status === 401) {
+        clearTokens();
+      }
+      return null;
+    } catch (error) {
+      console.error('Error refreshing access token:', error);
+      return null;
+    } finally {
+      refreshInFlight = null;
+    }
+  })();
+  return refreshInFlight;
+};
+
+// アクセストークンが期限切れ（または間近）ならリフレッシュする
+export const ensureFreshAccessToken = async (): Promise<string | null> => {
+  const token = localStorage.getItem(ACCESS_TOKEN_KEY);
+  const expiresAt = token ? accessTokenExpiresAt(token) : null;
+  if (token && expiresAt !== null && expiresAt - Date.now() > REFRESH_MARGIN_MS) {
+    return token;
+  }
+  if (!localStorage.getItem(REFRESH_TOKEN_KEY)) {
+    return token;
+  }
+  return refreshAccessToken();
+};
+
+// 定期的に期限を確認して更新する。戻り値で停止する
+export const startTokenRefresh = (): (() => void) => {
+  const timer = setInterval(ensureFreshAccessToken, REFRESH_CHECK_INTERVAL_MS);
+  return () => clearInterval(timer);
+};
+
+export const logoutSession = async () => {
+  const refreshToken = localStorage.getItem(REFRESH_TOKEN_KEY);
+  clearTokens();
+  if (!refreshToken) return;
+  try {
+    await fetch(`${API_BASE}/api/logout`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ refresh_token: refreshToken }),
+    });
+  } catch (error) {
+    console.error('Error revoking session:', error);
+  }
+};
@@ -34,6 +34,15 @@ export interface HistoryContent {
   updated_at: string;
 }
 
+interface PendingQuestionSummary {
+  summary_history_id: number;
+  section_type: 'user_question_summary';
+  content: string;
+  question_text: string;
+  ai_answer_text: string;
+  user_provided_summary: string | null;
+}
+
 interface AiAssistantProps {
   pdfSummaryContent?: string;
   summaryId?: number;
@@ -50,6 +59,82 @@ const AiAssistant = ({ pdfSummaryContent, summaryId, viewMode, currentMessages,
   const [displayMessages, setDisplayMessages] = useState<Message[]>([]);
   const [loading, setLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // 質問単位の要約は少し溜めてから /api/save-question-summaries でまとめて保存する
+  const pendingQuestionSummariesRef = useRef<PendingQuestionSummary[]>([]);
+  const flushTimerRef = useRef<ReturnType<typeof setTimeout> | null>(null);
+  const flushFailuresRef = useRef(0);
+  const authTokenRef = useRef(authToken);
+  authTokenRef.current = authToken;
+
+  const flushQuestionSummaries = async () => {
+    if (flushTimerRef.current) {
+      clearTimeout(flushTimerRef.current);
+      flushTimerRef.current = null;
+    }
+    // サーバーは1回に QUESTION_SUMMARY_BATCH_SIZE 件まで受け付ける
+    const items = pendingQuestionSummariesRef.current.slice(0, QUESTION_SUMMARY_BATCH_SIZE);
+    if (items.length === 0) return;
+    pendingQuestionSummariesRef.current = pendingQuestionSummariesRef.current.slice(items.length);
+    let retryDelayMs: number | null = null;
+    try {
+      const response = await fetch(`${API_BASE}/api/save-question-summaries`, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${authTokenRef.current}`,
+        },
+        body: JSON.stringify({ items }),
+      });
+      if (response.status === 429 || response.status >= 500) {
+        // 流量制限・サーバーエラーは時間を置いて再送する（429 は Retry-After に従う）
+        const retryAfter = Number(response.headers.get('Retry-After'));
+        retryDelayMs = retryAfter > 0 ? retryAfter * 1000 : questionSummaryBackoffMs(flushFailuresRef.current);
+        throw new Error(`status ${response.status}`);
+      }
+      if (!response.ok) {
+        throw new Error(`status ${response.status}`);
+      }
+      flushFailuresRef.current = 0;
+      console.log(`質問単位の要約が保存されました (${items.length}件)`);
+    } catch (saveError) {
+      // 4xx は再送しても成功しない（fetch の TypeError はネットワークエラーなので再送する）
+      if (retryDelayMs === null && !(saveError instanceof TypeError)) {
+        console.error('質問単位の要約保存中にエラーが発生しました:', saveError);
+      } else if (flushFailuresRef.current < QUESTION_SUMMARY_MAX_RETRIES) {
+        // 送れなかった要約はキューの先頭に戻す
+        flushFailuresRef.current += 1;
+        pendingQuestionSummariesRef.current = [...items, ...pendingQuestionSummariesRef.current];
+        console.warn('質問単位の要約の保存を再試行します:', saveError);
+        flushTimerRef.current = setTimeout(flushQuestionSummaries, retryDelayMs ?? questionSummaryBackoffMs(flushFailuresRef.current));
+        return;
+      } else {
+        flushFailuresRef.current = 0;
+        console.error('質問単位の要約保存を諦めました:', saveError);
+      }
+    }
+    if (pendingQuestionSummariesRef.current.length >= QUESTION_SUMMARY_BATCH_SIZE) {
+      flushQuestionSummaries();
+    } else if (pendingQuestionSummariesRef.current.length > 0 && !flushTimerRef.current) {
+      flushTimerRef.current = setTimeout(flushQuestionSummaries, QUESTION_SUMMARY_FLUSH_DELAY_MS);
+    }
+  };
+
+  const queueQuestionSummary = (item: PendingQuestionSummary) => {
+    pendingQuestionSummariesRef.current.push(item);
+    if (pendingQuestionSummariesRef.current.length >= QUESTION_SUMMARY_BATCH_SIZE) {
+      flushQuestionSummaries();
+    } else if (!flushTimerRef.current) {
+      flushTimerRef.current = setTimeout(flushQuestionSummaries, QUESTION_SUMMARY_FLUSH_DELAY_MS);
+    }
+  };
+
+  // アンマウント時に未保存の要約を送る
+  useEffect(() => {
+    return () => {
+      flushQuestionSummaries();
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
 
   const handleSend = async (messageToSend?: string, displayMessage?: string) => {
 
@@ -78,14 +163,21 @@ const AiAssistant = ({ pdfSummaryContent, summaryId, viewMode, currentMessages,
         requestBody.original_file_paths = currentPdfFilePaths?.map(String);
       }
 
+      // ログイン中はトークンを付ける（流量制限が IP ではなくユーザー単位になる）
+      const token = authToken || localStorage.getItem('access_token');
       const response = await fetch(`${API_BASE}/api/chat`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...(token ? { 'Authorization': `Bearer ${token}` } : {}),
         },
         body: JSON.stringify(requestBody),
       });
 
+      if (response.status === 429) {
+        const retryAfter = response.headers.get('Retry-After');
+        throw new RateLimitedError(retryAfter ? Number(retryAfter) : null);
+      }
       if (!response.ok) {
         throw new Error('Network response was not ok');
       }
@@ -100,35 +192,24 @@ const AiAssistant = ({ pdfSummaryContent, summaryId, viewMode, currentMessages,
       if (summaryId && viewMode !== 'history') { // summaryIdがある場合のみ保存
         const userQuestion = userDisplayMessage.text;
         const aiAnswer = data.reply;
-        const category = userDisplayMessage.category || 'その他';
 
-        try {
-          await fetch(`${API_BASE}/api/save-question-summary`, {
-            method: 'POST',
-            headers: {
-              'Content-Type': 'application/json',
-              'Authorization': `Bearer ${authToken}`, // NEW: Authorization ヘッダーを追加
-            },
-            body: JSON.stringify({
-              summary_history_id: summaryId,
-              section_type: 'user_question_summary',
-              content: '', // 要約はバックエンドで生成されるため空 (ユーザー提供の要約がない場合、バックエンドでAI生成される)
-              question_text: userQuestion,
-              ai_answer_text: aiAnswer,
-              user_provided_summary: null, // NEW FIELD: ユーザーが提供する要約 (現時点ではnull)
-            }),
-          });
-          console.log('質問単位の要約が保存されました');
-        } catch (saveError) {
-          console.error('質問単位の要約保存中にエラーが発生しました:', saveError);
-        }
+        queueQuestionSummary({
+          summary_history_id: summaryId,
+          section_type: 'user_question_summary',
+          content: '', // 要約はバックエンドで生成されるため空 (ユーザー提供の要約がない場合、バックエンドでAI生成される)
+          question_text: userQuestion,
+          ai_answer_text: aiAnswer,
+          user_provided_summary: null, // NEW FIELD: ユーザーが提供する要約 (現時点ではnull)
+        });
       }
 
     } catch (error) {
       console.error('Error fetching AI response:', error);
       const errorMessage: Message = {
         sender: 'ai',
-        text: '申し訳ありません。エラーが発生しました。',
+        text: error instanceof RateLimitedError
+          ? `リクエストが混み合っています。${error.retryAfterSeconds ?? 10}秒ほど待ってから再度お試しください。`
+          : '申し訳ありません。エラーが発生しました。',
         timestamp: new Date().toISOString(), // timestampを追加
       };
       const errorMessages = [...newMessages, errorMessage];
@@ -274,3 +355,16 @@ const AiAssistant = ({ pdfSummaryContent, summaryId, viewMode, currentMessages,
 
 export default AiAssistant;
 const API_BASE = process.env.REACT_APP_API_BASE_URL || '';
+const QUESTION_SUMMARY_FLUSH_DELAY_MS = 5000;
+// サーバーの MAX_QUESTION_SUMMARY_BATCH（LLM_BURST_PER_CLIENT の既定値）と揃える
+const QUESTION_SUMMARY_BATCH_SIZE = 10;
+const QUESTION_SUMMARY_MAX_RETRIES = 5;
+
+const questionSummaryBackoffMs = (failures: number) => Math.min(60000, 2000 * 2 ** failures);
+
+// サーバーの流量制限（429）。Retry-After の秒数を持つ
+class RateLimitedError extends Error {
+  constructor(public retryAfterSeconds: number | null) {
+    super('Too many requests');
+  }
+}
@@ -1,4 +1,5 @@
 import React, { useState, useEffect } from 'react';
+import { storeTokens } from '../authTokens';
 import {
   Dialog,
   DialogTitle,
@@ -40,7 +41,7 @@ const LoginModal: React.FC<LoginModalProps> = ({ open, onClose, showSnackbar })
 
       if (response.ok) {
         const data = await response.json();
-        localStorage.setItem('access_token', data.access_token);
+        storeTokens(data); // アクセストークンとリフレッシュトークンを保存
         showSnackbar('ログインに成功しました！', 'success'); // Call showSnackbar
         setErrorMessage(''); // Clear any previous error
         onClose(); // ログイン成功時にモーダルを閉じる
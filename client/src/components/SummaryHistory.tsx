@@ -30,6 +30,8 @@ import AddReactionIcon from '@mui/icons-material/AddReaction'; // 追加
 import { Message, HistoryContent } from './AiAssistant'; // AiAssistantと関連する型をインポート
 
 const API_BASE = process.env.REACT_APP_API_BASE_URL || '';
+const SEARCH_DEBOUNCE_MS = 300;
+const SEARCH_RESULT_LIMIT = 50;
 
 // App.tsxから渡されるHistoryItemの型を再利用
 interface HistoryItem {
@@ -172,6 +174,8 @@ const ChatHistoryDisplay: React.FC<{ chatHistoryId?: number }> = ({ chatHistoryI
 
 const SummaryHistory: React.FC<SummaryHistoryProps> = ({ histories, onHistoryClick, onUpdateHistory, currentUsername }) => {
   const [filter, setFilter] = useState('all');
+  const [searchQuery, setSearchQuery] = useState('');
+  const [searchResultIds, setSearchResultIds] = useState<number[] | null>(null); // サーバー側検索の結果（スコア順）
   const [open, setOpen] = useState(false);
   const [selectedHistory, setSelectedHistory] = useState<HistoryItem | null>(null);
   const [isEditingTags, setIsEditingTags] = useState(false);
@@ -219,7 +223,49 @@ const SummaryHistory: React.FC<SummaryHistoryProps> = ({ histories, onHistoryCli
     }
   }, [selectedHistory]);
 
-  const displayedHistories = histories.filter(item => {
+  // 検索語が入力されたら、入力が止まってから /api/search で検索する
+  useEffect(() => {
+    const query = searchQuery.trim();
+    if (!query) {
+      setSearchResultIds(null);
+      return;
+    }
+    const token = localStorage.getItem('access_token');
+    if (!token) return;
+
+    const controller = new AbortController();
+    const timer = window.setTimeout(async () => {
+      try {
+        const response = await fetch(`${API_BASE}/api/search?q=${encodeURIComponent(query)}&limit=${SEARCH_RESULT_LIMIT}`, {
+          headers: { 'Authorization': `Bearer ${token}` },
+          signal: controller.signal,
+        });
+        if (response.ok) {
+          const data: { id: number }[] = await response.json();
+          setSearchResultIds(data.map(result => result.id));
+        } else {
+          console.error('Failed to search summaries');
+        }
+      } catch (error: any) {
+        if (error.name !== 'AbortError') {
+          console.error('Error searching summaries:', error);
+        }
+      }
+    }, SEARCH_DEBOUNCE_MS);
+
+    return () => {
+      window.clearTimeout(timer);
+      controller.abort();
+    };
+  }, [searchQuery]);
+
+  const searchedHistories = searchResultIds === null
+    ? histories
+    : searchResultIds
+        .map(id => histories.find(item => item.id === id))
+        .filter((item): item is HistoryItem => item !== undefined);
+
+  const displayedHistories = searchedHistories.filter(item => {
     if (filter === 'personal') {
       return !item.team_id;
     }
@@ -485,11 +531,19 @@ const SummaryHistory: React.FC<SummaryHistoryProps> = ({ histories, onHistoryCli
           </ToggleButton>
         </ToggleButtonGroup>
       </Box>
+      <TextField
+        value={searchQuery}
+        onChange={(e) => setSearchQuery(e.target.value)}
+        placeholder="タイトル・タグ・内容・質問から検索"
+        size="small"
+        fullWidth
+        sx={{ mb: 1 }}
+      />
       <Divider sx={{ mb: 1, borderColor: '#00bcd4' }} />
       <Box sx={{ flexGrow: 1, overflowY: 'auto' }}>
         {displayedHistories.length === 0 ? (
           <Typography sx={{ textAlign: 'center', color: 'text.secondary', mt: 4 }}>
-            履歴はありません
+            {searchResultIds === null ? '履歴はありません' : '一致する履歴はありません'}
           </Typography>
         ) : (
           <List disablePadding>
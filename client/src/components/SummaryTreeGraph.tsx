@@ -40,6 +40,14 @@ interface GraphData {
   links: GraphLink[];
 }
 
+interface NodeDetail {
+  id: string;
+  label: string;
+  ai_answer?: string;
+  ai_answer_summary?: string;
+  history_content_id?: number;
+}
+
 const SummaryTreeGraph: React.FC = () => {
   const { authToken } = useAuth();
   const [graphData, setGraphData] = useState<GraphData | null>(null);
@@ -48,6 +56,7 @@ const SummaryTreeGraph: React.FC = () => {
   const [selectedNode, setSelectedNode] = useState<GraphNode | null>(null);
   const [isSummarized, setIsSummarized] = useState<boolean>(true); // NEW: 要約表示/元の回答表示を切り替えるstate
   const cyRef = useRef<cytoscape.Core | null>(null); // Cytoscape.js インスタンスを保存 (useRefを使用)
+  const nodeDetailsCacheRef = useRef<Map<string, NodeDetail>>(new Map()); // 質問ノードID -> 取得済みの回答
   const [expandedGroupNodes, setExpandedGroupNodes] = useState<{ [key: string]: boolean }>({}); // NEW: 展開状態を管理
   const [teams, setTeams] = useState<any[]>([]); // NEW: ユーザーが所属するチームのリスト
   const [selectedFilter, setSelectedFilter] = useState<{ type: 'personal' | 'team' | 'none', teamId?: number }>({ type: 'none' }); // NEW: 選択されたフィルター
@@ -93,6 +102,8 @@ const SummaryTreeGraph: React.FC = () => {
     try {
       let url = `${API_BASE}/api/summary-tree-graph`;
       const params = new URLSearchParams();
+      // 回答本文はノード選択時に /api/graph/nodes から取得する
+      params.append('detail', 'lean');
 
       if (selectedFilter.type === 'personal') {
         params.append('filter_type', 'personal');
@@ -115,6 +126,7 @@ const SummaryTreeGraph: React.FC = () => {
         throw new Error(`HTTP error! status: ${response.status}`);
       }
       const data: GraphData = await response.json();
+      nodeDetailsCacheRef.current.clear();
       setGraphData(data);
     } catch (e: any) {
       setError(e.message);
@@ -129,6 +141,47 @@ const SummaryTreeGraph: React.FC = () => {
     }
   }, [authToken, fetchGraphData, selectedFilter.type]);
 
+  // lean モードで省かれた回答を、選択された質問ノード（統合ノードは元の各質問）の分だけ取得する
+  const loadNodeDetails = useCallback(async (nodeData: GraphNode) => {
+    const questionIds = nodeData.type === 'user_question_group'
+      ? nodeData.grouped_question_ids || []
+      : nodeData.type === 'user_question' ? [nodeData.question_id || nodeData.id] : [];
+    const cache = nodeDetailsCacheRef.current;
+    const missingIds = questionIds.filter(id => !cache.has(id));
+    if (missingIds.length > 0 && authToken) {
+      try {
+        const response = await fetch(`${API_BASE}/api/graph/nodes?ids=${encodeURIComponent(missingIds.join(','))}`, {
+          headers: {
+            'Authorization': `Bearer ${authToken}`,
+          },
+        });
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const details: NodeDetail[] = await response.json();
+        details.forEach(detail => cache.set(detail.id, detail));
+      } catch (e: any) {
+        console.error("Failed to fetch node details:", e.message);
+        return;
+      }
+    }
+    const loaded = questionIds.map(id => cache.get(id)).filter((detail): detail is NodeDetail => detail !== undefined);
+    if (loaded.length === 0) return;
+
+    setSelectedNode(current => {
+      if (!current || current.id !== nodeData.id) return current; // 取得中に別のノードが選択された
+      return {
+        ...current,
+        ai_answer: loaded[0].ai_answer,
+        ai_answer_summary: loaded[0].ai_answer_summary,
+        original_questions_details: current.original_questions_details?.map(originalQuestion => {
+          const detail = cache.get(originalQuestion.question_id || originalQuestion.id);
+          return detail ? { ...originalQuestion, ai_answer: detail.ai_answer, ai_answer_summary: detail.ai_answer_summary } : originalQuestion;
+        }),
+      };
+    });
+  }, [authToken]);
+
   const [processedElements, setProcessedElements] = useState<any[]>([]);
   const containerRef = useRef<HTMLDivElement | null>(null);
   const relayoutTimerRef = useRef<number | null>(null);
@@ -586,6 +639,7 @@ const SummaryTreeGraph: React.FC = () => {
     if (node.isNode()) {
       const nodeData = node.data();
       setSelectedNode(nodeData); // 右側の詳細パネルに表示
+      loadNodeDetails(nodeData);
 
       if (nodeData.type === 'user_question_group' && cyRef.current) { // cyRef.current を参照
         const isExpanded = expandedGroupNodes[nodeData.id];
@@ -659,7 +713,7 @@ const SummaryTreeGraph: React.FC = () => {
         }).run();
       }
     }
-  }, [expandedGroupNodes, layout]); // 依存配列に expandedGroupNodes と layout を追加
+  }, [expandedGroupNodes, layout, loadNodeDetails]); // 依存配列に expandedGroupNodes と layout を追加
 
   useEffect(() => {
     const cy = cyRef.current;
@@ -3,6 +3,7 @@ import { Box, Typography, Container, TextField, Button, List, ListItem, ListItem
 import DeleteIcon from '@mui/icons-material/Delete';
 import AddIcon from '@mui/icons-material/Add';
 import DownloadIcon from '@mui/icons-material/Download';
+import { storeTokens } from '../authTokens';
 
 interface TeamManagementProps {
   showSnackbar: (message: string, severity: 'success' | 'error' | 'info' | 'warning') => void;
@@ -31,6 +32,21 @@ interface SharedFile {
   uploaded_at: string; // ISO 8601 string
 }
 
+interface SummaryJob {
+  id: string;
+  status: 'pending' | 'running' | 'succeeded' | 'failed';
+  total_files: number;
+  completed_files: number;
+  error?: string | null;
+  summary_details?: {
+    summary: string;
+    filename: string;
+    tags: string[];
+    file_path: number[];
+    summary_id: number;
+  } | null;
+}
+
 interface Message {
   id: number;
   team_id: number;
@@ -59,6 +75,7 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
   const [messages, setMessages] = useState<Message[]>([]);
   const [newMessageContent, setNewMessageContent] = useState<string>('');
   const [loadingMessages, setLoadingMessages] = useState<boolean>(false);
+  const [hasOlderMessages, setHasOlderMessages] = useState<boolean>(false);
 
   interface TabPanelProps {
     children?: React.ReactNode;
@@ -189,7 +206,8 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
     }
   }, [showSnackbar]);
 
-  const fetchMessages = useCallback(async (teamId: number) => {
+  // beforeId を指定すると、それより古いメッセージを1ページ分読み込んで先頭に追加する
+  const fetchMessages = useCallback(async (teamId: number, beforeId?: number) => {
     setLoadingMessages(true);
     const token = localStorage.getItem('access_token');
     if (!token) {
@@ -199,7 +217,11 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
     }
 
     try {
-      const response = await fetch(`${API_BASE}/api/teams/${teamId}/messages`, {
+      const params = new URLSearchParams({ limit: String(MESSAGE_PAGE_SIZE) });
+      if (beforeId !== undefined) {
+        params.set('before_id', String(beforeId));
+      }
+      const response = await fetch(`${API_BASE}/api/teams/${teamId}/messages?${params.toString()}`, {
         headers: {
           'Authorization': `Bearer ${token}`,
         },
@@ -207,16 +229,18 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
 
       if (response.ok) {
         const data: Message[] = await response.json();
-        setMessages(data);
+        setMessages((prevMessages) => (beforeId !== undefined ? [...data, ...prevMessages] : data));
+        setHasOlderMessages(data.length === MESSAGE_PAGE_SIZE);
       } else {
         const errorData = await response.json();
         showSnackbar(`メッセージの取得に失敗しました: ${errorData.detail || '不明なエラー'}`, 'error');
-        setMessages([]);
+        // 過去のメッセージの読み込みに失敗した場合は、表示中のメッセージを残す
+        if (beforeId === undefined) setMessages([]);
       }
     } catch (error) {
       console.error('Error fetching messages:', error);
       showSnackbar('ネットワークエラーが発生しました。', 'error');
-      setMessages([]);
+      if (beforeId === undefined) setMessages([]);
     } finally {
       setLoadingMessages(false);
     }
@@ -237,10 +261,25 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
   useEffect(() => {
     if (selectedTeam && currentTab === 1) { // 1は「ファイル共有」タブのインデックス
       fetchSharedFiles(selectedTeam.id);
-    } else if (selectedTeam && currentTab === 2) { // 2は「チャット」タブのインデックス
-      fetchMessages(selectedTeam.id);
     }
-  }, [currentTab, selectedTeam, fetchSharedFiles, fetchMessages]);
+  }, [currentTab, selectedTeam, fetchSharedFiles]);
+
+  // 新着メッセージは WebSocket でプッシュされるので、履歴を再取得する必要はない
+  useEffect(() => {
+    const token = localStorage.getItem('access_token');
+    if (!selectedTeam || !token) {
+      return;
+    }
+    const wsBase = (API_BASE || window.location.origin).replace(/^http/, 'ws');
+    const socket = new WebSocket(`${wsBase}/ws/teams/${selectedTeam.id}/messages?token=${encodeURIComponent(token)}`);
+    socket.onmessage = (event) => {
+      const incoming: Message = JSON.parse(event.data);
+      setMessages((prevMessages) => appendMessage(prevMessages, incoming));
+    };
+    return () => {
+      socket.close();
+    };
+  }, [selectedTeam]);
 
   const handleCreateTeam = async () => {
     if (!teamName.trim()) {
@@ -266,6 +305,8 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
 
       if (response.ok) {
         const data = await response.json();
+        // 所属チームはアクセストークンに含まれるので、新しいチームを含むトークンに差し替える
+        if (data.access_token) storeTokens(data);
         showSnackbar(`チーム「${data.team_name}」を作成しました！`, 'success');
         setTeamName(''); // フォームをクリア
         fetchMyTeams(); // チームリストを更新
@@ -288,6 +329,30 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
     }
   };
 
+  const waitForSummaryJob = async (jobId: string, token: string): Promise<SummaryJob> => {
+    let lastCompleted = -1;
+    while (true) {
+      const response = await fetch(`${API_BASE}/api/jobs/${jobId}`, {
+        headers: {
+          'Authorization': `Bearer ${token}`,
+        },
+      });
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({}));
+        return { id: jobId, status: 'failed', total_files: 0, completed_files: 0, error: errorData.detail };
+      }
+      const job: SummaryJob = await response.json();
+      if (job.status === 'succeeded' || job.status === 'failed') {
+        return job;
+      }
+      if (job.total_files > 1 && job.completed_files !== lastCompleted) {
+        lastCompleted = job.completed_files;
+        showSnackbar(`要約を生成しています... (${job.completed_files}/${job.total_files} ファイル)`, 'info');
+      }
+      await new Promise(resolve => setTimeout(resolve, SUMMARY_JOB_POLL_INTERVAL_MS));
+    }
+  };
+
   const handleFileUpload = async () => {
     console.log('handleFileUpload started, isUploading:', isUploading);
     if (!selectedTeam || !selectedFile || selectedFile.length === 0) {
@@ -320,18 +385,25 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
 
       if (response.ok) {
         const data = await response.json();
-        showSnackbar( data.message, 'success');
+        showSnackbar( data.message, 'info');
         fetchSharedFiles(selectedTeam.id); // ファイルリストを更新
 
-        // Pass summary details to parent component
-        if (data.summary_details && onSummaryGeneratedFromTeamUpload) {
-          onSummaryGeneratedFromTeamUpload(
-            data.summary_details.summary,
-            data.summary_details.filename,
-            data.summary_details.summary_id,
-            data.summary_details.tags,
-            data.summary_details.file_path
-          );
+        // 要約はサーバーのバックグラウンドジョブで生成されるため、完了するまで進捗を確認する
+        const job = await waitForSummaryJob(data.job_id, token);
+        if (job.status === 'failed') {
+          showSnackbar(`要約の生成に失敗しました: ${job.error || '不明なエラー'}`, 'error');
+        } else {
+          showSnackbar('要約がチーム履歴として保存されました！', 'success');
+          // Pass summary details to parent component
+          if (job.summary_details && onSummaryGeneratedFromTeamUpload) {
+            onSummaryGeneratedFromTeamUpload(
+              job.summary_details.summary,
+              job.summary_details.filename,
+              job.summary_details.summary_id,
+              job.summary_details.tags,
+              job.summary_details.file_path
+            );
+          }
         }
       } else {
         const errorData = await response.json();
@@ -408,6 +480,8 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
       });
 
       if (response.ok) {
+        const data = await response.json();
+        if (data.access_token) storeTokens(data); // 自分自身を削除した場合は、そのチームを含まないトークンが返る
         showSnackbar('メンバーを削除しました！', 'success');
         fetchTeamMembers(selectedTeam.id); // メンバーリストを更新
       } else {
@@ -512,7 +586,7 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
 
       if (response.ok) {
         const sentMessage: Message = await response.json();
-        setMessages((prevMessages) => [...prevMessages, sentMessage]);
+        setMessages((prevMessages) => appendMessage(prevMessages, sentMessage));
         setNewMessageContent('');
         showSnackbar('メッセージを送信しました！', 'success');
       } else {
@@ -754,6 +828,13 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
                     <Typography variant="body2" color="text.secondary">まだメッセージはありません。</Typography>
                   ) : (
                     <List>
+                      {hasOlderMessages && selectedTeam && (
+                        <ListItem sx={{ justifyContent: 'center', p: 0.5 }}>
+                          <Button size="small" onClick={() => fetchMessages(selectedTeam.id, messages[0].id)}>
+                            以前のメッセージを読み込む
+                          </Button>
+                        </ListItem>
+                      )}
                       {messages.map((message) => (
                         <ListItem key={message.id} sx={{ flexDirection: 'column', alignItems: 'flex-start', p: 0.5 }}>
                           <Typography variant="caption" color="text.secondary">
@@ -824,3 +905,9 @@ const TeamManagement: React.FC<TeamManagementProps> = ({ showSnackbar, onSummary
 
 export default TeamManagement;
 const API_BASE = process.env.REACT_APP_API_BASE_URL || '';
+const MESSAGE_PAGE_SIZE = 50;
+const SUMMARY_JOB_POLL_INTERVAL_MS = 2000;
+
+// 送信レスポンスと WebSocket の両方で同じメッセージが届くため、ID で重複を除いて追加する
+const appendMessage = (messages: Message[], message: Message): Message[] =>
+  messages.some((existing) => existing.id === message.id) ? messages : [...messages, message];
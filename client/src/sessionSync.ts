@@ -0,0 +1,64 @@
+// 作業状態（/api/session）の差分同期
+// 前回サーバーと同期した状態との差分だけを JSON Patch（RFC 6902）で送る。version は ETag として If-Match に使う
+
+export interface JsonPatchOperation {
+  op: 'add' | 'remove' | 'replace';
+  path: string;
+  value?: unknown;
+}
+
+export interface SyncedSession<T> {
+  version: number;
+  state: T;
+}
+
+export const sessionETag = (version: number) => `"session-${version}"`;
+
+// undefined のプロパティなど、JSON にしたときに消える値をそろえる（サーバーに保存される形と同じにする）
+export const toJsonValue = <T>(value: T): T => JSON.parse(JSON.stringify(value));
+
+const escapePointer = (key: string) => key.replace(/~/g, '~0').replace(/\//g, '~1');
+const isEqual = (a: unknown, b: unknown) => JSON.stringify(a) === JSON.stringify(b);
+const isObject = (value: unknown): value is Record<string, unknown> =>
+  typeof value === 'object' && value !== null && !Array.isArray(value);
+
+const diffArrays = (path: string, prev: unknown[], next: unknown[], ops: JsonPatchOperation[]) => {
+  // チャットの追記のように末尾だけ変わることが多いので、位置ごとに比較する
+  const common = Math.min(prev.length, next.length);
+  for (let i = 0; i < common; i++) {
+    if (!isEqual(prev[i], next[i])) {
+      ops.push({ op: 'replace', path: `${path}/${i}`, value: next[i] });
+    }
+  }
+  for (let i = prev.length - 1; i >= next.length; i--) {
+    ops.push({ op: 'remove', path: `${path}/${i}` });
+  }
+  for (let i = prev.length; i < next.length; i++) {
+    ops.push({ op: 'add', path: `${path}/-`, value: next[i] });
+  }
+};
+
+// prev を next にする JSON Patch を作る（どちらも toJsonValue 済みの値を渡す）
+export const createSessionPatch = (prev: unknown, next: unknown, path = ''): JsonPatchOperation[] => {
+  const ops: JsonPatchOperation[] = [];
+  if (isObject(prev) && isObject(next)) {
+    Object.keys(prev).forEach((key) => {
+      if (!(key in next)) {
+        ops.push({ op: 'remove', path: `${path}/${escapePointer(key)}` });
+      }
+    });
+    Object.keys(next).forEach((key) => {
+      const childPath = `${path}/${escapePointer(key)}`;
+      if (!(key in prev)) {
+        ops.push({ op: 'add', path: childPath, value: next[key] });
+      } else {
+        ops.push(...createSessionPatch(prev[key], next[key], childPath));
+      }
+    });
+  } else if (Array.isArray(prev) && Array.isArray(next)) {
+    diffArrays(path, prev, next, ops);
+  } else if (!isEqual(prev, next)) {
+    ops.push({ op: 'replace', path, value: next });
+  }
+  return ops;
+};
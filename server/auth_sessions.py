@@ -0,0 +1,115 @@
+"""リフレッシュトークンによるログインセッション（ローテーションと再利用の検知）
+
+リフレッシュトークンは "<セッションID>.<ランダムな秘密>" の形式で、DB には秘密の SHA-256 だけを保存する。
+リフレッシュのたびに秘密を新しくし（ローテーション）、直前の秘密は REFRESH_REUSE_GRACE_SECONDS の間だけ
+「ローテーション済み」として扱う（複数タブが同時にリフレッシュした場合など）。それ以外の古い秘密が使われた場合は
+トークンが漏洩したとみなしてセッションを失効させる。
+"""
+import hashlib
+import os
+import secrets
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database import AuthSession
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_REUSE_GRACE_SECONDS = 30
+
+
+class RefreshTokenInvalid(Exception):
+    """リフレッシュトークンが不正・期限切れ・失効済み"""
+
+
+class RefreshTokenAlreadyRotated(Exception):
+    """直前にローテーション済みのトークン（別のタブなどが先にリフレッシュした）"""
+
+
+@dataclass
+class AccessClaims:
+    """アクセストークンのクレーム。ユーザーIDと、発行時点の所属チームを含む（チームの認可は team_members で行う）"""
+    id: int
+    username: str
+    team_ids: List[int]
+    session_id: Optional[str] = None
+
+
+def _hash_secret(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+def _split_token(refresh_token: str) -> Tuple[str, str]:
+    session_id, _, secret = refresh_token.partition(".")
+    if not session_id or not secret:
+        raise RefreshTokenInvalid()
+    return session_id, secret
+
+
+def _as_utc(value: datetime) -> datetime:
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+def create_session(db: Session, user_id: int) -> Tuple[AuthSession, str]:
+    """新しいセッションを作り、(セッション, リフレッシュトークン) を返す（コミットは呼び出し側）"""
+    now = datetime.now(timezone.utc)
+    secret = secrets.token_urlsafe(32)
+    session = AuthSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        token_hash=_hash_secret(secret),
+        created_at=now,
+        last_used_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+    db.add(session)
+    return session, f"{session.id}.{secret}"
+
+
+def rotate_session(db: Session, refresh_token: str) -> Tuple[AuthSession, str]:
+    """リフレッシュトークンを検証して新しいトークンに置き換え、(セッション, 新しいリフレッシュトークン) を返す
+
+    同じセッションの同時リフレッシュを直列化するため、セッションの行をロックする（コミットは呼び出し側）。
+    """
+    session_id, secret = _split_token(refresh_token)
+    session = db.query(AuthSession).filter(AuthSession.id == session_id).with_for_update().first()
+    now = datetime.now(timezone.utc)
+    if session is None or session.revoked_at is not None or _as_utc(session.expires_at) <= now:
+        raise RefreshTokenInvalid()
+
+    secret_hash = _hash_secret(secret)
+    if not secrets.compare_digest(secret_hash, session.token_hash):
+        rotated_recently = (
+            session.previous_token_hash is not None
+            and secrets.compare_digest(secret_hash, session.previous_token_hash)
+            and now - _as_utc(session.last_used_at) <= timedelta(seconds=REFRESH_REUSE_GRACE_SECONDS)
+        )
+        if rotated_recently:
+            raise RefreshTokenAlreadyRotated()
+        # ローテーション済みの古いトークンが使われた（漏洩の可能性）ため、セッションごと失効させる
+        session.revoked_at = now
+        raise RefreshTokenInvalid()
+
+    new_secret = secrets.token_urlsafe(32)
+    session.previous_token_hash = session.token_hash
+    session.token_hash = _hash_secret(new_secret)
+    session.last_used_at = now
+    session.expires_at = now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    return session, f"{session.id}.{new_secret}"
+
+
+def revoke_session(db: Session, refresh_token: str) -> bool:
+    """リフレッシュトークンのセッションを失効させる（コミットは呼び出し側）。該当するセッションが無ければ False"""
+    try:
+        session_id, secret = _split_token(refresh_token)
+    except RefreshTokenInvalid:
+        return False
+    session = db.query(AuthSession).filter(AuthSession.id == session_id).first()
+    if session is None or not secrets.compare_digest(_hash_secret(secret), session.token_hash):
+        return False
+    if session.revoked_at is None:
+        session.revoked_at = datetime.now(timezone.utc)
+    return True
@@ -0,0 +1,88 @@
+"""cache.py のドライバーの確認と計測（2つのワーカーを同じプロセス内の2つの Cache で模擬する）
+
+- 片方のワーカーで保存した値が、もう片方から読めるか（redis のみ）
+- invalidate() で、もう片方のワーカーのローカルのキャッシュも消えるか（pub/sub）
+- 同じキーへの同時の get_or_load で、loader が何回呼ばれるか（single-flight）
+- get の平均レイテンシ
+
+redis ドライバーは、既定では benchmarks/resp_standin.py の簡易サーバーに接続する（--url で本物の Redis も指定できる）。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_cache.py --concurrency 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+async def check_driver(label: str, make_driver, concurrency: int, reads: int):
+    from cache import Cache
+
+    worker_a, worker_b = Cache(make_driver(), prefix="bench"), Cache(make_driver(), prefix="bench")
+    await worker_a.start()
+    await worker_b.start()
+    teams_a = worker_a.namespace("team_members", ttl=60, local_ttl=30)
+    teams_b = worker_b.namespace("team_members", ttl=60, local_ttl=30)
+
+    await teams_a.set("1", [1, 2, 3])
+    shared = await teams_b.get("1")
+    await teams_a.invalidate("1")
+    await asyncio.sleep(0.05) # 通知が届くのを待つ
+    after_invalidate = await teams_b.get("1")
+
+    calls = 0
+
+    async def slow_loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"graph": list(range(100))}
+
+    started = time.perf_counter()
+    await asyncio.gather(*[
+        (teams_a if i % 2 == 0 else teams_b).get_or_load("graph", slow_loader)
+        for i in range(concurrency)
+    ])
+    stampede_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    for _ in range(reads):
+        await teams_b.get_bytes("graph")
+    read_us = (time.perf_counter() - started) / reads * 1e6
+
+    print(f"{label:<7}: shared across workers {shared == [1, 2, 3]!s:<5} | invalidated {after_invalidate is None!s:<5} | "
+          f"{concurrency} concurrent loads -> loader called {calls} time(s) in {stampede_ms:6.1f} ms | "
+          f"get {read_us:6.1f} us")
+    await worker_a.close()
+    await worker_b.close()
+
+
+async def main(args):
+    from cache import LocalLRUDriver, RespDriver
+    from resp_standin import RespStandIn
+
+    await check_driver("memory", LocalLRUDriver, args.concurrency, args.reads)
+
+    standin = None
+    url = args.url
+    if url is None:
+        standin = RespStandIn()
+        await standin.start()
+        url = standin.url
+    await check_driver("redis", lambda: RespDriver.from_url(url), args.concurrency, args.reads)
+    if standin is not None:
+        print(f"stand-in server handled {standin.commands} commands")
+        await standin.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--reads", type=int, default=2000)
+    parser.add_argument("--url", default=None, help="redis://host:port/db（省略時は簡易サーバー）")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,195 @@
+"""グラフ組み立て（類似質問の統合とリンクの重複排除）の旧実装と graph_assembly の比較
+
+- assembly:   統合ノードの生成とリンクの付け替え・重複排除
+              旧実装は next(...) によるノード検索と any(...) によるリンク重複チェック（O(L^2)）
+- clustering: 類似質問のグループ化
+              旧実装は質問のペアごとに cos_sim を呼ぶ（O(Q^2) 回の Python 呼び出し）
+
+旧実装は件数が大きいと終わらないため、--legacy-max-nodes / --legacy-max-questions 以下の場合のみ計測し、
+結果が新実装と一致することも確認する。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_graph_assembly.py --nodes 1000 10000 50000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from graph_assembly import GraphLink, GraphNode, SIMILARITY_THRESHOLD, assemble_graph, cluster_similar_questions  # noqa: E402
+
+EMBEDDING_DIMENSION = 768
+CATEGORIES = ["手法", "実験", "関連研究"]
+
+
+def make_graph(node_count: int, group_ratio: float = 0.2, seed: int = 0):
+    """組み立て前のノードとリンク、類似質問のグループ、埋め込みを生成する
+
+    要約1件あたり PDF・カテゴリ3件・質問20件を持つ。group_ratio の割合の質問は同じカテゴリ内で
+    2〜4件の類似質問グループになる（統合後に重複リンクが発生する）。
+    """
+    rng = random.Random(seed)
+    generator = torch.Generator().manual_seed(seed)
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    nodes: List[GraphNode] = []
+    links: List[GraphLink] = []
+    groups: List[List[str]] = []
+    embeddings: Dict[str, torch.Tensor] = {}
+
+    summary_count = max(1, node_count // (2 + len(CATEGORIES) + 20))
+    question_index = 0
+    for summary_id in range(1, summary_count + 1):
+        summary_node_id = f"summary_{summary_id}"
+        nodes.append(GraphNode(id=summary_node_id, label=f"論文{summary_id}.pdf", type="summary", summary_id=summary_id,
+                               parent_summary_id=summary_id - 1 if summary_id > 1 and summary_id % 5 else None,
+                               summary_created_at=base_time + timedelta(hours=summary_id)))
+        nodes.append(GraphNode(id=f"pdf_{summary_id}", label=f"論文{summary_id}.pdf", type="pdf_file", file_id=summary_id))
+        links.append(GraphLink(source=f"pdf_{summary_id}", target=summary_node_id, type="pdf_summary_link"))
+        if summary_id > 1 and summary_id % 5:
+            links.append(GraphLink(source=f"summary_{summary_id - 1}", target=summary_node_id, type="parent_summary_link"))
+
+        for category in CATEGORIES:
+            category_node_id = f"category_{summary_id}_{category}"
+            nodes.append(GraphNode(id=category_node_id, label=category, type="category", summary_id=summary_id, category=category))
+            links.append(GraphLink(source=summary_node_id, target=category_node_id, type="summary_category_link"))
+
+        remaining = 20
+        while remaining > 0:
+            category = rng.choice(CATEGORIES)
+            size = min(remaining, rng.randint(2, 4)) if rng.random() < group_ratio else 1
+            base_vector = torch.randn(EMBEDDING_DIMENSION, generator=generator)
+            members = []
+            for _ in range(size):
+                question_id = f"question_{summary_id}_{category}_{question_index}"
+                question_index += 1
+                nodes.append(GraphNode(
+                    id=question_id, label=f"質問{question_index}", type="user_question", summary_id=summary_id,
+                    question_id=question_id, ai_answer="回答" * 20, category=category,
+                    question_created_at=base_time + timedelta(minutes=question_index), history_content_id=summary_id,
+                ))
+                links.append(GraphLink(source=f"category_{summary_id}_{category}", target=question_id, type="category_question_link"))
+                # 同じグループの質問は近い埋め込み、それ以外は無相関な埋め込みにする
+                embeddings[question_id] = base_vector + 0.1 * torch.randn(EMBEDDING_DIMENSION, generator=generator)
+                members.append(question_id)
+            groups.append(members)
+            remaining -= size
+
+    return nodes, links, groups, embeddings
+
+
+# --- 旧実装（main.get_summary_tree_graph から抜き出したもの） ---
+
+def legacy_cluster(sorted_question_ids: List[str], embeddings: Dict[str, torch.Tensor]) -> List[List[str]]:
+    def calculate_cosine_similarity(vec1, vec2):
+        # sentence_transformers.util.cos_sim と同じ計算
+        vec1 = torch.nn.functional.normalize(vec1.unsqueeze(0), p=2, dim=1)
+        vec2 = torch.nn.functional.normalize(vec2.unsqueeze(0), p=2, dim=1)
+        return torch.mm(vec1, vec2.transpose(0, 1)).item()
+
+    node_to_group_map = {}
+    groups = []
+    for q_id1 in sorted_question_ids:
+        if q_id1 not in embeddings or q_id1 in node_to_group_map:
+            continue
+        current_group = [q_id1]
+        node_to_group_map[q_id1] = current_group
+        for q_id2 in sorted_question_ids:
+            if q_id1 == q_id2 or q_id2 not in embeddings or q_id2 in node_to_group_map:
+                continue
+            if calculate_cosine_similarity(embeddings[q_id1], embeddings[q_id2]) >= SIMILARITY_THRESHOLD:
+                current_group.append(q_id2)
+                node_to_group_map[q_id2] = current_group
+        groups.append(current_group)
+    return groups
+
+
+def legacy_assemble(nodes: List[GraphNode], links: List[GraphLink], groups: List[List[str]]) -> Tuple[List[GraphNode], List[GraphLink]]:
+    question_nodes_data = [node for node in nodes if node.type == "user_question"]
+    final_nodes: List[GraphNode] = []
+    final_links: List[GraphLink] = []
+    integrated_node_replacements: Dict[str, str] = {}
+
+    for group_index, group in enumerate(groups):
+        if len(group) > 1:
+            representative_node_data = next(node for node in question_nodes_data if node.id == group[0])
+            integrated_node_id = f"integrated_question_group_{representative_node_data.summary_id}_{group_index}"
+            original_questions_details_list = []
+            for original_q_id in group:
+                original_node = next(node for node in question_nodes_data if node.id == original_q_id)
+                original_questions_details_list.append({
+                    "id": original_node.id, "label": original_node.label, "question_id": original_node.question_id,
+                    "ai_answer": original_node.ai_answer, "ai_answer_summary": original_node.ai_answer_summary,
+                })
+            final_nodes.append(GraphNode(
+                id=integrated_node_id, label=f"類似質問 ({len(group)}件): {representative_node_data.label}",
+                type="user_question_group", summary_id=representative_node_data.summary_id, question_id=integrated_node_id,
+                ai_answer=representative_node_data.ai_answer, ai_answer_summary=representative_node_data.ai_answer_summary,
+                question_created_at=representative_node_data.question_created_at, category=representative_node_data.category,
+                grouped_question_ids=group, original_questions_details=original_questions_details_list,
+            ))
+            for original_q_id in group:
+                integrated_node_replacements[original_q_id] = integrated_node_id
+        else:
+            final_nodes.append(next(node for node in question_nodes_data if node.id == group[0]))
+
+    for node in nodes:
+        if node.type != "user_question":
+            final_nodes.append(node)
+
+    for link in links:
+        source_id = integrated_node_replacements.get(link.source, link.source)
+        target_id = integrated_node_replacements.get(link.target, link.target)
+        if source_id == target_id:
+            continue
+        if not any(fl.source == source_id and fl.target == target_id and fl.type == link.type for fl in final_links):
+            final_links.append(GraphLink(source=source_id, target=target_id, type=link.type, directed=link.directed))
+    return final_nodes, final_links
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--legacy-max-nodes", type=int, default=10000)
+    parser.add_argument("--legacy-max-questions", type=int, default=1000)
+    args = parser.parse_args()
+    torch.set_num_threads(max(1, os.cpu_count() or 1))
+
+    for node_count in args.nodes:
+        nodes, links, groups, embeddings = make_graph(node_count)
+        sorted_question_ids = [node.id for node in sorted((n for n in nodes if n.type == "user_question"), key=lambda n: n.question_created_at)]
+        print(f"== {len(nodes)} nodes, {len(links)} links, {len(sorted_question_ids)} questions")
+
+        new_groups, elapsed = timed(cluster_similar_questions, sorted_question_ids, embeddings)
+        print(f"clustering new    : {elapsed * 1000:10.1f} ms ({sum(len(g) > 1 for g in new_groups)} merged groups)")
+        if len(sorted_question_ids) <= args.legacy_max_questions:
+            old_groups, elapsed = timed(legacy_cluster, sorted_question_ids, embeddings)
+            print(f"clustering legacy : {elapsed * 1000:10.1f} ms (same groups: {old_groups == new_groups})")
+        else:
+            print("clustering legacy :    skipped")
+
+        graph, elapsed = timed(assemble_graph, nodes, links, new_groups)
+        graph_data = graph.to_graph_data()
+        print(f"assembly new      : {elapsed * 1000:10.1f} ms ({len(graph_data.nodes)} nodes, {len(graph_data.links)} links)")
+        if node_count <= args.legacy_max_nodes:
+            (old_nodes, old_links), elapsed = timed(legacy_assemble, nodes, links, new_groups)
+            same = ([n.id for n in old_nodes] == [n.id for n in graph_data.nodes]
+                    and [(l.source, l.target, l.type) for l in old_links] == [(l.source, l.target, l.type) for l in graph_data.links])
+            print(f"assembly legacy   : {elapsed * 1000:10.1f} ms (same result: {same})")
+        else:
+            print("assembly legacy   :    skipped")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""グラフエンドポイントのノードごとのログ出力にかかるコストの比較
+
+before: logging.DEBUG をグローバルに設定し、全ノードを f-string で INFO 出力（旧実装）
+after:  configure_logging()（INFO、キュー経由）で、DEBUG ログをレベル判定とサンプリングで抑制（現実装）
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_graph_logging.py --nodes 5000 --repeat 20
+"""
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@dataclass
+class FakeNode:
+    id: str
+    label: str
+    type: str
+    grouped_question_ids: Optional[List[str]] = field(default=None)
+
+
+def make_nodes(count: int) -> List[FakeNode]:
+    return [
+        FakeNode(
+            id=f"question_{i // 20}_カテゴリ_{i % 20}",
+            label=f"質問 {i}: この論文の手法は既存手法と比べてどのような利点がありますか？",
+            type="user_question",
+            grouped_question_ids=[f"question_{i // 20}_カテゴリ_{j}" for j in range(i % 3)] or None,
+        )
+        for i in range(count)
+    ]
+
+
+def run_before(nodes: List[FakeNode], repeat: int) -> float:
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s', stream=open(os.devnull, "w"))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        logging.info(f"Generated final nodes count: {len(nodes)}")
+        for node in nodes:
+            logging.info(f"  Node: id={node.id}, label={node.label}, type={node.type}, grouped_question_ids={node.grouped_question_ids}")
+    return time.perf_counter() - started
+
+
+def run_after(nodes: List[FakeNode], repeat: int) -> float:
+    os.environ.setdefault("LOG_LEVEL", "INFO")
+    from logging_config import configure_logging, LogSampler
+
+    configure_logging()
+    logger = logging.getLogger("main")
+    started = time.perf_counter()
+    for _ in range(repeat):
+        logger.debug("Generated final nodes count: %s", len(nodes))
+        if logger.isEnabledFor(logging.DEBUG):
+            sampler = LogSampler(first=20, every=100)
+            for node in nodes:
+                if sampler.sample():
+                    logger.debug("  Node: id=%s, label=%s, type=%s, grouped_question_ids=%s", node.id, node.label, node.type, node.grouped_question_ids)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--variant", choices=["before", "after"])
+    args = parser.parse_args()
+
+    if args.variant:
+        nodes = make_nodes(args.nodes)
+        elapsed = run_before(nodes, args.repeat) if args.variant == "before" else run_after(nodes, args.repeat)
+        print(f"{elapsed:.6f}")
+        return
+
+    # ロギング設定はプロセス全体に効くので、variant ごとに別プロセスで計測する
+    results = {}
+    for variant in ("before", "after"):
+        output = subprocess.run(
+            [sys.executable, __file__, "--variant", variant, "--nodes", str(args.nodes), "--repeat", str(args.repeat)],
+            check=True, capture_output=True, text=True, env={**os.environ, "LOG_LEVEL": "INFO"},
+        ).stdout.strip().splitlines()[-1]
+        results[variant] = float(output)
+
+    per_request_before = results["before"] / args.repeat * 1000
+    per_request_after = results["after"] / args.repeat * 1000
+    print(f"nodes={args.nodes} repeat={args.repeat}")
+    print(f"before: {per_request_before:.3f} ms per graph request")
+    print(f"after:  {per_request_after:.3f} ms per graph request")
+    if per_request_after > 0:
+        print(f"speedup: {per_request_before / per_request_after:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
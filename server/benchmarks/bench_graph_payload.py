@@ -0,0 +1,132 @@
+"""グラフレスポンスのシリアライズ時間とペイロードサイズの比較
+
+- stdlib json: FastAPI 既定の経路（jsonable_encoder で datetime を文字列化してから json.dumps）に相当
+- orjson:      responses.ORJSONModelResponse と同じ経路
+- 圧縮:        gzip（level 6）と brotli（quality 4、インストールされている場合）
+- lean:        ?detail=lean（回答本文を省いたグラフ）と、/api/graph/nodes でノード20件分の回答を取得した場合
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_graph_payload.py --questions 1000 5000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import orjson
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from synthetic_graph import make_graph  # noqa: E402
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _encode_datetime(dt: datetime) -> str:
+    return dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _jsonable(obj):
+    # jsonable_encoder と同様に、オブジェクトを再帰的にたどって JSON 互換の値に変換する
+    if isinstance(obj, dict):
+        return {key: _jsonable(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_jsonable(value) for value in obj]
+    if isinstance(obj, datetime):
+        return _encode_datetime(obj)
+    return obj
+
+
+def stdlib_dumps(graph) -> bytes:
+    return json.dumps(_jsonable(graph), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def orjson_dumps(graph) -> bytes:
+    def default(obj):
+        if isinstance(obj, datetime):
+            return _encode_datetime(obj)
+        raise TypeError
+    return orjson.dumps(graph, default=default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+LEAN_NODE_EXCLUDE = {"ai_answer", "ai_answer_summary"}
+LEAN_QUESTION_DETAIL_FIELDS = ("id", "label", "question_id")
+
+
+def lean_graph(graph):
+    # main._lean_graph_payload と同じ変換（回答本文と None のフィールドを除く）
+    nodes = []
+    for node in graph["nodes"]:
+        lean_node = {key: value for key, value in node.items() if value is not None and key not in LEAN_NODE_EXCLUDE}
+        if node.get("original_questions_details"):
+            lean_node["original_questions_details"] = [
+                {key: question[key] for key in LEAN_QUESTION_DETAIL_FIELDS if question.get(key) is not None}
+                for question in node["original_questions_details"]
+            ]
+        nodes.append(lean_node)
+    links = [{key: value for key, value in link.items() if value is not None} for link in graph["links"]]
+    return {"nodes": nodes, "links": links}
+
+
+def node_details(graph, count: int):
+    # /api/graph/nodes のレスポンス（質問ノード count 件分）
+    questions = [node for node in graph["nodes"] if node["type"] == "user_question"][:count]
+    return [
+        {"id": node["id"], "label": node["label"], "ai_answer": node["ai_answer"],
+         "ai_answer_summary": node["ai_answer_summary"], "history_content_id": node["history_content_id"]}
+        for node in questions
+    ]
+
+
+def compressed_size(raw: bytes) -> str:
+    sizes = [f"gzip {len(gzip.compress(raw, compresslevel=6)) / 1024:.1f} KiB"]
+    if brotli is not None:
+        sizes.append(f"br {len(brotli.compress(raw, quality=4)) / 1024:.1f} KiB")
+    return ", ".join(sizes)
+
+
+def best_of(func, arg, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, nargs="+", default=[1000, 5000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for question_count in args.questions:
+        graph = make_graph(question_count)
+        raw = orjson_dumps(graph)
+        print(f"== {question_count} questions, {len(graph['nodes'])} nodes, {len(graph['links'])} links")
+        print(f"serialize stdlib json : {best_of(stdlib_dumps, graph, args.repeat) * 1000:8.1f} ms")
+        print(f"serialize orjson      : {best_of(orjson_dumps, graph, args.repeat) * 1000:8.1f} ms")
+        print(f"payload raw           : {len(raw) / 1024:8.1f} KiB")
+        started = time.perf_counter()
+        gzipped = gzip.compress(raw, compresslevel=6)
+        print(f"payload gzip          : {len(gzipped) / 1024:8.1f} KiB ({(time.perf_counter() - started) * 1000:.1f} ms)")
+        if brotli is not None:
+            started = time.perf_counter()
+            compressed = brotli.compress(raw, quality=4)
+            print(f"payload brotli        : {len(compressed) / 1024:8.1f} KiB ({(time.perf_counter() - started) * 1000:.1f} ms)")
+
+        lean = lean_graph(graph)
+        lean_raw = orjson_dumps(lean)
+        print(f"lean serialize orjson : {best_of(orjson_dumps, lean, args.repeat) * 1000:8.1f} ms")
+        print(f"lean payload raw      : {len(lean_raw) / 1024:8.1f} KiB ({compressed_size(lean_raw)})")
+        details_raw = orjson_dumps(node_details(graph, 20))
+        print(f"node details x20      : {len(details_raw) / 1024:8.1f} KiB ({compressed_size(details_raw)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""ログインが集中しているときの、他のリクエストのレイテンシの比較
+
+- inline:   イベントループ上で pwd_context.verify を直接呼ぶ（旧 login の経路）
+- executor: passwords.verify_password（専用のスレッドプール）
+
+--logins 件のログインを同時に処理している間、軽いエンドポイントに相当する処理（DB などを待たずにすぐ返す）を
+--interval-ms ごとに実行し、開始を予定した時刻から完了までの時間の p50 / p95 / p99 を出力する。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_login_storm.py --logins 50 --rounds 12
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def unrelated_requests(stop: asyncio.Event, interval: float, latencies: List[float]):
+    loop = asyncio.get_running_loop()
+    scheduled = loop.time()
+    while not stop.is_set():
+        scheduled += interval
+        await asyncio.sleep(max(0.0, scheduled - loop.time()))
+        # 予定した時刻からの遅れ = イベントループが他の処理で止まっていた時間
+        latencies.append(loop.time() - scheduled)
+
+
+async def run(mode: str, logins: int, interval: float, password: str, hashed: str):
+    import passwords
+
+    async def login_inline():
+        passwords.pwd_context.verify(password, hashed)
+        await asyncio.sleep(0)
+
+    async def login_executor():
+        await passwords.verify_password(password, hashed)
+
+    login = login_inline if mode == "inline" else login_executor
+    stop = asyncio.Event()
+    latencies: List[float] = []
+    ticker = asyncio.create_task(unrelated_requests(stop, interval, latencies))
+    started = time.perf_counter()
+    await asyncio.gather(*[login() for _ in range(logins)])
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    args = parser.parse_args()
+
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    import passwords
+
+    password = "correct horse battery staple"
+    hashed = passwords.pwd_context.hash(password)
+    print(f"== {args.logins} concurrent logins, bcrypt rounds {args.rounds}, {passwords.PASSWORD_HASH_WORKERS} hash workers")
+    for mode in ("inline", "executor"):
+        elapsed, latencies = asyncio.run(run(mode, args.logins, args.interval_ms / 1000, password, hashed))
+        latencies_ms = [latency * 1000 for latency in latencies] or [0.0]
+        print(f"{mode:<9}: logins done in {elapsed * 1000:8.0f} ms | unrelated requests ({len(latencies)}) "
+              f"p50 {statistics.median(latencies_ms):7.1f} ms  p95 {percentile(latencies_ms, 0.95):7.1f} ms  "
+              f"p99 {percentile(latencies_ms, 0.99):7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
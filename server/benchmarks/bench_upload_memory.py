@@ -0,0 +1,83 @@
+"""アップロード受信時のピークメモリの比較（同時アップロード）
+
+- legacy:    await file.read() で全体を読み込み、base64 文字列に変換する（旧 upload_pdf の経路）
+- streaming: uploads.read_upload でチャンク単位に読み込み、sha256 を計算する
+- oversize:  上限を超えるファイル。streaming は上限に達した時点で読み込みをやめる
+
+multipart のパーサーと同様に SpooledTemporaryFile に書き出したファイルを UploadFile として渡し、
+--concurrency 件を同時に読み込んだときの Python ヒープのピーク（tracemalloc）を計測する。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/bench_upload_memory.py --size-mb 10 --concurrency 1 8 32
+"""
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import tracemalloc
+from tempfile import SpooledTemporaryFile
+
+from starlette.datastructures import UploadFile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import uploads  # noqa: E402
+
+SPOOL_MAX_SIZE = 1024 * 1024 # starlette の MultiPartParser と同じ
+
+
+def make_upload(payload: bytes, with_size: bool = True) -> UploadFile:
+    spooled = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    spooled.write(payload)
+    spooled.seek(0)
+    return UploadFile(file=spooled, size=len(payload) if with_size else None, filename="paper.pdf")
+
+
+async def legacy_read(file: UploadFile, max_size: int):
+    content = await file.read()
+    if len(content) > max_size:
+        raise uploads.UploadTooLarge(file.filename, max_size)
+    return content, base64.b64encode(content).decode("utf-8")
+
+
+async def streaming_read(file: UploadFile, max_size: int):
+    return await uploads.read_upload(file, max_size=max_size)
+
+
+async def run(reader, payload: bytes, concurrency: int, max_size: int, with_size: bool) -> int:
+    files = [make_upload(payload, with_size) for _ in range(concurrency)]
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    results = await asyncio.gather(*[reader(file, max_size) for file in files], return_exceptions=True)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    for file in files:
+        await file.close()
+    del results
+    return peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size-mb", type=float, default=10)
+    parser.add_argument("--max-size-mb", type=float, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    args = parser.parse_args()
+
+    payload = os.urandom(int(args.size_mb * 1024 * 1024))
+    oversize_payload = os.urandom(int(args.max_size_mb * 2 * 1024 * 1024))
+    max_size = int(args.max_size_mb * 1024 * 1024)
+
+    for concurrency in args.concurrency:
+        print(f"== {concurrency} concurrent uploads of {args.size_mb:.0f}MB (limit {args.max_size_mb:.0f}MB)")
+        for name, reader in (("legacy", legacy_read), ("streaming", streaming_read)):
+            peak = asyncio.run(run(reader, payload, concurrency, max_size, with_size=True))
+            print(f"{name:<10}: peak {peak / (1024 * 1024):8.1f} MB")
+        for name, reader in (("legacy", legacy_read), ("streaming", streaming_read)):
+            # size が分からない場合（チャンク転送など）も、streaming は上限に達した時点で打ち切る
+            peak = asyncio.run(run(reader, oversize_payload, concurrency, max_size, with_size=False))
+            print(f"{name:<10}: peak {peak / (1024 * 1024):8.1f} MB (oversize {args.max_size_mb * 2:.0f}MB, size unknown)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""負荷試験のドライバー（asyncio + httpx。locust が無くても同じシナリオを流せる）
+
+seed_loadtest.py が書き出したユーザーの一覧から --users 人がログインし、loadtest_scenarios のシナリオで
+--duration 秒の間リクエストを送り続ける。エンドポイントごとの件数・エラー数・スループットと、レイテンシの p50 / p95 / p99 を出力する。
+
+--output に結果の JSON を保存し、次回 --baseline にその JSON を指定すると、p95 が --max-regression（割合）を超えて
+悪化したか、スループットが同じ割合を超えて下がったエンドポイントを表示して終了コード 1 で終わる（CI で退行を検知する）。
+
+サーバーは loadtest_server.py（Gemini と埋め込みモデルを差し替えたもの）で起動しておく。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/loadtest.py --users 50 --duration 60 --output benchmarks/loadtest_result.json
+    python benchmarks/loadtest.py --users 50 --duration 60 --baseline benchmarks/loadtest_result.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from typing import Any, Dict, List
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest_scenarios import next_request
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+async def login(client: httpx.AsyncClient, username: str, password: str) -> str:
+    for attempt in range(10):
+        response = await client.post("/api/login", json={"username": username, "password": password})
+        if response.status_code != 429:
+            response.raise_for_status()
+            return response.json()["access_token"]
+        await asyncio.sleep(0.2 * (attempt + 1))
+    raise RuntimeError(f"login for {username} kept being rate limited")
+
+
+async def virtual_user(client: httpx.AsyncClient, user: Dict[str, Any], token: str, deadline: float, think: float,
+                       seed: int, latencies: Dict[str, List[float]], errors: Dict[str, int]):
+    rng = random.Random(seed)
+    headers = {"Authorization": f"Bearer {token}"}
+    while time.monotonic() < deadline:
+        planned = next_request(rng, user)
+        started = time.perf_counter()
+        try:
+            response = await client.request(planned.method, planned.path, params=planned.params, json=planned.json, headers=headers)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        if ok:
+            latencies[planned.name].append(time.perf_counter() - started)
+        else:
+            errors[planned.name] += 1
+        if think > 0:
+            await asyncio.sleep(rng.uniform(0, 2 * think))
+
+
+def summarize(latencies: Dict[str, List[float]], errors: Dict[str, int], elapsed: float) -> Dict[str, Dict[str, float]]:
+    report = {}
+    everything = [value for values in latencies.values() for value in values]
+    for name, values in sorted(latencies.items()) + [("TOTAL", everything)]:
+        error_count = sum(errors.values()) if name == "TOTAL" else errors.get(name, 0)
+        report[name] = {
+            "requests": len(values),
+            "errors": error_count,
+            "rps": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000 if values else 0.0,
+            "p95_ms": percentile(values, 0.95) * 1000 if values else 0.0,
+            "p99_ms": percentile(values, 0.99) * 1000 if values else 0.0,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Dict[str, float]]):
+    print(f"{'endpoint':<42} {'requests':>8} {'errors':>7} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in report.items():
+        print(f"{name:<42} {row['requests']:>8} {row['errors']:>7} {row['rps']:>8.1f} "
+              f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} {row['p99_ms']:>9.1f}")
+
+
+def regressions(report: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], max_regression: float) -> List[str]:
+    found = []
+    for name, before in baseline.items():
+        after = report.get(name)
+        if after is None or not before["requests"]:
+            continue
+        if after["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            found.append(f"{name}: p95 {before['p95_ms']:.1f} ms -> {after['p95_ms']:.1f} ms")
+        if after["rps"] < before["rps"] * (1 - max_regression):
+            found.append(f"{name}: throughput {before['rps']:.1f} -> {after['rps']:.1f} req/s")
+    return found
+
+
+async def main(args) -> int:
+    with open(args.users_file, encoding="utf-8") as f:
+        manifest = json.load(f)
+    users = manifest["users"][:args.users]
+
+    limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=120, limits=limits) as client:
+        # ログイン（bcrypt）は計測に含めない
+        tokens = [await login(client, user["username"], manifest["password"]) for user in users]
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        errors: Dict[str, int] = defaultdict(int)
+        if args.warmup > 0:
+            deadline = time.monotonic() + args.warmup
+            await asyncio.gather(*[
+                virtual_user(client, user, token, deadline, args.think_ms / 1000, args.seed + index, defaultdict(list), defaultdict(int))
+                for index, (user, token) in enumerate(zip(users, tokens))
+            ])
+
+        started = time.perf_counter()
+        deadline = time.monotonic() + args.duration
+        await asyncio.gather(*[
+            virtual_user(client, user, token, deadline, args.think_ms / 1000, args.seed + index, latencies, errors)
+            for index, (user, token) in enumerate(zip(users, tokens))
+        ])
+        elapsed = time.perf_counter() - started
+
+    report = summarize(latencies, errors, elapsed)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            found = regressions(report, json.load(f), args.max_regression)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765")
+    parser.add_argument("--users-file", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_users.json"))
+    parser.add_argument("--users", type=int, default=50, help="同時に動かす利用者の数")
+    parser.add_argument("--duration", type=float, default=60)
+    parser.add_argument("--warmup", type=float, default=10)
+    parser.add_argument("--think-ms", type=float, default=0, help="リクエストの間隔の平均（0 なら間を空けない）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--baseline", default=None)
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    sys.exit(asyncio.run(main(parser.parse_args())))
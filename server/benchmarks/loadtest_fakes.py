@@ -0,0 +1,113 @@
+"""負荷試験用の Gemini クライアントと埋め込みモデルの代わり
+
+- FakeGenaiClient: genai.Client と同じ client.aio.models.generate_content を持ち、FAKE_GEMINI_LATENCY_MS（± JITTER）
+  待ってから、プロンプトから決まる応答を返す（API キーもネットワークも使わない）
+- FakeSentenceTransformer: 文字の bigram をハッシュして次元に割り振る決定的な埋め込み。同じテキストは常に同じベクトルになり、
+  文字が重なるテキストほど類似度が高い。FAKE_EMBEDDING_COST_MS でテキスト1件あたりの CPU 時間を模擬できる
+
+install() を main.py の import より前に呼ぶと、main.py はこれらを使う。
+"""
+import asyncio
+import hashlib
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, List, Optional, Union
+
+import numpy as np
+import torch
+
+FAKE_GEMINI_LATENCY_MS = float(os.getenv("FAKE_GEMINI_LATENCY_MS", "800"))
+FAKE_GEMINI_JITTER_MS = float(os.getenv("FAKE_GEMINI_JITTER_MS", "200"))
+FAKE_EMBEDDING_DIM = int(os.getenv("FAKE_EMBEDDING_DIM", "768"))
+FAKE_EMBEDDING_COST_MS = float(os.getenv("FAKE_EMBEDDING_COST_MS", "0"))
+
+CATEGORIES = ["手法", "実験", "データセット", "評価", "関連研究", "応用"]
+
+
+@dataclass
+class FakeResponse:
+    text: str
+    candidates: Optional[list] = None
+
+
+def _prompt_text(contents: Any) -> str:
+    if isinstance(contents, str):
+        return contents
+    if isinstance(contents, dict):
+        return "".join(_prompt_text(value) for key, value in contents.items() if key in ("parts", "text"))
+    if isinstance(contents, (list, tuple)):
+        return "".join(_prompt_text(item) for item in contents)
+    return ""
+
+
+def fake_reply(prompt: str) -> str:
+    digest = hashlib.sha256(prompt.encode("utf-8")).digest()
+    if "カテゴリ名" in prompt:
+        return CATEGORIES[digest[0] % len(CATEGORIES)]
+    sentences = [f"要点{index + 1}: 負荷試験用の応答です（{digest[index]:02x}）。" for index in range(3)]
+    if "タグ" in prompt:
+        sentences.append(f"タグ: {CATEGORIES[digest[3] % len(CATEGORIES)]}, 負荷試験")
+    return "\n".join(sentences)
+
+
+class _FakeModels:
+    async def generate_content(self, model: str, contents: Any, **kwargs) -> FakeResponse:
+        latency = max(0.0, random.gauss(FAKE_GEMINI_LATENCY_MS, FAKE_GEMINI_JITTER_MS)) / 1000
+        await asyncio.sleep(latency)
+        return FakeResponse(text=fake_reply(_prompt_text(contents)))
+
+
+class _FakeAio:
+    def __init__(self):
+        self.models = _FakeModels()
+
+
+class FakeGenaiClient:
+    def __init__(self, api_key: Optional[str] = None, **kwargs):
+        self.aio = _FakeAio()
+
+
+def _busy_wait(seconds: float):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+class FakeSentenceTransformer:
+    def __init__(self, model_name: str = "fake", *args, **kwargs):
+        self.model_name = model_name
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return FAKE_EMBEDDING_DIM
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(FAKE_EMBEDDING_DIM, dtype=np.float32)
+        padded = f" {text} "
+        for index in range(len(padded) - 1):
+            digest = hashlib.blake2b(padded[index:index + 2].encode("utf-8"), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % FAKE_EMBEDDING_DIM
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def encode(self, sentences: Union[str, List[str]], convert_to_tensor: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if FAKE_EMBEDDING_COST_MS > 0:
+            _busy_wait(FAKE_EMBEDDING_COST_MS * len(texts) / 1000)
+        matrix = np.stack([self._embed(text) for text in texts]) if texts else np.zeros((0, FAKE_EMBEDDING_DIM), dtype=np.float32)
+        if single:
+            matrix = matrix[0]
+        return torch.from_numpy(matrix) if convert_to_tensor else matrix
+
+
+def install():
+    """google.genai.Client と sentence_transformers.SentenceTransformer を差し替える（main.py の import より前に呼ぶ）"""
+    from google import genai
+    import sentence_transformers
+
+    genai.Client = FakeGenaiClient
+    sentence_transformers.SentenceTransformer = FakeSentenceTransformer
+    os.environ.setdefault("GEMINI_API_KEY", "loadtest-fake-key")
@@ -0,0 +1,73 @@
+"""負荷試験のシナリオ（loadtest.py と locustfile.py で共通）
+
+ログイン済みの利用者1人が送るリクエストを、WEIGHTS の比率で1件ずつ選ぶ。利用者は seed_loadtest.py が書き出した
+ユーザーの一覧の1件（username, team_ids, summary_ids）で、要約・チームはその利用者が閲覧できるものから選ぶ。
+"""
+import random
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+# エンドポイント（name）ごとの比率。読み取りが中心で、Gemini を呼ぶチャットと書き込みを混ぜる
+WEIGHTS = {
+    "GET /api/summaries": 25,
+    "GET /api/summary-tree-graph": 8,
+    "GET /api/summary-tree-graph?detail=lean": 8,
+    "POST /api/chat": 12,
+    "GET /api/summaries/{id}/comments": 15,
+    "POST /api/comments": 5,
+    "GET /api/teams/{id}/messages": 20,
+    "POST /api/teams/{id}/messages": 7,
+}
+CHAT_QUESTIONS = ["この論文の提案手法を一文で説明してください", "実験の設定の要点は何ですか", "評価指標は何が使われていますか"]
+
+
+@dataclass
+class PlannedRequest:
+    name: str # 集計の単位（パスの ID を {id} にしたもの）
+    method: str
+    path: str
+    params: Dict[str, Any] = field(default_factory=dict)
+    json: Optional[Dict[str, Any]] = None
+
+
+def next_request(rng: random.Random, user: Dict[str, Any]) -> PlannedRequest:
+    names = list(WEIGHTS)
+    while True:
+        name = rng.choices(names, weights=[WEIGHTS[n] for n in names])[0]
+        planned = _plan(rng, name, user)
+        if planned is not None:
+            return planned
+
+
+def _plan(rng: random.Random, name: str, user: Dict[str, Any]) -> Optional[PlannedRequest]:
+    summary_ids = user["summary_ids"]
+    team_ids = user["team_ids"]
+    if name == "GET /api/summaries":
+        return PlannedRequest(name, "GET", "/api/summaries")
+    if name == "GET /api/summary-tree-graph":
+        return PlannedRequest(name, "GET", "/api/summary-tree-graph")
+    if name == "GET /api/summary-tree-graph?detail=lean":
+        return PlannedRequest(name, "GET", "/api/summary-tree-graph", params={"detail": "lean"})
+    if name == "POST /api/chat":
+        if not summary_ids:
+            return None
+        # 同じ質問の応答キャッシュを当てにしない計測にするため、質問に番号を付ける
+        message = f"{rng.choice(CHAT_QUESTIONS)}（{rng.randrange(10 ** 6)}）"
+        return PlannedRequest(name, "POST", "/api/chat", json={"message": message, "summary_id": rng.choice(summary_ids)})
+    if name == "GET /api/summaries/{id}/comments":
+        if not summary_ids:
+            return None
+        return PlannedRequest(name, "GET", f"/api/summaries/{rng.choice(summary_ids)}/comments")
+    if name == "POST /api/comments":
+        if not summary_ids:
+            return None
+        return PlannedRequest(name, "POST", "/api/comments", json={"summary_id": rng.choice(summary_ids), "content": "負荷試験のコメント"})
+    if name == "GET /api/teams/{id}/messages":
+        if not team_ids:
+            return None
+        return PlannedRequest(name, "GET", f"/api/teams/{rng.choice(team_ids)}/messages", params={"limit": 50})
+    if name == "POST /api/teams/{id}/messages":
+        if not team_ids:
+            return None
+        return PlannedRequest(name, "POST", f"/api/teams/{rng.choice(team_ids)}/messages", json={"content": "負荷試験のメッセージ"})
+    raise ValueError(name)
@@ -0,0 +1,51 @@
+"""負荷試験用のサーバー（Gemini と埋め込みモデルを loadtest_fakes の代わりに差し替えて main.py を起動する）
+
+DATABASE_URL は .env（または環境変数）のものを使う。seed_loadtest.py でデータを入れたデータベースを指定する。
+各ワーカーが自分のプロセスで差し替えてから main.py を import する（埋め込みサーバーは使わない）。
+Gemini を呼ぶエンドポイントの流量制限と、IP ごとのログインの同時実行数の上限（負荷は1つの IP から来る）は、
+環境変数で指定しない限り計測の邪魔にならない値にする。
+
+使い方（server ディレクトリで実行）:
+    FAKE_GEMINI_LATENCY_MS=800 python benchmarks/loadtest_server.py --workers 4 --port 8765
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+LOADTEST_ENV_DEFAULTS = {
+    "LLM_RATE_PER_CLIENT": "100000", "LLM_BURST_PER_CLIENT": "100000",
+    "LLM_RATE_PER_IP": "100000", "LLM_BURST_PER_IP": "100000",
+    "LLM_GLOBAL_RATE": "100000", "LLM_GLOBAL_BURST": "100000",
+    "LLM_MAX_CONCURRENCY": "100000",
+    "LOGIN_MAX_CONCURRENCY_PER_IP": "100000",
+}
+
+
+def create_app():
+    """uvicorn のファクトリー（ワーカーごとに呼ばれる）"""
+    sys.path.insert(0, SERVER_DIR)
+    import loadtest_fakes
+    loadtest_fakes.install()
+    from main import app
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    os.environ["EMBEDDING_SERVER_ENABLED"] = "0"
+    os.environ.pop("EMBEDDING_SERVER_SOCKET", None)
+    os.environ.setdefault("GEMINI_API_KEY", "loadtest-fake-key")
+    for name, value in LOADTEST_ENV_DEFAULTS.items():
+        os.environ.setdefault(name, value)
+    uvicorn.run("loadtest_server:create_app", factory=True, app_dir=BENCHMARKS_DIR,
+                host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,49 @@
+"""locust で負荷試験を行う場合のシナリオ（loadtest.py と同じリクエストの組み合わせ）
+
+locust は requirements.txt に含めていないので、別途 pip install locust する。
+ユーザーの一覧は LOADTEST_USERS_FILE（既定は benchmarks/loadtest_users.json）から読む。
+
+使い方（server ディレクトリで実行。サーバーは loadtest_server.py で起動しておく）:
+    locust -f benchmarks/locustfile.py --host http://127.0.0.1:8765 --headless -u 50 -r 10 -t 2m --csv benchmarks/locust
+"""
+import itertools
+import json
+import os
+import random
+import sys
+import time
+
+from locust import HttpUser, between, task
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from loadtest_scenarios import next_request
+
+USERS_FILE = os.getenv("LOADTEST_USERS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_users.json"))
+
+with open(USERS_FILE, encoding="utf-8") as f:
+    _manifest = json.load(f)
+_next_user = itertools.cycle(_manifest["users"])
+
+
+class TeamAppUser(HttpUser):
+    wait_time = between(0.5, 2)
+
+    def on_start(self):
+        self.user = next(_next_user)
+        self.rng = random.Random(self.user["username"])
+        for attempt in range(10):
+            with self.client.post("/api/login", json={"username": self.user["username"], "password": _manifest["password"]},
+                                  name="POST /api/login", catch_response=True) as response:
+                if response.status_code == 429:
+                    response.success() # 同じ IP からのログインの同時実行数の制限。少し待って再試行する
+                    time.sleep(0.2 * (attempt + 1))
+                    continue
+                self.client.headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+                return
+        raise RuntimeError(f"login for {self.user['username']} kept being rate limited")
+
+    @task
+    def scenario(self):
+        planned = next_request(self.rng, self.user)
+        self.client.request(planned.method, planned.path, params=planned.params, json=planned.json, name=planned.name)
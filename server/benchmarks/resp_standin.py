@@ -0,0 +1,113 @@
+"""cache.RespDriver の確認用に、同じプロセス内で動かす Redis プロトコル（RESP2）の簡易サーバー
+
+cache.py が使うコマンド（PING / AUTH / SELECT / GET / SET [PX ms] [NX] / DEL / PUBLISH / SUBSCRIBE）だけを実装する。
+データはメモリ上の dict で、永続化やレプリケーションは無い。
+
+    server = RespStandIn()
+    await server.start()          # server.port に接続する
+    ...
+    await server.stop()
+"""
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _array(items: List[bytes]) -> bytes:
+    return b"*%d\r\n" % len(items) + b"".join(items)
+
+
+class RespStandIn:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self.commands = 0
+        self._data: Dict[bytes, Tuple[Optional[float], bytes]] = {}
+        self._subscribers: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> List[bytes]:
+        header = await reader.readuntil(b"\r\n")
+        if not header.startswith(b"*"):
+            raise ConnectionError("inline commands are not supported")
+        args = []
+        for _ in range(int(header[1:-2])):
+            length = int((await reader.readuntil(b"\r\n"))[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                args = await self._read_command(reader)
+                self.commands += 1
+                writer.write(self._execute(args, writer))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for subscribers in self._subscribers.values():
+                subscribers.discard(writer)
+            writer.close()
+
+    def _execute(self, args: List[bytes], writer: asyncio.StreamWriter) -> bytes:
+        command = args[0].upper()
+        if command in (b"PING", b"AUTH", b"SELECT"):
+            return b"+PONG\r\n" if command == b"PING" else b"+OK\r\n"
+        if command == b"GET":
+            return _bulk(self._get(args[1]))
+        if command == b"SET":
+            key, value, options = args[1], args[2], [arg.upper() for arg in args[3:]]
+            if b"NX" in options and self._get(key) is not None:
+                return _bulk(None)
+            expires_at = None
+            if b"PX" in options:
+                expires_at = time.monotonic() + int(options[options.index(b"PX") + 1]) / 1000
+            self._data[key] = (expires_at, value)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            removed = sum(1 for key in args[1:] if self._data.pop(key, None) is not None)
+            return b":%d\r\n" % removed
+        if command == b"PUBLISH":
+            channel, message = args[1], args[2]
+            payload = _array([_bulk(b"message"), _bulk(channel), _bulk(message)])
+            for subscriber in list(self._subscribers[channel]):
+                subscriber.write(payload)
+            return b":%d\r\n" % len(self._subscribers[channel])
+        if command == b"SUBSCRIBE":
+            replies = []
+            for channel in args[1:]:
+                self._subscribers[channel].add(writer)
+                replies.append(_array([_bulk(b"subscribe"), _bulk(channel), b":%d\r\n" % len(self._subscribers[channel])]))
+            return b"".join(replies)
+        return b"-ERR unknown command '%s'\r\n" % command
@@ -0,0 +1,212 @@
+"""負荷試験用の合成データを Postgres に入れる
+
+ユーザー・チーム・要約（個人とチーム）・AI チャットの履歴（質問の埋め込みと質問と回答のペア付き）・コメント・チームのメッセージを
+--scale の規模で作り、負荷試験のドライバーが使うユーザーの一覧（ユーザー名、パスワード、所属チーム、閲覧できる要約）を
+--output の JSON に書き出す。乱数のシードを固定しているので、同じ規模なら同じデータになる。
+埋め込みは loadtest_fakes.FakeSentenceTransformer で計算する（負荷試験のサーバーと同じ次元）。
+
+データは既存のデータと混ざらないよう、ユーザー名・チーム名に --prefix を付ける。同じ prefix のユーザーが既にいる場合は何もしない。
+main.py を一度起動してテーブルを作成済みのデータベースを DATABASE_URL に指定する。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/seed_loadtest.py --scale medium --output benchmarks/loadtest_users.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".env"))
+
+from synthetic_graph import ANSWER_SENTENCES
+
+
+@dataclass
+class Scale:
+    users: int
+    teams: int
+    members_per_team: int
+    summaries_per_user: int
+    team_summary_ratio: float # チームの要約として保存する割合
+    questions_per_summary: int
+    comments_per_summary: int
+    messages_per_team: int
+
+
+SCALES = {
+    "small": Scale(users=20, teams=4, members_per_team=5, summaries_per_user=5, team_summary_ratio=0.3,
+                   questions_per_summary=6, comments_per_summary=2, messages_per_team=50),
+    "medium": Scale(users=200, teams=20, members_per_team=10, summaries_per_user=10, team_summary_ratio=0.3,
+                    questions_per_summary=10, comments_per_summary=3, messages_per_team=300),
+    "large": Scale(users=1000, teams=100, members_per_team=12, summaries_per_user=20, team_summary_ratio=0.3,
+                   questions_per_summary=15, comments_per_summary=4, messages_per_team=1000),
+}
+QUESTION_TOPICS = ["提案手法", "実験の設定", "データセット", "評価指標", "関連研究", "計算量", "ハイパーパラメータ", "限界"]
+QUESTION_FORMS = ["{topic}について教えてください", "{topic}の要点は何ですか", "{topic}はどう説明されていますか", "{topic}の問題点は？"]
+CATEGORIES = ["手法", "実験", "データセット", "評価", "関連研究"]
+COMMIT_EVERY = 200
+
+
+def _chat_history(rng: random.Random, question_count: int, started_at: datetime) -> List[Dict[str, Any]]:
+    messages = []
+    for index in range(question_count):
+        asked_at = started_at + timedelta(minutes=2 * index)
+        question = rng.choice(QUESTION_FORMS).format(topic=rng.choice(QUESTION_TOPICS))
+        answer = "".join(rng.choice(ANSWER_SENTENCES).format(n=rng.randint(1, 10000)) for _ in range(rng.randint(2, 6)))
+        messages.append({"sender": "user", "text": question, "timestamp": asked_at.isoformat(), "category": rng.choice(CATEGORIES)})
+        messages.append({"sender": "ai", "text": answer, "timestamp": (asked_at + timedelta(seconds=5)).isoformat()})
+    return messages
+
+
+def _chat_rows(encoder, chat: List[Dict[str, Any]], summary_text: str):
+    import history_writes
+
+    # チャットは質問と回答が交互に並んでいる
+    questions = [(message, chat[index + 1]) for index, message in enumerate(chat) if message["sender"] == "user"]
+    # main._prepare_chat_history_rows と同じく、質問・回答・要約を結合したテキストの埋め込みの平均を保存する
+    texts = [f"質問: {question['text']} 回答: {answer['text']} 要約: {summary_text}" for question, answer in questions]
+    embedding = encoder.encode(texts).mean(axis=0) if texts else None
+    pairs = [
+        {
+            "position": position,
+            "question": question["text"],
+            "answer": answer["text"],
+            "category": question["category"],
+            "asked_at": datetime.fromisoformat(question["timestamp"]),
+        }
+        for position, (question, answer) in enumerate(questions)
+    ]
+    return history_writes.ChatHistoryRows(
+        content=json.dumps(chat, ensure_ascii=False),
+        embedding=json.dumps(embedding.tolist()) if embedding is not None else None,
+        ai_summary="負荷試験用の回答の要約です。",
+        question_answer_pairs=pairs,
+    )
+
+
+def seed(scale: Scale, prefix: str, password: str, seed_value: int) -> Optional[Dict[str, Any]]:
+    import history_writes
+    import passwords
+    from database import Comment, Message, SessionLocal, Team, TeamMember, User
+    from loadtest_fakes import FakeSentenceTransformer
+
+    rng = random.Random(seed_value)
+    encoder = FakeSentenceTransformer()
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    db = SessionLocal()
+    try:
+        if db.query(User.id).filter(User.username == f"{prefix}-user-0").first() is not None:
+            print(f"users with prefix {prefix!r} already exist; use another --prefix or a fresh database")
+            return None
+
+        # bcrypt は遅いので、全員同じパスワードのハッシュを使い回す
+        hashed = passwords.pwd_context.hash(password)
+        users = [User(username=f"{prefix}-user-{index}", hashed_password=hashed) for index in range(scale.users)]
+        db.add_all(users)
+        db.flush()
+        teams = [Team(name=f"{prefix}-team-{index}", created_by_user_id=users[index % len(users)].id) for index in range(scale.teams)]
+        db.add_all(teams)
+        db.flush()
+
+        team_ids_by_user: Dict[int, List[int]] = {user.id: [] for user in users}
+        for team in teams:
+            members = rng.sample(users, min(scale.members_per_team, len(users)))
+            if team.created_by_user_id not in {member.id for member in members}:
+                members[0] = next(user for user in users if user.id == team.created_by_user_id)
+            for member in members:
+                role = "admin" if member.id == team.created_by_user_id else "member"
+                db.add(TeamMember(user_id=member.id, team_id=team.id, role=role))
+                team_ids_by_user[member.id].append(team.id)
+        db.commit()
+
+        summary_ids_by_user: Dict[int, List[int]] = {user.id: [] for user in users}
+        team_summary_ids: Dict[int, List[int]] = {team.id: [] for team in teams}
+        written = 0
+        for user in users:
+            for index in range(scale.summaries_per_user):
+                created_at = base_time + timedelta(hours=rng.randint(0, 24 * 180))
+                user_teams = team_ids_by_user[user.id]
+                team_id = rng.choice(user_teams) if user_teams and rng.random() < scale.team_summary_ratio else None
+                summary_text = "".join(rng.choice(ANSWER_SENTENCES).format(n=rng.randint(1, 10000)) for _ in range(8))
+                chat = _chat_history(rng, scale.questions_per_summary, created_at)
+                summary_id = history_writes.insert_summary(db, {
+                    "user_id": user.id,
+                    "filename": f"論文{user.id}-{index}.pdf",
+                    "summary": summary_text,
+                    "team_id": team_id,
+                    "tags": ",".join(rng.sample(CATEGORIES, 2)),
+                    "original_file_path": None,
+                    "created_at": created_at,
+                    "parent_summary_id": None,
+                }, _chat_rows(encoder, chat, summary_text), created_at)
+                (team_summary_ids[team_id] if team_id else summary_ids_by_user[user.id]).append(summary_id)
+
+                commenters = [user] if team_id is None else [u for u in users if team_id in team_ids_by_user[u.id]]
+                history_writes.insert_rows(db, Comment, [
+                    {"summary_id": summary_id, "user_id": rng.choice(commenters).id, "content": f"コメント{n}: 参考になりました",
+                     "created_at": created_at + timedelta(hours=n + 1)}
+                    for n in range(scale.comments_per_summary)
+                ])
+                written += 1
+                if written % COMMIT_EVERY == 0:
+                    db.commit()
+                    print(f"  {written} summaries", flush=True)
+        db.commit()
+
+        for team in teams:
+            members = [user.id for user in users if team.id in team_ids_by_user[user.id]]
+            history_writes.insert_rows(db, Message, [
+                {"team_id": team.id, "user_id": rng.choice(members), "content": f"メッセージ{n}",
+                 "created_at": base_time + timedelta(minutes=n)}
+                for n in range(scale.messages_per_team)
+            ])
+        db.commit()
+
+        return {
+            "password": password,
+            "users": [
+                {
+                    "username": user.username,
+                    "team_ids": team_ids_by_user[user.id],
+                    "summary_ids": summary_ids_by_user[user.id]
+                    + [summary_id for team_id in team_ids_by_user[user.id] for summary_id in team_summary_ids[team_id]],
+                }
+                for user in users
+            ],
+        }
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--prefix", default=None, help="ユーザー名・チーム名の接頭辞（既定は lt-<scale>）")
+    parser.add_argument("--password", default="loadtest-password")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadtest_users.json"))
+    args = parser.parse_args()
+
+    scale = SCALES[args.scale]
+    started = time.perf_counter()
+    manifest = seed(scale, args.prefix or f"lt-{args.scale}", args.password, args.seed)
+    if manifest is None:
+        sys.exit(1)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    print(f"seeded {args.scale}: {scale.users} users, {scale.teams} teams, {scale.users * scale.summaries_per_user} summaries "
+          f"in {time.perf_counter() - started:.1f} s -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
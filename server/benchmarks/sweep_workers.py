@@ -0,0 +1,177 @@
+"""ワーカー数・ワーカークラスごとのスループットとレイテンシの計測（WEB_CONCURRENCY の既定値を決めるため）
+
+構成ごとに start_server.py（gunicorn）を起動し、--duration 秒の間 --concurrency 本の接続で負荷をかけて、
+スループットとレイテンシの p50 / p95 / p99 を出力する。負荷の種類は --mix で選ぶ。
+- embedding: GET /api/search（クエリの埋め込みが中心の CPU 負荷）
+- llm:       POST /api/chat（Gemini の応答待ちが中心の IO 負荷。プロンプトは毎回変え、応答キャッシュは使わない）
+- mixed:     両方を半分ずつ
+
+最後に、スループットが最大の構成の 95% 以上を出せる構成のうち、p95 が最も小さいもの（同じならワーカーの少ないもの）を勧める。
+DATABASE_URL・GEMINI_API_KEY などは .env（または環境変数）のものを使う。計測のあいだ LLM_* の流量制限は無効にする。
+llm / mixed は実際に Gemini を呼ぶので、クォータに注意する。
+
+使い方（server ディレクトリで実行）:
+    python benchmarks/sweep_workers.py --workers 1,2,4,8 --mix mixed --duration 30 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import httpx
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEARCH_WORDS = ["要約", "機械学習", "データベース", "設計", "テスト", "性能", "グラフ", "検索", "キャッシュ", "認証"]
+BENCH_USER = "sweep-bench-user"
+BENCH_PASSWORD = "sweep-bench-password"
+# 流量制限で断られないよう、計測中のサーバーに渡す値
+UNLIMITED_ADMISSION = {
+    "LLM_RATE_PER_CLIENT": "100000", "LLM_BURST_PER_CLIENT": "100000",
+    "LLM_RATE_PER_IP": "100000", "LLM_BURST_PER_IP": "100000",
+    "LLM_GLOBAL_RATE": "100000", "LLM_GLOBAL_BURST": "100000",
+    "LLM_MAX_CONCURRENCY": "100000",
+}
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+@dataclass
+class Result:
+    workers: int
+    worker_class: str
+    latencies: List[float] = field(default_factory=list)
+    errors: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        return len(self.latencies) / self.elapsed if self.elapsed else 0.0
+
+    def p(self, q: float) -> float:
+        return percentile(self.latencies, q) * 1000 if self.latencies else float("nan")
+
+
+def start_server(workers: int, worker_class: str, port: int) -> subprocess.Popen:
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers), GUNICORN_WORKER_CLASS=worker_class, PORT=str(port),
+               SERVER_RELOAD="0", EMBEDDING_SERVER_SOCKET="", **UNLIMITED_ADMISSION)
+    return subprocess.Popen([sys.executable, "start_server.py"], cwd=SERVER_DIR, env=env)
+
+
+def stop_server(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def wait_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 180):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            if (await client.get("/api/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.5)
+    raise RuntimeError("server did not become ready")
+
+
+async def access_token(client: httpx.AsyncClient) -> str:
+    await client.post("/api/register", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    response = await client.post("/api/login", json={"username": BENCH_USER, "password": BENCH_PASSWORD})
+    response.raise_for_status()
+    return response.json()["access_token"]
+
+
+async def one_request(client: httpx.AsyncClient, kind: str, headers: dict) -> httpx.Response:
+    if kind == "embedding":
+        query = " ".join(random.sample(SEARCH_WORDS, 2))
+        return await client.get("/api/search", params={"q": query}, headers=headers)
+    message = f"{random.choice(SEARCH_WORDS)}について一文で説明してください。（{random.randrange(10 ** 9)}）"
+    return await client.post("/api/chat", json={"message": message}, headers=dict(headers, **{"Cache-Control": "no-cache"}))
+
+
+async def drive(client: httpx.AsyncClient, mix: str, token: str, duration: float, concurrency: int, result: Result):
+    headers = {"Authorization": f"Bearer {token}"}
+    kinds = ["embedding", "llm"] if mix == "mixed" else [mix]
+    deadline = time.monotonic() + duration
+
+    async def connection(index: int):
+        kind = kinds[index % len(kinds)]
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = await one_request(client, kind, headers)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - started)
+            else:
+                result.errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[connection(index) for index in range(concurrency)])
+    result.elapsed = time.perf_counter() - started
+
+
+async def measure(workers: int, worker_class: str, args) -> Result:
+    result = Result(workers, worker_class)
+    process = start_server(workers, worker_class, args.port)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=120, limits=limits) as client:
+            await wait_ready(client, process)
+            token = await access_token(client)
+            # ウォームアップ（モデルの読み込みや接続プールの作成を計測に含めない）
+            await drive(client, args.mix, token, min(5.0, args.duration), args.concurrency, Result(workers, worker_class))
+            await drive(client, args.mix, token, args.duration, args.concurrency, result)
+    finally:
+        stop_server(process)
+    return result
+
+
+def recommend(results: List[Result]) -> Optional[Result]:
+    measured = [result for result in results if result.latencies]
+    if not measured:
+        return None
+    best = max(result.throughput for result in measured)
+    candidates = [result for result in measured if result.throughput >= 0.95 * best]
+    return min(candidates, key=lambda result: (result.p(0.95), result.workers))
+
+
+async def main(args):
+    results = []
+    for worker_class in args.worker_class.split(","):
+        for workers in [int(value) for value in args.workers.split(",")]:
+            result = await measure(workers, worker_class, args)
+            results.append(result)
+            print(f"{worker_class:<34} workers={workers:<3} {result.throughput:8.1f} req/s | "
+                  f"p50 {result.p(0.50):8.1f} ms | p95 {result.p(0.95):8.1f} ms | p99 {result.p(0.99):8.1f} ms | "
+                  f"errors {result.errors}", flush=True)
+
+    chosen = recommend(results)
+    if chosen is not None:
+        print(f"recommended for mix={args.mix}: WEB_CONCURRENCY={chosen.workers} GUNICORN_WORKER_CLASS={chosen.worker_class}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=f"1,2,{os.cpu_count() or 1}")
+    parser.add_argument("--worker-class", default="uvicorn.workers.UvicornWorker,uvicorn.workers.UvicornH11Worker")
+    parser.add_argument("--mix", choices=["embedding", "llm", "mixed"], default="mixed")
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--port", type=int, default=8765)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,88 @@
+"""ベンチマーク用の合成グラフデータ（/api/summary-tree-graph のレスポンスと同じ形の dict）"""
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List
+
+ANSWER_SENTENCES = [
+    "この手法は既存の手法と比較して計算量を削減しつつ、精度を維持できる点が特徴です。",
+    "実験では{n}件のデータセットを用いて評価が行われました。",
+    "提案モデルの学習には約{n}時間を要したと報告されています。",
+    "著者らは第{n}章で理論的な上界を導出しています。",
+    "ベースラインに対して{n}%の改善が確認されました。",
+    "ただし、データ量が少ない場合には性能が低下する可能性があります。",
+    "関連研究としてTransformer系のモデルが比較対象に挙げられています。",
+    "評価指標にはF1スコアと正解率が使われています。",
+]
+
+
+def make_graph(question_count: int, questions_per_summary: int = 20, group_ratio: float = 0.2,
+               answer_sentences: int = 12, seed: int = 0) -> Dict[str, List[Dict[str, Any]]]:
+    """質問 question_count 件を持つグラフを生成する。group_ratio の割合の質問は類似質問グループに統合される"""
+    rng = random.Random(seed)
+    base_time = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    nodes: List[Dict[str, Any]] = []
+    links: List[Dict[str, Any]] = []
+
+    summary_count = max(1, question_count // questions_per_summary)
+    for summary_id in range(1, summary_count + 1):
+        nodes.append(_node(id=f"summary_{summary_id}", label=f"論文{summary_id}.pdf", type="summary",
+                           summary_id=summary_id, summary_created_at=base_time + timedelta(hours=summary_id)))
+        nodes.append(_node(id=f"pdf_{summary_id}", label=f"論文{summary_id}.pdf", type="pdf_file", file_id=summary_id))
+        links.append(_link(f"pdf_{summary_id}", f"summary_{summary_id}", "pdf_summary_link"))
+        category_id = f"category_{summary_id}_手法"
+        nodes.append(_node(id=category_id, label="手法", type="category", summary_id=summary_id, category="手法"))
+        links.append(_link(f"summary_{summary_id}", category_id, "summary_category_link"))
+
+    pending_group: List[Dict[str, Any]] = []
+    for index in range(question_count):
+        summary_id = index % summary_count + 1
+        answer = "".join(
+            rng.choice(ANSWER_SENTENCES).format(n=rng.randint(1, 10000))
+            for _ in range(rng.randint(answer_sentences // 2, answer_sentences))
+        )
+        question = _node(
+            id=f"question_{summary_id}_手法_{index}", label=f"質問{index}: この論文の提案手法の利点は何ですか？",
+            type="user_question", summary_id=summary_id, question_id=f"question_{summary_id}_手法_{index}",
+            ai_answer=answer, ai_answer_summary=answer[:120], category="手法",
+            question_created_at=base_time + timedelta(minutes=index), history_content_id=summary_id,
+        )
+        category_id = f"category_{summary_id}_手法"
+        if rng.random() < group_ratio:
+            pending_group.append(question)
+            if len(pending_group) == 3:
+                group_id = f"integrated_question_group_{summary_id}_{index}"
+                representative = pending_group[0]
+                nodes.append(_node(
+                    id=group_id, label=f"類似質問 (3件): {representative['label']}", type="user_question_group",
+                    summary_id=summary_id, question_id=group_id, ai_answer=representative["ai_answer"],
+                    ai_answer_summary=representative["ai_answer_summary"], category="手法",
+                    question_created_at=representative["question_created_at"],
+                    grouped_question_ids=[q["id"] for q in pending_group],
+                    original_questions_details=[
+                        {"id": q["id"], "label": q["label"], "question_id": q["question_id"],
+                         "ai_answer": q["ai_answer"], "ai_answer_summary": q["ai_answer_summary"]}
+                        for q in pending_group
+                    ],
+                ))
+                links.append(_link(category_id, group_id, "category_question_link"))
+                pending_group = []
+        else:
+            nodes.append(question)
+            links.append(_link(category_id, question["id"], "category_question_link"))
+
+    return {"nodes": nodes, "links": links}
+
+
+def _node(**fields) -> Dict[str, Any]:
+    node = {
+        "id": None, "label": None, "type": None, "summary_id": None, "question_id": None, "ai_answer": None,
+        "ai_answer_summary": None, "parent_summary_id": None, "question_created_at": None,
+        "summary_created_at": None, "category": None, "history_content_id": None, "original_summary_id": None,
+        "grouped_question_ids": None, "original_questions_details": None, "file_id": None,
+    }
+    node.update(fields)
+    return node
+
+
+def _link(source: str, target: str, link_type: str) -> Dict[str, Any]:
+    return {"source": source, "target": target, "type": link_type, "directed": True}
@@ -0,0 +1,472 @@
+"""ワーカー間で共有できるキャッシュ（ドライバーを差し替えられる共通のインターフェース）
+
+- CACHE_URL=memory://              ワーカーごとの LRU（既定。ワーカーが1つなら十分）
+- CACHE_URL=redis://host:6379/0    Redis プロトコル（RESP2）のサーバー。全ワーカーで共有する
+
+キーは "<CACHE_KEY_PREFIX>:<名前空間>:<キー>" の形式で、名前空間ごとに既定の TTL を持つ。
+get_or_load は同じキーの同時の読み込みを1回にまとめる（ワーカー内は Future、ワーカー間は SET NX のロック）。
+名前空間に local_ttl を指定すると、共有キャッシュの前にワーカーごとの短命なキャッシュを置き、
+invalidate() は共有キャッシュから消したうえで pub/sub で全ワーカーのローカルのキャッシュにも伝える。
+
+Redis クライアントのライブラリには依存しない（必要なコマンドだけを asyncio のストリームで送る）。
+共有キャッシュのサーバーに接続できない間は、名前空間はキャッシュを使わずに loader で読み込む（エラーはログに残す）。
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlparse
+
+import orjson
+
+from logging_config import LogSampler
+from responses import dumps
+
+logger = logging.getLogger(__name__)
+
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "team20")
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "4096")) # memory:// とローカルのキャッシュの件数の上限
+CACHE_POOL_SIZE = int(os.getenv("CACHE_POOL_SIZE", "4")) # redis:// の接続数（ワーカーごと）
+# redis:// の1コマンドの待ち時間の上限（サーバーが応答しない場合に、リクエストを待たせ続けない）
+CACHE_COMMAND_TIMEOUT_SECONDS = float(os.getenv("CACHE_COMMAND_TIMEOUT_SECONDS", "1"))
+INVALIDATION_CHANNEL = "invalidate"
+# ワーカー間の single-flight: ロックを取れなかったワーカーが、値が入るのを待つ最大時間と確認の間隔
+LOAD_LOCK_SECONDS = 10.0
+LOAD_POLL_SECONDS = 0.05
+
+MessageHandler = Callable[[bytes], None]
+
+
+class CacheDriver:
+    """キャッシュのドライバーの共通インターフェース（値はバイト列、ttl は秒）"""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        """キーが無い場合だけ保存する（ロック用）。保存したら True"""
+        raise NotImplementedError
+
+    async def delete(self, *keys: str):
+        raise NotImplementedError
+
+    async def publish(self, channel: str, message: bytes):
+        raise NotImplementedError
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalLRUDriver(CacheDriver):
+    """プロセス内の LRU。pub/sub も同じプロセス内だけで配信する"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[Optional[float], bytes]]" = OrderedDict()
+        self._handlers: Dict[str, List[MessageHandler]] = defaultdict(list)
+
+    def _live_entry(self, key: str) -> Optional[bytes]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key: str, value: bytes, ttl: Optional[float]):
+        self._entries[key] = (time.monotonic() + ttl if ttl else None, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return self._live_entry(key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self._store(key, value, ttl)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        if self._live_entry(key) is not None:
+            return False
+        self._store(key, value, ttl)
+        return True
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            self.discard(key)
+
+    def discard(self, key: str):
+        self._entries.pop(key, None)
+
+    async def publish(self, channel: str, message: bytes):
+        for handler in list(self._handlers[channel]):
+            handler(message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        self._handlers[channel].append(handler)
+
+
+class RespError(Exception):
+    """Redis プロトコルのサーバーがエラーを返した"""
+
+
+# ドライバーの障害（サーバーの停止・接続の切断・タイムアウト）として扱う例外
+DRIVER_ERRORS = (RespError, OSError, EOFError, asyncio.TimeoutError, asyncio.LimitOverrunError)
+_driver_error_sampler = LogSampler(first=10, every=100)
+
+
+def _log_driver_error(operation: str, error: BaseException):
+    if _driver_error_sampler.sample():
+        logger.warning("Cache %s failed, continuing without the shared cache: %r", operation, error)
+
+
+class RespConnection:
+    """RESP2 の1本の接続。コマンドは1つずつ送って応答を待つ"""
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    @classmethod
+    async def open(cls, host: str, port: int, password: Optional[str] = None, db: int = 0) -> "RespConnection":
+        reader, writer = await asyncio.open_connection(host, port)
+        connection = cls(reader, writer)
+        if password:
+            await connection.execute("AUTH", password)
+        if db:
+            await connection.execute("SELECT", str(db))
+        return connection
+
+    @staticmethod
+    def encode(*args: Any) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        return b"".join(parts)
+
+    async def send(self, *args: Any):
+        self.writer.write(self.encode(*args))
+        await self.writer.drain()
+
+    async def read_reply(self) -> Any:
+        line = await self.reader.readuntil(b"\r\n")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RespError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            length = int(payload)
+            if length < 0:
+                return None
+            return [await self.read_reply() for _ in range(length)]
+        raise RespError(f"unexpected reply: {line!r}")
+
+    async def execute(self, *args: Any) -> Any:
+        await self.send(*args)
+        return await self.read_reply()
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+class RespDriver(CacheDriver):
+    """Redis プロトコル（RESP2）のサーバーを使うドライバー。コマンド用の接続プールと、購読用の接続を1本持つ"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, password: Optional[str] = None, db: int = 0,
+                 pool_size: int = CACHE_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.db = db
+        self.pool_size = pool_size
+        self._idle: "asyncio.Queue[RespConnection]" = asyncio.Queue()
+        self._opened = 0
+        self._handlers: Dict[str, List[MessageHandler]] = defaultdict(list)
+        self._subscriber: Optional[RespConnection] = None
+        self._subscriber_task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def from_url(cls, url: str) -> "RespDriver":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        password = unquote(parsed.password) if parsed.password else None
+        return cls(host=parsed.hostname or "127.0.0.1", port=parsed.port or 6379, password=password, db=db)
+
+    async def _acquire(self) -> RespConnection:
+        if self._idle.empty() and self._opened < self.pool_size:
+            self._opened += 1
+            try:
+                return await RespConnection.open(self.host, self.port, self.password, self.db)
+            except BaseException:
+                # タイムアウトで中断された場合も数え直す
+                self._opened -= 1
+                raise
+        return await self._idle.get()
+
+    async def _execute(self, *args: Any) -> Any:
+        return await asyncio.wait_for(self._execute_unbounded(*args), CACHE_COMMAND_TIMEOUT_SECONDS)
+
+    async def _execute_unbounded(self, *args: Any) -> Any:
+        connection = await self._acquire()
+        try:
+            reply = await connection.execute(*args)
+        except RespError:
+            self._idle.put_nowait(connection)
+            raise
+        except BaseException:
+            # 応答の途中で切れた接続は再利用しない
+            self._opened -= 1
+            await connection.close()
+            raise
+        self._idle.put_nowait(connection)
+        return reply
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await self._execute("GET", key)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if ttl:
+            await self._execute("SET", key, value, "PX", int(ttl * 1000))
+        else:
+            await self._execute("SET", key, value)
+
+    async def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return await self._execute("SET", key, value, "PX", int(ttl * 1000), "NX") is not None
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._execute("DEL", *keys)
+
+    async def publish(self, channel: str, message: bytes):
+        await self._execute("PUBLISH", channel, message)
+
+    async def subscribe(self, channel: str, handler: MessageHandler):
+        first = not self._handlers[channel]
+        self._handlers[channel].append(handler)
+        if self._subscriber is None:
+            self._subscriber = await RespConnection.open(self.host, self.port, self.password, self.db)
+            self._subscriber_task = asyncio.create_task(self._listen(self._subscriber))
+        if first:
+            # 購読中の接続にはコマンドを送るだけにして、確認の応答は _listen で読み捨てる
+            await self._subscriber.send("SUBSCRIBE", channel)
+
+    async def _listen(self, connection: RespConnection):
+        while True:
+            try:
+                reply = await connection.read_reply()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                logger.warning("Cache subscription connection to %s:%s closed", self.host, self.port)
+                return
+            if isinstance(reply, list) and len(reply) == 3 and reply[0] == b"message":
+                for handler in list(self._handlers[reply[1].decode("utf-8")]):
+                    try:
+                        handler(reply[2])
+                    except Exception:
+                        logger.exception("Cache invalidation handler failed")
+
+    async def close(self):
+        if self._subscriber_task is not None:
+            self._subscriber_task.cancel()
+        if self._subscriber is not None:
+            await self._subscriber.close()
+        while not self._idle.empty():
+            await self._idle.get_nowait().close()
+        self._opened = 0
+
+
+def create_driver(url: str = CACHE_URL) -> CacheDriver:
+    scheme = urlparse(url).scheme
+    if scheme in ("redis", "resp"):
+        return RespDriver.from_url(url)
+    if scheme in ("", "memory"):
+        return LocalLRUDriver()
+    raise ValueError(f"Unsupported CACHE_URL scheme: {scheme}")
+
+
+class CacheNamespace:
+    """名前空間ごとのキャッシュ。値は JSON（orjson）で保存する"""
+
+    def __init__(self, cache: "Cache", name: str, ttl: Optional[float], local_ttl: float = 0):
+        self.cache = cache
+        self.name = name
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        # memory:// ならドライバー自体がワーカー内にあるので、ローカルのキャッシュは重ねない
+        self._local = LocalLRUDriver() if local_ttl > 0 and not isinstance(cache.driver, LocalLRUDriver) else None
+        self._in_flight: Dict[str, "asyncio.Future[Any]"] = {}
+
+    def key(self, key: str) -> str:
+        return f"{self.cache.prefix}:{self.name}:{key}"
+
+    async def get_bytes(self, key: str) -> Optional[bytes]:
+        if self._local is not None:
+            value = await self._local.get(key)
+            if value is not None:
+                return value
+        try:
+            value = await self.cache.driver.get(self.key(key))
+        except DRIVER_ERRORS as e:
+            _log_driver_error("get", e)
+            return None
+        if value is not None and self._local is not None:
+            await self._local.set(key, value, self.local_ttl)
+        return value
+
+    async def set_bytes(self, key: str, value: bytes, ttl: Optional[float] = None):
+        try:
+            await self.cache.driver.set(self.key(key), value, ttl or self.ttl)
+        except DRIVER_ERRORS as e:
+            _log_driver_error("set", e)
+            return
+        if self._local is not None:
+            await self._local.set(key, value, self.local_ttl)
+
+    async def get(self, key: str) -> Any:
+        value = await self.get_bytes(key)
+        return orjson.loads(value) if value is not None else None
+
+    async def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        await self.set_bytes(key, dumps(value), ttl)
+
+    async def invalidate(self, *keys: str):
+        """共有キャッシュから削除し、全ワーカーのローカルのキャッシュにも削除を伝える"""
+        if not keys:
+            return
+        for key in keys:
+            self.drop_local(key)
+        try:
+            await self.cache.driver.delete(*[self.key(key) for key in keys])
+            for key in keys:
+                await self.cache.driver.publish(self.cache.channel, f"{self.name}\n{key}".encode("utf-8"))
+        except DRIVER_ERRORS as e:
+            # 共有キャッシュには TTL の間だけ古い値が残りうる（書き込み自体は失敗させない）
+            logger.error("Cache invalidate of %s %s failed: %r", self.name, keys, e)
+
+    def drop_local(self, key: str):
+        if self._local is not None:
+            self._local.discard(key)
+
+    async def get_or_load(self, key: str, loader: Callable[[], Awaitable[Any]], ttl: Optional[float] = None) -> Any:
+        """キャッシュに無ければ loader で読み込んで保存する。同じキーの同時の読み込みは1回にまとめる"""
+        async def load_bytes() -> bytes:
+            return dumps(await loader())
+        return orjson.loads(await self.get_or_load_bytes(key, load_bytes, ttl))
+
+    async def get_or_load_bytes(self, key: str, loader: Callable[[], Awaitable[bytes]], ttl: Optional[float] = None) -> bytes:
+        """get_or_load のバイト列版（JSON 化済みのレスポンスなどをそのまま保存する）"""
+        value = await self.get_bytes(key)
+        if value is not None:
+            return value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            return await asyncio.shield(in_flight)
+
+        future: "asyncio.Future[bytes]" = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            value = await self._load_once_across_workers(key, loader, ttl)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # 待っている呼び出し元がいなくても警告を出さない
+            raise
+        finally:
+            del self._in_flight[key]
+
+    async def _load_once_across_workers(self, key: str, loader: Callable[[], Awaitable[bytes]], ttl: Optional[float]) -> bytes:
+        lock_key = self.key(key) + ":lock"
+        token = secrets.token_hex(8).encode("ascii")
+        try:
+            locked = await self.cache.driver.add(lock_key, token, LOAD_LOCK_SECONDS)
+        except DRIVER_ERRORS as e:
+            # 共有キャッシュが使えないので、待たずに読み込むだけにする（保存もしない）
+            _log_driver_error("lock", e)
+            return await loader()
+        if not locked:
+            # 他のワーカーが読み込み中。値が入るのを待ち、時間内に入らなければ自分で読み込む
+            deadline = time.monotonic() + LOAD_LOCK_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOAD_POLL_SECONDS)
+                value = await self.get_bytes(key)
+                if value is not None:
+                    return value
+        try:
+            value = await loader()
+            await self.set_bytes(key, value, ttl)
+            return value
+        finally:
+            if locked:
+                await self._release_lock(lock_key, token)
+
+    async def _release_lock(self, lock_key: str, token: bytes):
+        try:
+            if await self.cache.driver.get(lock_key) == token:
+                await self.cache.driver.delete(lock_key)
+        except DRIVER_ERRORS as e:
+            # ロックは LOAD_LOCK_SECONDS で期限切れになる
+            _log_driver_error("unlock", e)
+
+
+class Cache:
+    def __init__(self, driver: CacheDriver, prefix: str = CACHE_KEY_PREFIX):
+        self.driver = driver
+        self.prefix = prefix
+        self.channel = f"{prefix}:{INVALIDATION_CHANNEL}"
+        self._namespaces: Dict[str, CacheNamespace] = {}
+        self._started = False
+
+    def namespace(self, name: str, ttl: Optional[float] = None, local_ttl: float = 0) -> CacheNamespace:
+        if name not in self._namespaces:
+            self._namespaces[name] = CacheNamespace(self, name, ttl, local_ttl)
+        return self._namespaces[name]
+
+    def _on_invalidate(self, message: bytes):
+        name, _, key = message.decode("utf-8").partition("\n")
+        namespace = self._namespaces.get(name)
+        if namespace is not None:
+            namespace.drop_local(key)
+
+    async def start(self):
+        """無効化の通知の購読を始める（アプリの起動時に1回呼ぶ）"""
+        if not self._started:
+            try:
+                await asyncio.wait_for(self.driver.subscribe(self.channel, self._on_invalidate), CACHE_COMMAND_TIMEOUT_SECONDS)
+                self._started = True
+            except DRIVER_ERRORS as e:
+                # 共有キャッシュが無くても起動する（他のワーカーの無効化は、ローカルのキャッシュの TTL の間だけ届かない）
+                logger.error("Cache invalidation subscription failed: %r", e)
+
+    async def close(self):
+        await self.driver.close()
+
+
+cache = Cache(create_driver())
@@ -0,0 +1,136 @@
+"""質問のカテゴリの割り当て（埋め込みの重心との類似度で既存のカテゴリを使い回す）
+
+ユーザー（チームの要約ならチーム）ごとに、カテゴリ名と、そのカテゴリに割り当てた質問の埋め込みの重心を共有キャッシュに持つ。
+質問の埋め込みとのコサイン類似度が CATEGORY_SIMILARITY_THRESHOLD 以上の重心があればそのカテゴリにし、重心を更新する。
+どの重心にも近くない質問だけを Gemini でカテゴリ付けする（同じ保存の中で互いに近い質問は1回にまとめる）。
+Gemini が既存のカテゴリ名を返した場合は、そのカテゴリの重心に加える。
+
+重心の更新は同じスコープについてワーカー内で順番に行う。ワーカー間で同時に更新した場合は後の書き込みが残る
+（失われるのは重心の一部で、次の保存で Gemini が呼ばれるだけ）。
+"""
+import asyncio
+import base64
+import os
+import weakref
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import orjson
+import torch
+
+import metrics
+from cache import CacheNamespace
+
+CATEGORY_SIMILARITY_THRESHOLD = float(os.getenv("CATEGORY_SIMILARITY_THRESHOLD", "0.8"))
+# 重心を保持する秒数（更新のたびに延長する）と、スコープごとのカテゴリ数の上限（超えたら質問数の少ないものから捨てる）
+CATEGORY_CENTROIDS_TTL_SECONDS = float(os.getenv("CATEGORY_CENTROIDS_TTL_SECONDS", str(30 * 24 * 3600)))
+CATEGORY_MAX_PER_SCOPE = int(os.getenv("CATEGORY_MAX_PER_SCOPE", "100"))
+# Gemini の呼び出しに失敗したときのカテゴリ（重心は作らない）
+DEFAULT_CATEGORY = "その他"
+
+
+def category_scope(user_id: int, team_id: Optional[int]) -> str:
+    return f"team:{team_id}" if team_id else f"user:{user_id}"
+
+
+class _Centroid:
+    def __init__(self, category: str, vector: torch.Tensor, count: int):
+        self.category = category
+        self.vector = vector # 正規化前の質問の埋め込みの和（正規化済みの埋め込みを足していく）
+        self.count = count
+
+    def direction(self) -> torch.Tensor:
+        return torch.nn.functional.normalize(self.vector, p=2, dim=0)
+
+    def add(self, embedding: torch.Tensor):
+        self.vector = self.vector + embedding
+        self.count += 1
+
+
+def _dump(centroids: List[_Centroid]) -> bytes:
+    # 埋め込みは float32 のバイト列を base64 にして保存する（JSON の数値の列より小さい）
+    return orjson.dumps([
+        {"category": c.category, "count": c.count,
+         "vector": base64.b64encode(c.vector.numpy().astype("float32").tobytes()).decode("ascii")}
+        for c in centroids
+    ])
+
+
+def _load(value: Optional[bytes], dimension: int) -> List[_Centroid]:
+    if value is None:
+        return []
+    centroids = []
+    for item in orjson.loads(value):
+        vector = torch.frombuffer(bytearray(base64.b64decode(item["vector"])), dtype=torch.float32)
+        if vector.shape[0] == dimension:
+            centroids.append(_Centroid(item["category"], vector, item["count"]))
+    return centroids
+
+
+class CategoryResolver:
+    def __init__(self, centroids: CacheNamespace,
+                 encode: Callable[[List[str]], Awaitable[torch.Tensor]],
+                 generate: Callable[[str], Awaitable[str]]):
+        self.centroids = centroids
+        self.encode = encode
+        self.generate = generate
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock(self, scope: str) -> asyncio.Lock:
+        lock = self._locks.get(scope)
+        if lock is None:
+            lock = self._locks[scope] = asyncio.Lock()
+        return lock
+
+    async def resolve(self, scope: str, questions: List[str]) -> List[str]:
+        """質問ごとのカテゴリを返す"""
+        if not questions:
+            return []
+        embeddings = torch.nn.functional.normalize((await self.encode(questions)).float().cpu(), p=2, dim=1)
+        async with self._lock(scope):
+            centroids = _load(await self.centroids.get_bytes(scope), embeddings.shape[1])
+            categories = await self._assign(centroids, questions, embeddings)
+            centroids.sort(key=lambda c: c.count, reverse=True)
+            await self.centroids.set_bytes(scope, _dump(centroids[:CATEGORY_MAX_PER_SCOPE]), CATEGORY_CENTROIDS_TTL_SECONDS)
+        return categories
+
+    async def _assign(self, centroids: List[_Centroid], questions: List[str], embeddings: torch.Tensor) -> List[str]:
+        categories: List[Optional[str]] = [None] * len(questions)
+        # 既存の重心に近くない質問を、代表の質問（最初の1件）ごとにまとめる
+        pending: List[List[int]] = []
+        for index, embedding in enumerate(embeddings):
+            best = self._closest([c.direction() for c in centroids], embedding)
+            if best is not None:
+                centroids[best].add(embedding)
+                categories[index] = centroids[best].category
+                metrics.category_resolutions.inc(outcome="matched")
+                continue
+            group = self._closest([embeddings[members[0]] for members in pending], embedding)
+            if group is not None:
+                pending[group].append(index)
+                metrics.category_resolutions.inc(outcome="grouped")
+            else:
+                pending.append([index])
+
+        labels = await asyncio.gather(*[self.generate(questions[members[0]]) for members in pending])
+        by_name: Dict[str, _Centroid] = {c.category: c for c in centroids}
+        for members, label in zip(pending, labels):
+            metrics.category_resolutions.inc(outcome="generated")
+            for index in members:
+                categories[index] = label
+            if label == DEFAULT_CATEGORY:
+                continue
+            centroid = by_name.get(label)
+            if centroid is None:
+                centroid = by_name[label] = _Centroid(label, torch.zeros(embeddings.shape[1]), 0)
+                centroids.append(centroid)
+            for index in members:
+                centroid.add(embeddings[index])
+        return categories
+
+    @staticmethod
+    def _closest(directions: List[torch.Tensor], embedding: torch.Tensor) -> Optional[int]:
+        if not directions:
+            return None
+        similarities = torch.stack(directions) @ embedding
+        best = int(torch.argmax(similarities))
+        return best if float(similarities[best]) >= CATEGORY_SIMILARITY_THRESHOLD else None
@@ -1,7 +1,8 @@
 import os
-from sqlalchemy import create_engine, Column, Integer, String, ForeignKey, DateTime, Text, LargeBinary
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, ForeignKey, DateTime, Text, LargeBinary, Index, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.orm import sessionmaker, relationship, deferred
 from sqlalchemy.sql import func
 
 # Require DATABASE_URL for PostgreSQL (e.g., postgres:// or postgresql://)
@@ -34,10 +35,24 @@ class UserSession(Base):
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), unique=True, nullable=False)
     session_data = Column(Text, nullable=False) # Stores JSON string of session state
+    version = Column(Integer, nullable=False, default=0, server_default="0") # 保存のたびに1増やす（ETag に使う）
     last_updated = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     user = relationship("User", back_populates="session")
 
+class AuthSession(Base):
+    """リフレッシュトークンのセッション（ログインごとに1行。トークン本体ではなくハッシュを保存する）"""
+    __tablename__ = "auth_sessions"
+
+    id = Column(String(36), primary_key=True) # UUID（リフレッシュトークンの前半）
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False) # 現在のリフレッシュトークンの SHA-256
+    previous_token_hash = Column(String(64), nullable=True) # 直前のトークン（再利用の検知用）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    revoked_at = Column(DateTime(timezone=True), nullable=True)
+
 class Team(Base):
     __tablename__ = "teams"
 
@@ -87,6 +102,14 @@ class Reaction(Base):
     comment = relationship("Comment", back_populates="reactions")
     user = relationship("User", back_populates="reactions")
 
+# 要約の全文検索用ベクトル（タイトル > タグ > 本文の順に重み付け）。日本語は分かち書きされないため、
+# 空白区切りの語での一致に限られる（意味的な一致は /api/search のベクトル類似度で補う）
+SUMMARY_SEARCH_VECTOR_SQL = (
+    "setweight(to_tsvector('simple'::regconfig, coalesce(filename, '')), 'A') || "
+    "setweight(to_tsvector('simple'::regconfig, replace(coalesce(tags, ''), ',', ' ')), 'B') || "
+    "setweight(to_tsvector('simple'::regconfig, coalesce(summary, '')), 'C')"
+)
+
 class SummaryHistory(Base):
     __tablename__ = "summary_histories"
 
@@ -100,6 +123,7 @@ class SummaryHistory(Base):
     chat_history_id = Column(Integer, nullable=True)  # AI チャット履歴への参照（外部キー制約なし）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     parent_summary_id = Column(Integer, ForeignKey("summary_histories.id"), nullable=True) # NEW FIELD
+    search_vector = deferred(Column(TSVECTOR, Computed(SUMMARY_SEARCH_VECTOR_SQL, persisted=True))) # 全文検索用（DBが生成）
 
     user = relationship("User", back_populates="summaries")
     team = relationship("Team", back_populates="summaries")
@@ -108,6 +132,10 @@ class SummaryHistory(Base):
     ai_summary_responses = relationship("AiSummaryResponse", back_populates="summary_history", cascade="all, delete-orphan") # NEW
     parent = relationship("SummaryHistory", remote_side=[id]) # NEW RELATIONSHIP
 
+    __table_args__ = (
+        Index("ix_summary_histories_search_vector", "search_vector", postgresql_using="gin"),
+    )
+
 class HistoryContent(Base):
     __tablename__ = "history_contents"
 
@@ -118,11 +146,39 @@ class HistoryContent(Base):
     question_text = Column(Text, nullable=True) # NEW FIELD: ユーザーの質問テキスト
     ai_answer_text = Column(Text, nullable=True) # NEW FIELD: AIの回答テキスト
     embedding = Column(Text, nullable=True) # NEW FIELD: Store embeddings as JSON string
+    qa_extracted_at = Column(DateTime(timezone=True), nullable=True) # ai_chat から質問と回答のペアを抽出した日時（ペアが0件でも記録する）
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
     summary_history = relationship("SummaryHistory", back_populates="contents")
     ai_summary_responses = relationship("AiSummaryResponse", back_populates="original_history_content", cascade="all, delete-orphan") # NEW
+    question_answer_pairs = relationship("QuestionAnswerPair", back_populates="history_content", cascade="all, delete-orphan")
+
+    __table_args__ = (
+        Index("ix_history_contents_summary_section", "summary_history_id", "section_type"), # 要約ごとのセクション取得用
+        # 質問と回答のペアを未抽出の ai_chat（起動時のバックフィルが探す。抽出後は索引から外れる）
+        Index("ix_history_contents_qa_pending", "id", postgresql_where=text("section_type = 'ai_chat' AND qa_extracted_at IS NULL")),
+    )
+
+class QuestionAnswerPair(Base):
+    """ai_chat の履歴から抽出した質問と回答のペア（チャット履歴の保存時に作り直す）"""
+    __tablename__ = "question_answer_pairs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    summary_history_id = Column(Integer, ForeignKey("summary_histories.id"), nullable=False)
+    history_content_id = Column(Integer, ForeignKey("history_contents.id"), nullable=False) # 抽出元の ai_chat（埋め込みもこの行に保存されている）
+    position = Column(Integer, nullable=False) # チャット内での順番
+    question = Column(Text, nullable=False)
+    answer = Column(Text, nullable=False, default="")
+    category = Column(String, nullable=True)
+    asked_at = Column(DateTime(timezone=True), nullable=True) # 質問メッセージのタイムスタンプ
+
+    history_content = relationship("HistoryContent", back_populates="question_answer_pairs")
+
+    __table_args__ = (
+        Index("ix_question_answer_pairs_summary_position", "summary_history_id", "history_content_id", "position"),
+        Index("ix_question_answer_pairs_history_content_id", "history_content_id"), # チャット単位の作り直し用
+    )
 
 class AiSummaryResponse(Base): # NEW TABLE
     __tablename__ = "ai_summary_responses"
@@ -146,9 +202,60 @@ class SharedFile(Base):
     team_id = Column(Integer, ForeignKey("teams.id"), nullable=True)
     uploaded_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
     uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    chunked_at = Column(DateTime(timezone=True), nullable=True) # テキストをチャンクに分割して file_chunks に保存した日時
 
     team = relationship("Team", back_populates="shared_files")
     uploaded_by_user = relationship("User", back_populates="uploaded_files")
+    chunks = relationship("FileChunk", back_populates="shared_file", cascade="all, delete-orphan")
+
+class FileChunk(Base):
+    """共有ファイルから抽出したテキストのチャンクと、その埋め込み（チャットで関連箇所だけを送るため）"""
+    __tablename__ = "file_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    shared_file_id = Column(Integer, ForeignKey("shared_files.id"), nullable=False, index=True)
+    chunk_index = Column(Integer, nullable=False) # ファイル内での順番
+    page_number = Column(Integer, nullable=True)
+    content = Column(Text, nullable=False)
+    embedding = Column(Text, nullable=True) # Store embeddings as JSON string
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    shared_file = relationship("SharedFile", back_populates="chunks")
+
+class FileSummary(Base):
+    """ファイル（またはファイルの組み合わせ）の要約のキャッシュ。cache_key は内容の SHA-256 とプロンプトのバージョンから作る"""
+    __tablename__ = "file_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String, unique=True, nullable=False, index=True)
+    summary = Column(Text, nullable=False)
+    tags = Column(String, nullable=True) # カンマ区切り
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class SummaryJob(Base):
+    """チームへのアップロード後にバックグラウンドで実行する要約ジョブ（進捗の確認用）"""
+    __tablename__ = "summary_jobs"
+
+    id = Column(String(36), primary_key=True) # UUID
+    team_id = Column(Integer, ForeignKey("teams.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False) # アップロードしたユーザー
+    file_ids = Column(Text, nullable=False) # 要約する SharedFile の ID（JSON 配列）
+    status = Column(String(20), nullable=False, default="pending") # 'pending', 'running', 'succeeded', 'failed'
+    total_files = Column(Integer, nullable=False, default=0)
+    completed_files = Column(Integer, nullable=False, default=0)
+    summary_history_id = Column(Integer, ForeignKey("summary_histories.id"), nullable=True) # 作成したチームの要約
+    error = Column(Text, nullable=True)
+    worker_id = Column(String, nullable=True) # ジョブを実行するワーカー（ホスト名:PID）
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class CacheVersion(Base):
+    """読み取り API の ETag に使うバージョン。対象（scope）を変更する書き込みのたびに1増やす"""
+    __tablename__ = "cache_versions"
+
+    scope = Column(String, primary_key=True) # 'summary:12', 'team:3:files' など
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
 
 class Message(Base):
     __tablename__ = "messages"
@@ -161,3 +268,28 @@ class Message(Base):
 
     team = relationship("Team", back_populates="messages")
     user = relationship("User", back_populates="messages")
+
+    __table_args__ = (
+        Index("ix_messages_team_id_id", "team_id", "id"), # チームごとのページング用
+    )
+
+# create_all は既存テーブルへの列・インデックス追加を行わないため、
+# 既存DBに必要な追加分はここに冪等な DDL として記述し、起動時に適用する
+SCHEMA_MIGRATIONS = [
+    "CREATE INDEX IF NOT EXISTS ix_messages_team_id_id ON messages (team_id, id)",
+    "CREATE INDEX IF NOT EXISTS ix_history_contents_summary_section ON history_contents (summary_history_id, section_type)",
+    f"ALTER TABLE summary_histories ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ({SUMMARY_SEARCH_VECTOR_SQL}) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_summary_histories_search_vector ON summary_histories USING gin (search_vector)",
+    "ALTER TABLE shared_files ADD COLUMN IF NOT EXISTS chunked_at TIMESTAMP WITH TIME ZONE",
+    "ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 0",
+    "ALTER TABLE summary_jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR",
+    "CREATE INDEX IF NOT EXISTS ix_question_answer_pairs_history_content_id ON question_answer_pairs (history_content_id)",
+    "ALTER TABLE history_contents ADD COLUMN IF NOT EXISTS qa_extracted_at TIMESTAMP WITH TIME ZONE",
+    "CREATE INDEX IF NOT EXISTS ix_history_contents_qa_pending ON history_contents (id)"
+    " WHERE section_type = 'ai_chat' AND qa_extracted_at IS NULL",
+]
+
+def apply_schema_migrations():
+    with engine.begin() as conn:
+        for statement in SCHEMA_MIGRATIONS:
+            conn.execute(text(statement))
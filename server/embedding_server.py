@@ -0,0 +1,243 @@
+"""埋め込みモデルを1プロセスに集約する埋め込みサーバーとそのクライアント
+
+uvicorn の各ワーカーが SentenceTransformer を個別にロードすると、モデル分のメモリが
+ワーカー数だけ必要になる。モデルはこのサーバープロセスだけが保持し、
+API ワーカーは Unix ソケット経由で encode を依頼する。
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from multiprocessing.connection import Client, Listener, AuthenticationError
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+
+from logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "all-mpnet-base-v2")
+EMBEDDING_SERVER_SOCKET = os.getenv("EMBEDDING_SERVER_SOCKET", "")
+# 1回の encode にまとめるテキスト数の上限と、バッチを溜めるための待ち時間
+MAX_BATCH_SIZE = int(os.getenv("EMBEDDING_MAX_BATCH_SIZE", "64"))
+BATCH_WAIT_SECONDS = float(os.getenv("EMBEDDING_BATCH_WAIT_MS", "5")) / 1000
+# 待ち行列の上限（バックプレッシャー）。溢れた依頼は QUEUE_TIMEOUT_SECONDS 待った後に busy を返す
+MAX_QUEUE_SIZE = int(os.getenv("EMBEDDING_MAX_QUEUE_SIZE", "256"))
+QUEUE_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_QUEUE_TIMEOUT", "10"))
+# モデルのロード（初回はダウンロードを含む）と、1回の encode 依頼を待つ最大秒数。超えたら error を返す
+MODEL_LOAD_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_MODEL_LOAD_TIMEOUT", "300"))
+REQUEST_TIMEOUT_SECONDS = float(os.getenv("EMBEDDING_REQUEST_TIMEOUT", "60"))
+# クライアントが応答を待つ最大秒数（サーバーが応答しない場合に呼び出し元のスレッドを止めたままにしない）
+RESPONSE_TIMEOUT_SECONDS = MODEL_LOAD_TIMEOUT_SECONDS + REQUEST_TIMEOUT_SECONDS
+
+
+def _authkey() -> bytes:
+    # start_server.py がプロセス起動ごとにランダムな値を設定する
+    return os.getenv("EMBEDDING_SERVER_AUTHKEY", "team20-embedding").encode()
+
+
+class EmbeddingServerBusy(RuntimeError):
+    """埋め込みサーバーの待ち行列が満杯で依頼を受け付けられなかった"""
+
+
+class EmbeddingServer:
+    """Unix ソケットで encode 依頼を受け、複数ワーカーからの依頼をまとめてバッチ処理する"""
+
+    def __init__(self, socket_path: str, model_name: str = EMBEDDING_MODEL_NAME):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self._jobs: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue(maxsize=MAX_QUEUE_SIZE)
+        self._model = None
+        self._model_ready = threading.Event() # ロードが終わったら（失敗した場合も）セットする
+        self._load_error: Optional[BaseException] = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        # モデルのロード前にソケットを開き、ロード中の依頼は待ち行列で待たせる
+        listener = Listener(self.socket_path, family="AF_UNIX", authkey=_authkey())
+        os.chmod(self.socket_path, 0o600)
+        logger.info("Embedding server listening on %s", self.socket_path)
+
+        threading.Thread(target=self._batch_loop, name="embedding-batcher", daemon=True).start()
+
+        try:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    logger.warning("Embedding server rejected a connection: %s", e)
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+        finally:
+            listener.close()
+
+    def _load_model(self):
+        from sentence_transformers import SentenceTransformer
+
+        started = time.monotonic()
+        try:
+            self._model = SentenceTransformer(self.model_name)
+        except Exception as e:
+            logger.error("Failed to load embedding model '%s': %s", self.model_name, e)
+            self._load_error = e
+            return
+        finally:
+            self._model_ready.set()
+        logger.info("Embedding model '%s' loaded in %.1fs", self.model_name, time.monotonic() - started)
+
+    def _model_unavailable(self) -> Optional[str]:
+        """モデルが使えない理由（ロード中で時間切れ、またはロードに失敗）。使えるなら None"""
+        if not self._model_ready.wait(MODEL_LOAD_TIMEOUT_SECONDS):
+            return "embedding model is still loading"
+        if self._load_error is not None:
+            return f"embedding model failed to load: {self._load_error}"
+        return None
+
+    def _handle_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+
+                op = request[0]
+                if op in ("dimension", "encode"):
+                    unavailable = self._model_unavailable()
+                    if unavailable is not None:
+                        conn.send(("error", unavailable))
+                        continue
+
+                if op == "dimension":
+                    conn.send(("ok", self._model.get_sentence_embedding_dimension()))
+                elif op == "encode":
+                    future: Future = Future()
+                    try:
+                        self._jobs.put((list(request[1]), future), timeout=QUEUE_TIMEOUT_SECONDS)
+                    except queue.Full:
+                        conn.send(("busy", "embedding queue is full"))
+                        continue
+                    try:
+                        conn.send(("ok", future.result(timeout=REQUEST_TIMEOUT_SECONDS)))
+                    except FutureTimeoutError:
+                        conn.send(("error", "embedding request timed out"))
+                    except Exception as e:
+                        conn.send(("error", str(e)))
+                else:
+                    conn.send(("error", f"unknown operation: {op}"))
+
+    def _batch_loop(self):
+        self._load_model()
+        if self._load_error is not None:
+            # ロードに失敗した場合は、待ち行列に入った依頼にもエラーを返し続ける
+            while True:
+                _, future = self._jobs.get()
+                future.set_exception(RuntimeError(f"embedding model failed to load: {self._load_error}"))
+        while True:
+            jobs = [self._jobs.get()]
+            total = len(jobs[0][0])
+            deadline = time.monotonic() + BATCH_WAIT_SECONDS
+            while total < MAX_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    job = self._jobs.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                jobs.append(job)
+                total += len(job[0])
+
+            texts = [text for job_texts, _ in jobs for text in job_texts]
+            try:
+                vectors = self._model.encode(texts, batch_size=MAX_BATCH_SIZE, convert_to_numpy=True)
+            except Exception as e:
+                logger.error("Embedding batch of %s texts failed: %s", len(texts), e)
+                for _, future in jobs:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for job_texts, future in jobs:
+                future.set_result(vectors[offset:offset + len(job_texts)])
+                offset += len(job_texts)
+
+
+class RemoteEmbeddingModel:
+    """SentenceTransformer と同じ呼び出し方で埋め込みサーバーを利用する薄いクライアント
+
+    接続はスレッドごとに保持するため、run_in_threadpool からの並行呼び出しでも安全。
+    """
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self._local = threading.local()
+        self._dimension: Optional[int] = None
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = Client(self.socket_path, family="AF_UNIX", authkey=_authkey())
+            self._local.conn = conn
+        return conn
+
+    def _call(self, request):
+        # サーバー再起動などで切断されていた場合は1度だけ再接続する
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                conn.send(request)
+                if not conn.poll(RESPONSE_TIMEOUT_SECONDS):
+                    raise TimeoutError(f"no response from embedding server within {RESPONSE_TIMEOUT_SECONDS:.0f}s")
+                status, payload = conn.recv()
+                break
+            except TimeoutError:
+                # 遅れて届く応答と次の依頼の応答が入れ替わるので、この接続は使い続けない（再試行もしない）
+                self._local.conn = None
+                conn.close()
+                raise
+            except (EOFError, OSError):
+                self._local.conn = None
+                conn.close()
+                if attempt == 1:
+                    raise
+        if status == "busy":
+            raise EmbeddingServerBusy(payload)
+        if status != "ok":
+            raise RuntimeError(f"Embedding server error: {payload}")
+        return payload
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dimension is None:
+            self._dimension = self._call(("dimension",))
+        return self._dimension
+
+    def encode(self, sentences: Union[str, List[str]], convert_to_tensor: bool = False, **kwargs):
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if texts:
+            vectors = self._call(("encode", texts))
+        else:
+            vectors = np.zeros((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        result = vectors[0] if single else vectors
+        if convert_to_tensor:
+            import torch
+            return torch.from_numpy(np.ascontiguousarray(result))
+        return result
+
+
+def run_embedding_server(socket_path: str):
+    """埋め込みサーバーを起動する（start_server.py から別プロセスとして呼ばれる）"""
+    configure_logging()
+    EmbeddingServer(socket_path).serve_forever()
+
+
+if __name__ == "__main__":
+    if not EMBEDDING_SERVER_SOCKET:
+        raise ValueError("EMBEDDING_SERVER_SOCKET environment variable must be set")
+    run_embedding_server(EMBEDDING_SERVER_SOCKET)
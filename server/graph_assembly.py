@@ -0,0 +1,183 @@
+"""要約ツリーグラフの組み立て（類似質問の統合、ノードとリンクの重複排除）
+
+ノードは ID、リンクは (source, target, type) をキーにした辞書で保持するため、
+ノード数・リンク数に対して線形時間で組み立てられる。
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from pydantic import BaseModel
+
+SIMILARITY_THRESHOLD = 0.85
+QUESTION_NODE_TYPE = "user_question"
+
+
+class GraphNode(BaseModel):
+    id: str
+    label: str
+    type: str # 'summary', 'user_question', 'pdf_file', 'category'
+    summary_id: Optional[int] = None # For chat messages, links back to the summary
+    question_id: Optional[str] = None # For user question nodes, unique ID within the chat
+    ai_answer: Optional[str] = None # For user question nodes, stores the AI's answer
+    ai_answer_summary: Optional[str] = None # NEW FIELD: Stores the summarized AI answer
+    parent_summary_id: Optional[int] = None # NEW FIELD
+    question_created_at: Optional[datetime] = None # NEW FIELD
+    summary_created_at: Optional[datetime] = None # NEW FIELD
+    category: Optional[str] = None # NEW FIELD: Add category to GraphNode
+    history_content_id: Optional[int] = None # NEW FIELD: Reference to HistoryContent.id
+    original_summary_id: Optional[int] = None # NEW FIELD: 質問が紐づく元の要約ID
+    grouped_question_ids: Optional[List[str]] = None # NEW FIELD: 統合された質問ノードのIDリスト
+    original_questions_details: Optional[List[Dict[str, Any]]] = None # NEW FIELD: 統合された質問の詳細
+    file_id: Optional[int] = None # NEW FIELD: For PDF file nodes
+
+
+class GraphLink(BaseModel):
+    source: str
+    target: str
+    type: Optional[str] = None
+    directed: Optional[bool] = True # NEW FIELD: エッジの方向性を示す
+
+
+class GraphData(BaseModel):
+    nodes: List[GraphNode]
+    links: List[GraphLink]
+
+
+class GraphNodeDetail(BaseModel):
+    id: str
+    label: str
+    ai_answer: Optional[str] = None
+    ai_answer_summary: Optional[str] = None
+    history_content_id: Optional[int] = None
+
+
+LinkKey = Tuple[str, str, Optional[str]]
+
+
+class SummaryGraph:
+    """ノードとリンクを重複なく、追加順に保持するグラフ"""
+
+    def __init__(self):
+        self._nodes: Dict[str, GraphNode] = {}
+        self._links: Dict[LinkKey, GraphLink] = {}
+
+    def add_node(self, node: GraphNode) -> bool:
+        """同じ ID のノードが既にあれば追加せず False を返す"""
+        if node.id in self._nodes:
+            return False
+        self._nodes[node.id] = node
+        return True
+
+    def add_link(self, link: GraphLink) -> bool:
+        """自己ループと、同じ (source, target, type) のリンクは追加せず False を返す"""
+        key = (link.source, link.target, link.type)
+        if link.source == link.target or key in self._links:
+            return False
+        self._links[key] = link
+        return True
+
+    def get_node(self, node_id: str) -> Optional[GraphNode]:
+        return self._nodes.get(node_id)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def to_graph_data(self) -> GraphData:
+        return GraphData(nodes=list(self._nodes.values()), links=list(self._links.values()))
+
+
+def cluster_similar_questions(ordered_ids: Sequence[str], embeddings: Dict[str, torch.Tensor],
+                              threshold: float = SIMILARITY_THRESHOLD, block_size: int = 256) -> List[List[str]]:
+    """コサイン類似度が threshold 以上の質問を貪欲法でグループ化する
+
+    ordered_ids の順（古い順）に未所属の質問を代表とし、まだどのグループにも属していない質問のうち
+    代表との類似度が threshold 以上のものを同じグループに入れる。埋め込みのない質問はどのグループにも入らない。
+    類似度は block_size 件ずつ、まだ未所属の後続の質問との行列積でまとめて計算する
+    （前方の質問は処理済みで必ずどこかのグループに属しているため比較しない）。
+    """
+    ids = [question_id for question_id in ordered_ids if question_id in embeddings]
+    if not ids:
+        return []
+
+    matrix = torch.stack([embeddings[question_id].reshape(-1).float().cpu() for question_id in ids])
+    matrix = torch.nn.functional.normalize(matrix, p=2, dim=1)
+    assigned = torch.zeros(len(ids), dtype=torch.bool)
+
+    groups: List[List[str]] = []
+    for block_start in range(0, len(ids), block_size):
+        candidates = (~assigned[block_start:]).nonzero().flatten() + block_start
+        similar = matrix[block_start:block_start + block_size] @ matrix[candidates].T >= threshold
+        for offset in range(similar.shape[0]):
+            index = block_start + offset
+            if assigned[index]:
+                continue
+            members = candidates[similar[offset] & ~assigned[candidates]]
+            assigned[members] = True
+            assigned[index] = True
+            # 代表を先頭に、残りは ordered_ids の順で並べる
+            groups.append([ids[index]] + [ids[member] for member in members.tolist() if member != index])
+    return groups
+
+
+def _question_group_node(group_index: int, members: List[GraphNode]) -> GraphNode:
+    # 代表ノード（グループ内の最も古いノード）の内容を引き継ぐ
+    representative = members[0]
+    integrated_node_id = f"integrated_question_group_{representative.summary_id}_{group_index}"
+    return GraphNode(
+        id=integrated_node_id,
+        label=f"類似質問 ({len(members)}件): {representative.label}",
+        type="user_question_group",
+        summary_id=representative.summary_id,
+        question_id=integrated_node_id,
+        ai_answer=representative.ai_answer,
+        ai_answer_summary=representative.ai_answer_summary,
+        question_created_at=representative.question_created_at,
+        category=representative.category,
+        history_content_id=None,
+        original_summary_id=representative.original_summary_id,
+        grouped_question_ids=[member.id for member in members],
+        original_questions_details=[
+            {
+                "id": member.id,
+                "label": member.label,
+                "question_id": member.question_id,
+                "ai_answer": member.ai_answer,
+                "ai_answer_summary": member.ai_answer_summary
+            }
+            for member in members
+        ]
+    )
+
+
+def assemble_graph(nodes: List[GraphNode], links: List[GraphLink], groups: List[List[str]]) -> SummaryGraph:
+    """類似質問のグループを統合ノードに置き換えたグラフを組み立てる
+
+    2件以上のグループは統合ノードになり、元の質問ノードへのリンクは統合ノードへのリンクに付け替える。
+    どのグループにも入っていない質問ノードは含めない。ノードの順序は質問（グループ順）、それ以外のノードの順。
+    """
+    nodes_by_id = {node.id: node for node in nodes}
+    graph = SummaryGraph()
+    replacements: Dict[str, str] = {} # {元の質問ノードID: 統合ノードID}
+
+    for group_index, group in enumerate(groups):
+        if len(group) > 1:
+            group_node = _question_group_node(group_index, [nodes_by_id[question_id] for question_id in group])
+            graph.add_node(group_node)
+            for question_id in group:
+                replacements[question_id] = group_node.id
+        else:
+            graph.add_node(nodes_by_id[group[0]])
+
+    for node in nodes:
+        if node.type != QUESTION_NODE_TYPE:
+            graph.add_node(node)
+
+    for link in links:
+        source_id = replacements.get(link.source, link.source)
+        target_id = replacements.get(link.target, link.target)
+        if source_id != link.source or target_id != link.target:
+            link = GraphLink(source=source_id, target=target_id, type=link.type, directed=link.directed)
+        graph.add_link(link)
+
+    return graph
@@ -0,0 +1,70 @@
+"""本番用の gunicorn の設定（start_server.py から使う）
+
+ワーカーは uvicorn のワーカークラスで動かし、数・種類・再起動の条件などを環境変数で変えられる。
+- 埋め込みサーバーは start_server.py が gunicorn より前に起動し、EMBEDDING_SERVER_SOCKET でワーカーに伝える
+  （gunicorn -c gunicorn.conf.py main:app で直接起動する場合は、埋め込みサーバーを別に起動して EMBEDDING_SERVER_SOCKET を設定する）。
+- GUNICORN_PRELOAD=1 なら main.py をマスターで読み込んでから fork し、import 済みのモジュール（torch など）のメモリを
+  ワーカー間で共有する（埋め込みサーバーを使わない場合は埋め込みモデルも）。
+- SIGHUP でワーカーを順に入れ替える（処理中のリクエストは GUNICORN_GRACEFUL_TIMEOUT 秒まで待つ）。
+  preload 時は HUP ではコードが再読み込みされないので、デプロイでは再起動するか USR2 で新しいマスターを起動する。
+- 各ワーカーは GUNICORN_MAX_REQUESTS 件（± ジッター）を処理したら入れ替える（メモリの断片化・リーク対策）。
+"""
+import logging
+import os
+
+import multiprocessing
+
+logger = logging.getLogger("gunicorn.error")
+
+
+def default_workers() -> int:
+    """ワーカー数の既定値
+
+    埋め込みサーバーを使う場合、ワーカーの仕事は Gemini と DB の待ちが中心なので CPU コア数と同じにする
+    （埋め込みの計算は埋め込みサーバーが全コアを使う）。使わない場合はワーカーごとにモデルを持って計算するので半分にする。
+    benchmarks/sweep_workers.py で実際の負荷に合わせて確認する。
+    """
+    cores = multiprocessing.cpu_count()
+    if os.getenv("EMBEDDING_SERVER_SOCKET"):
+        return max(2, cores)
+    return max(1, cores // 2)
+
+
+bind = os.getenv("GUNICORN_BIND", f"0.0.0.0:{os.getenv('PORT', '8000')}")
+workers = int(os.getenv("WEB_CONCURRENCY", "0")) or default_workers()
+# uvicorn.workers.UvicornWorker（uvloop / httptools）または uvicorn.workers.UvicornH11Worker（純 Python）
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "uvicorn.workers.UvicornWorker")
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+# ワーカーのハートビートの期限（イベントループがこの秒数止まったワーカーは再起動する）と、停止・再起動時の猶予
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "200"))
+# keep-alive の接続を保つ秒数（ロードバランサーのアイドルタイムアウトより長くする）と、accept 待ちの接続の上限
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "75"))
+backlog = int(os.getenv("GUNICORN_BACKLOG", "2048"))
+
+accesslog = None # アクセスログは main.py のミドルウェアが出す
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+
+def on_starting(server):
+    logger.info("Starting %s %s workers (preload=%s, max_requests=%s)", workers, worker_class, preload_app, max_requests)
+
+
+def when_ready(server):
+    if preload_app and not os.getenv("EMBEDDING_SERVER_SOCKET"):
+        # 埋め込みサーバーが無い場合は、モデルの重みを fork 前に読み込んでワーカー間で共有する（推論はまだしない）
+        import main
+        main.get_embedding_model()
+
+
+def post_fork(server, worker):
+    # preload 時はマスターで設定したログの書き出しスレッドが fork で引き継がれないので、ワーカーで作り直す
+    from logging_config import configure_logging
+    configure_logging()
+    # マスターで作られた DB の接続はワーカー間で共有しない（preload 時に main.py の import でマイグレーションが接続している）
+    from database import engine
+    engine.dispose(close=False)
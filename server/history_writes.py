@@ -0,0 +1,134 @@
+"""要約と履歴（AI チャット、回答の要約、質問と回答のペア）の一括保存
+
+行の ID は先にシーケンスからまとめて予約する。ID が確定していれば行どうしの参照
+（summary_histories.chat_history_id など）も組み立てる時点で埋められるため、flush で ID を1件ずつ取得する往復が要らない。
+INSERT はテーブルごとに1回の executemany で、SQLAlchemy が複数行の INSERT ... VALUES にまとめて送る。
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+from sqlalchemy import insert, text
+from sqlalchemy.orm import Session
+
+from database import AiSummaryResponse, HistoryContent, QuestionAnswerPair, SummaryHistory
+
+Row = Dict[str, Any]
+
+
+@dataclass
+class ChatHistoryRows:
+    """要約と一緒に保存する ai_chat の履歴"""
+    content: str # チャット履歴（JSON 文字列）
+    embedding: Optional[str] # 質問の埋め込み（JSON 文字列）
+    ai_summary: Optional[str] = None # AI の回答をまとめた要約（AiSummaryResponse）
+    question_answer_pairs: List[Row] = field(default_factory=list) # position, question, answer, category, asked_at
+
+
+@dataclass
+class QuestionSummaryRows:
+    """質問単位の要約（user_question_summary）1件分"""
+    summary_history_id: int
+    content: str # 保存する要約（ユーザー提供または AI 生成）
+    question_text: Optional[str]
+    ai_answer_text: Optional[str]
+    ai_summary: str # AI 生成の要約（AiSummaryResponse）
+
+
+def reserve_ids(db: Session, counts: Dict[Type, int]) -> Dict[Type, List[int]]:
+    """モデルごとに指定した件数の ID をシーケンスから予約する（1回の問い合わせ）"""
+    models = list(counts)
+    selects = []
+    params: Dict[str, Any] = {}
+    for index, model in enumerate(models):
+        if counts[model] <= 0:
+            continue
+        selects.append(
+            f"SELECT {index} AS model_index, nextval(pg_get_serial_sequence(:table_{index}, 'id')) AS id "
+            f"FROM generate_series(1, :count_{index})"
+        )
+        params[f"table_{index}"] = model.__tablename__
+        params[f"count_{index}"] = counts[model]
+
+    reserved: Dict[Type, List[int]] = {model: [] for model in models}
+    if selects:
+        for model_index, reserved_id in db.execute(text(" UNION ALL ".join(selects)), params):
+            reserved[models[model_index]].append(reserved_id)
+    return reserved
+
+
+def insert_rows(db: Session, model: Type, rows: Sequence[Row]):
+    if rows:
+        db.execute(insert(model.__table__), list(rows))
+
+
+def insert_summary(db: Session, summary: Row, chat: Optional[ChatHistoryRows], now: datetime) -> int:
+    """要約と、その ai_chat の履歴・回答の要約・質問と回答のペアを保存し、要約の ID を返す"""
+    qa_pairs = chat.question_answer_pairs if chat else []
+    ids = reserve_ids(db, {
+        SummaryHistory: 1,
+        HistoryContent: 1 if chat else 0,
+        AiSummaryResponse: 1 if chat and chat.ai_summary is not None else 0,
+        QuestionAnswerPair: len(qa_pairs),
+    })
+    summary_id = ids[SummaryHistory][0]
+    chat_content_id = ids[HistoryContent][0] if chat else None
+
+    insert_rows(db, SummaryHistory, [{**summary, "id": summary_id, "chat_history_id": chat_content_id}])
+    if chat:
+        insert_rows(db, HistoryContent, [{
+            "id": chat_content_id,
+            "summary_history_id": summary_id,
+            "section_type": "ai_chat",
+            "content": chat.content,
+            "embedding": chat.embedding,
+            "qa_extracted_at": now,
+            "created_at": now,
+            "updated_at": now,
+        }])
+        insert_rows(db, AiSummaryResponse, [
+            {
+                "id": response_id,
+                "summary_history_id": summary_id,
+                "original_history_content_id": chat_content_id,
+                "summarized_content": chat.ai_summary,
+                "created_at": now,
+            }
+            for response_id in ids[AiSummaryResponse]
+        ])
+        insert_rows(db, QuestionAnswerPair, [
+            {**qa_pair, "id": pair_id, "summary_history_id": summary_id, "history_content_id": chat_content_id}
+            for pair_id, qa_pair in zip(ids[QuestionAnswerPair], qa_pairs)
+        ])
+    return summary_id
+
+
+def insert_question_summaries(db: Session, items: Sequence[QuestionSummaryRows], now: datetime) -> List[int]:
+    """質問単位の要約とその AiSummaryResponse をまとめて保存し、HistoryContent の ID を items の順で返す"""
+    ids = reserve_ids(db, {HistoryContent: len(items), AiSummaryResponse: len(items)})
+    content_ids = ids[HistoryContent]
+
+    insert_rows(db, HistoryContent, [
+        {
+            "id": content_id,
+            "summary_history_id": item.summary_history_id,
+            "section_type": "user_question_summary", # 質問単位の要約であることを示す
+            "content": item.content,
+            "question_text": item.question_text,
+            "ai_answer_text": item.ai_answer_text,
+            "created_at": now,
+            "updated_at": now,
+        }
+        for content_id, item in zip(content_ids, items)
+    ])
+    insert_rows(db, AiSummaryResponse, [
+        {
+            "id": response_id,
+            "summary_history_id": item.summary_history_id,
+            "original_history_content_id": content_id,
+            "summarized_content": item.ai_summary,
+            "created_at": now,
+        }
+        for response_id, content_id, item in zip(ids[AiSummaryResponse], content_ids, items)
+    ])
+    return content_ids
@@ -0,0 +1,110 @@
+"""読み取りが中心の API の条件付きリクエスト（ETag / If-None-Match）とレスポンスのキャッシュ
+
+ETag は cache_versions のバージョンから作る。書き込み側のエンドポイントは、応答の内容が変わる対象（scope）の
+バージョンを同じトランザクションで bump() する。読み取り側は権限を確認したあと、バージョンだけを1回の問い合わせで読み、
+If-None-Match と一致すれば本文を組み立てずに 304 を返す。
+
+RESPONSE_CACHE_TTL_SECONDS が 1 以上なら、JSON 化した本文を共有キャッシュ（cache.py）に ETag をキーに含めて保存する。
+バージョンが変われば別のキーになるため、どのワーカーで書き込んでも古い本文は使われない（古いキーは TTL で消える）。
+"""
+import hashlib
+import os
+from typing import Any, Callable, List, Optional, Sequence
+
+from fastapi.responses import Response
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import func
+
+from cache import cache
+from database import CacheVersion
+from responses import dumps
+
+# 0 ならレスポンスのキャッシュは使わない（ETag と 304 だけ）
+RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "0"))
+
+_responses = cache.namespace("responses", ttl=RESPONSE_CACHE_TTL_SECONDS)
+
+
+def summary_scope(summary_id: int) -> str:
+    """要約の詳細と、その履歴コンテンツ"""
+    return f"summary:{summary_id}"
+
+
+def team_files_scope(team_id: int) -> str:
+    return f"team:{team_id}:files"
+
+
+def team_members_scope(team_id: int) -> str:
+    return f"team:{team_id}:members"
+
+
+def user_teams_scope(user_id: int) -> str:
+    return f"user:{user_id}:teams"
+
+
+def user_summaries_scope(user_id: int) -> str:
+    """ユーザーが作成した要約の一覧（/api/summaries）"""
+    return f"user:{user_id}:summaries"
+
+
+def team_summaries_scope(team_id: int) -> str:
+    return f"team:{team_id}:summaries"
+
+
+def summary_list_scopes(user_id: int, team_id: Optional[int]) -> List[str]:
+    """要約の作成・変更で一覧が変わる scope（作成者と、共有先のチーム）"""
+    scopes = [user_summaries_scope(user_id)]
+    if team_id is not None:
+        scopes.append(team_summaries_scope(team_id))
+    return scopes
+
+
+def bump(db: Session, *scopes: str):
+    """scope のバージョンを1増やす（コミットは呼び出し側）"""
+    for scope in sorted(set(scopes)): # 同時に bump するトランザクションどうしでロックの順序をそろえる
+        db.execute(insert(CacheVersion).values(scope=scope, version=1).on_conflict_do_update(
+            index_elements=[CacheVersion.scope],
+            set_={"version": CacheVersion.version + 1, "updated_at": func.now()}
+        ))
+
+
+def current_etag(db: Session, scopes: Sequence[str], *extra: Any) -> str:
+    """scope のバージョン（と、応答を左右するその他の値）から ETag を作る"""
+    versions = dict(db.query(CacheVersion.scope, CacheVersion.version).filter(CacheVersion.scope.in_(scopes)).all())
+    key = ";".join(f"{scope}={versions.get(scope, 0)}" for scope in scopes)
+    if extra:
+        key += ";" + ";".join(str(value) for value in extra)
+    return '"' + hashlib.sha256(key.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(header: Optional[str], etag: str) -> bool:
+    """If-Match / If-None-Match のいずれかの値が etag と一致するか（弱い比較）"""
+    if not header:
+        return False
+    for value in header.split(","):
+        value = value.strip()
+        if value == "*" or value.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
+
+
+def json_response(body: bytes, etag: str) -> Response:
+    # 毎回 If-None-Match で確認させる（304 なら本文は送らない）
+    return Response(content=body, media_type="application/json", headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+
+async def cached_json_response(key: str, etag: str, build: Callable[[], Any]) -> Response:
+    """build() の結果を JSON 化した ETag 付きのレスポンスを返す。同じ ETag の本文がキャッシュにあれば build() を呼ばない"""
+    if RESPONSE_CACHE_TTL_SECONDS <= 0:
+        return json_response(dumps(build()), etag)
+
+    async def load() -> bytes:
+        return dumps(build())
+    version = etag.strip('"')
+    body = await _responses.get_or_load_bytes(f"{key}:{version}", load)
+    return json_response(body, etag)
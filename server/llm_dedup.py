@@ -0,0 +1,96 @@
+"""Gemini 呼び出しの重複排除（single-flight）と短期間の応答キャッシュ
+
+同じチームの複数人が同じ要約についてチャットした場合やクライアントの再送など、同じプロンプトの呼び出しが
+同時に来たときは、上流（Gemini）への呼び出しを1回にまとめて結果を共有する。まとめるのはワーカー内だけ。
+
+cache_ttl > 0 を指定した呼び出しは、応答の本文（text）を正規化したプロンプトのハッシュをキーにして共有キャッシュ
+（cache.py）に保存し、期限内の同じプロンプトには上流を呼ばずに返す。カテゴリ生成のような決定的なプロンプト向け。
+cache_ttl = 0 の呼び出しはキャッシュを読み書きしない（同時の呼び出しをまとめるだけ）。
+"""
+import asyncio
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import metrics
+from cache import CacheNamespace
+
+# 決定的なプロンプト（カテゴリ生成、テキストの要約）の応答をキャッシュする秒数
+GEMINI_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", "600"))
+# チャットの応答をキャッシュする秒数（再送や同じ質問の連続をまとめる程度に短くする。0 で無効）
+GEMINI_CHAT_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CHAT_CACHE_TTL_SECONDS", "30"))
+
+
+@dataclass
+class CachedResponse:
+    """キャッシュから返す応答。呼び出し元は text だけを使う"""
+    text: str
+    candidates: Optional[list] = None
+
+
+def _normalize(value: Any) -> Any:
+    """ハッシュ用にプロンプトを正規化する（改行コードと前後の空白を揃え、バイト列はハッシュに置き換える）"""
+    if isinstance(value, str):
+        return value.replace("\r\n", "\n").strip()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"sha256": hashlib.sha256(value).hexdigest()}
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    if value is None or isinstance(value, (int, float, bool)):
+        return value
+    raise TypeError(f"unsupported prompt part: {type(value).__name__}")
+
+
+def prompt_key(model: str, contents: Any) -> Optional[str]:
+    """モデルと正規化したプロンプトのハッシュ。ハッシュできない内容（SDK のオブジェクトなど）なら None"""
+    try:
+        normalized = _normalize(contents)
+    except TypeError:
+        return None
+    payload = json.dumps([model, normalized], ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _response_text(response: Any) -> Optional[str]:
+    if getattr(response, "text", None):
+        return response.text
+    return None
+
+
+class ResponseDeduplicator:
+    def __init__(self, responses: CacheNamespace, model: str):
+        self.responses = responses
+        self.model = model
+        self._in_flight: Dict[str, "asyncio.Task[Any]"] = {}
+
+    async def generate(self, call: Callable[[Any], Awaitable[Any]], contents: Any, cache_ttl: float = 0) -> Any:
+        key = prompt_key(self.model, contents)
+        if key is None:
+            metrics.gemini_dedup_outcomes.inc(outcome="bypass")
+            return await call(contents)
+
+        if cache_ttl > 0:
+            cached = await self.responses.get_bytes(key)
+            if cached is not None:
+                metrics.gemini_dedup_outcomes.inc(outcome="hit")
+                return CachedResponse(text=cached.decode("utf-8"))
+
+        task = self._in_flight.get(key)
+        if task is not None:
+            metrics.gemini_dedup_outcomes.inc(outcome="coalesced")
+        else:
+            metrics.gemini_dedup_outcomes.inc(outcome="miss")
+            task = asyncio.ensure_future(call(contents))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # 呼び出し元の1つがキャンセルされても、同じ結果を待っている他の呼び出し元のために上流の呼び出しは続ける
+        response = await asyncio.shield(task)
+
+        text = _response_text(response)
+        if cache_ttl > 0 and text:
+            await self.responses.set_bytes(key, text.encode("utf-8"), cache_ttl)
+        return response
@@ -0,0 +1,111 @@
+"""ログ設定（JSON 形式の構造化ログ、モジュールごとのレベル、キュー経由の非同期出力、サンプリング）
+
+環境変数:
+    LOG_LEVEL   既定のレベル（既定値 INFO）
+    LOG_LEVELS  モジュールごとのレベル。例: "main=DEBUG,sqlalchemy.engine=WARNING"
+    LOG_FORMAT  "json"（既定）または "text"
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# LogRecord の標準属性（これ以外は extra= で渡された構造化フィールドとして出力する）
+_STANDARD_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_listener_pid: Optional[int] = None
+_configure_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """1レコードを1行の JSON として出力する"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat().replace('+00:00', 'Z'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _STANDARD_RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """キューが溢れたときはリクエスト処理を止めずにレコードを捨てる"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def parse_module_levels(spec: str) -> Dict[str, int]:
+    """LOG_LEVELS の値（例: main=DEBUG,sqlalchemy.engine=WARNING）をロガー名とレベルの辞書に変換する"""
+    levels: Dict[str, int] = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        level_value = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level_value, int):
+            levels[name.strip()] = level_value
+    return levels
+
+
+def configure_logging():
+    """ルートロガーに QueueHandler を設定し、実際の書き出しはバックグラウンドスレッドで行う
+
+    同じプロセスでは何度呼んでも1回だけ有効。fork 後の子プロセスでは書き出しスレッドを作り直す。
+    """
+    global _listener, _listener_pid
+    with _configure_lock:
+        if _listener is not None and _listener_pid == os.getpid():
+            return
+
+        stream_handler = logging.StreamHandler()
+        if os.getenv("LOG_FORMAT", "json").lower() == "text":
+            stream_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        else:
+            stream_handler.setFormatter(JsonFormatter())
+
+        log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=10000)
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_NonBlockingQueueHandler(log_queue))
+        root.setLevel(logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").upper()))
+
+        for name, level in parse_module_levels(os.getenv("LOG_LEVELS", "")).items():
+            logging.getLogger(name).setLevel(level)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        _listener_pid = os.getpid()
+        atexit.register(_listener.stop)
+
+
+class LogSampler:
+    """要素ごとのログを間引く。最初の first 件と、以降は every 件に1件だけ True を返す"""
+
+    def __init__(self, first: int = 10, every: int = 100):
+        self.first = first
+        self.every = every
+        self.seen = 0
+
+    def sample(self) -> bool:
+        self.seen += 1
+        return self.seen <= self.first or (self.every > 0 and (self.seen - self.first) % self.every == 0)
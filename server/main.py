@@ -1,29 +1,52 @@
 import logging
 import time
 import json
-from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Depends, status, Header, Form
+import asyncio
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File, Depends, status, Header, Form, Query, Body, WebSocket, WebSocketDisconnect, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from passlib.context import CryptContext
+from pydantic import BaseModel, Field
 import uvicorn
 import os
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
-import base64
-from sqlalchemy import or_
+from sqlalchemy import or_, exists, func, select
 from sqlalchemy.orm import Session, joinedload
-from database import Base, engine, SessionLocal, User, UserSession, SummaryHistory, Team, TeamMember, Comment, HistoryContent, SharedFile, Reaction, Message, AiSummaryResponse
+from database import Base, engine, SessionLocal, apply_schema_migrations, User, UserSession, SummaryHistory, Team, TeamMember, Comment, HistoryContent, SharedFile, Reaction, Message, AiSummaryResponse, QuestionAnswerPair, FileChunk, SummaryJob
 # (SQLite-specific migration utilities removed)
 from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
-from typing import Optional, List, Dict, Any, Union, Set
+from typing import Optional, List, Dict, Any, Union, Set, Tuple
 import uuid
-from fastapi.responses import Response
+from fastapi.responses import Response, PlainTextResponse, StreamingResponse
 import re # 追加
 from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 from collections import defaultdict
-from sentence_transformers import SentenceTransformer, util
+from dataclasses import dataclass
+from sentence_transformers import SentenceTransformer
+from embedding_server import EMBEDDING_MODEL_NAME, RemoteEmbeddingModel
+import metrics
+import search
+import pdf_chunks
+import summarization
+import uploads
+import summary_jobs
+import history_writes
+import passwords
+import rate_limits
+import auth_sessions
+import session_state
+import http_cache
+import llm_dedup
+import category_resolver
+from cache import cache
+from auth_sessions import AccessClaims
+from summary_jobs import summary_job_runner
+from team_chat import team_chat_hub
+from graph_assembly import GraphNode, GraphLink, GraphData, GraphNodeDetail, assemble_graph, cluster_similar_questions
+from responses import ORJSONModelResponse, CompressionMiddleware
+from logging_config import configure_logging, LogSampler
 
 import torch # NEW: torchをインポート
 
@@ -33,18 +56,40 @@ embedding_model = None
 def get_embedding_model():
     global embedding_model
     if embedding_model is None:
-        embedding_model = SentenceTransformer('all-mpnet-base-v2')
+        # start_server.py が起動時に設定するので、import 時ではなく呼び出し時に読む
+        socket_path = os.getenv("EMBEDDING_SERVER_SOCKET")
+        if socket_path:
+            # 埋め込みサーバー（start_server.py が起動）が全ワーカー共通のモデルを保持する
+            remote_model = RemoteEmbeddingModel(socket_path)
+            try:
+                remote_model.get_sentence_embedding_dimension()
+                embedding_model = remote_model
+            except (OSError, EOFError, RuntimeError) as e:
+                logger.warning("Embedding server at %s is unavailable (%s); loading model in-process.", socket_path, e)
+        if embedding_model is None:
+            embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
     return embedding_model
 
+def _encode_texts_sync(texts: List[str]):
+    return get_embedding_model().encode(texts, convert_to_tensor=True)
+
+async def encode_texts(texts: List[str]):
+    """テキストのリストをまとめて埋め込み、(len(texts), dim) のテンソルを返す。イベントループは塞がない"""
+    with metrics.timed("embedding"):
+        return await run_in_threadpool(_encode_texts_sync, texts)
+
 # Files are stored in PostgreSQL (SharedFile.content); no local storage is used.
 
-# ログ設定
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+# ログ設定（レベルは LOG_LEVEL / LOG_LEVELS 環境変数で指定）
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Team 20 API", version="1.0.0")
 
 # データベーステーブルを作成（初回起動時のみ作成）
 Base.metadata.create_all(bind=engine)
+apply_schema_migrations()
+metrics.instrument_engine(engine)
 
 # CORS設定 - フロントエンドからのアクセスを許可
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "")
@@ -52,9 +97,9 @@ allowed_origin_regex = os.getenv("ALLOWED_ORIGINS_REGEX", "").strip()
 allowed_origins = [o.strip() for o in allowed_origins_env.split(",") if o.strip()]
 
 # Helpful debug logs
-logging.info(f"CORS: ALLOWED_ORIGINS={allowed_origins}")
+logger.info("CORS: ALLOWED_ORIGINS=%s", allowed_origins)
 if allowed_origin_regex:
-    logging.info(f"CORS: ALLOWED_ORIGINS_REGEX={allowed_origin_regex}")
+    logger.info("CORS: ALLOWED_ORIGINS_REGEX=%s", allowed_origin_regex)
 
 if allowed_origin_regex:
     app.add_middleware(
@@ -64,6 +109,7 @@ if allowed_origin_regex:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag"],
     )
 else:
     app.add_middleware(
@@ -72,18 +118,48 @@ else:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag"],
     )
 
-# ログミドルウェア
+def _route_template(request: Request) -> str:
+    """メトリクスのラベルに使うルートのパステンプレート（/api/summaries/{summary_id} など）"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+# レスポンス圧縮（Accept-Encoding に応じて brotli / gzip、小さいレスポンスはそのまま）
+app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_SIZE", "1024")))
+
+# アップロードの本文サイズの上限（Content-Length が上限を超える場合は本文を読む前に 413 を返す）
+MAX_PDF_UPLOAD_SIZE = 10 * 1024 * 1024
+MAX_SHARED_FILE_UPLOAD_SIZE = 50 * 1024 * 1024
+app.add_middleware(
+    uploads.RequestSizeLimitMiddleware,
+    max_body_size=uploads.UPLOAD_MAX_REQUEST_BYTES,
+    paths=["/api/upload-pdf", "/api/teams/{team_id}/files"],
+)
+
+# ログミドルウェア（ルートごとのレイテンシ・実行中リクエスト数・DBクエリ数を計測）
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    start_time = time.time()
-    
-    response = await call_next(request)
-    
-    process_time = time.time() - start_time
-    
-    
+    start_time = time.perf_counter()
+    method = request.method
+    route = _route_template(request)
+    timings = metrics.start_request()
+    metrics.http_requests_in_flight.inc(method=method, route=route)
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+    finally:
+        process_time = time.perf_counter() - start_time
+        metrics.http_requests_in_flight.dec(method=method, route=route)
+        metrics.http_request_duration.observe(process_time, method=method, route=route, status=str(status_code))
+        metrics.http_request_db_queries.observe(timings.db_queries, method=method, route=route)
+
+    response.headers["Server-Timing"] = timings.server_timing(process_time)
     return response
 
 # データベースセッションの依存性注入
@@ -95,24 +171,38 @@ def get_db():
         db.close()
 
 # .envファイルから環境変数を読み込む
-logging.info("Attempting to load .env file...")
+logger.info("Attempting to load .env file...")
 if load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), '.env')):
-    logging.info(".env file loaded successfully.")
+    logger.info(".env file loaded successfully.")
 else:
-    logging.warning(".env file not found or failed to load.")
+    logger.warning(".env file not found or failed to load.")
 
 # Gemini APIキーを設定
 API_KEY = os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     raise ValueError("GEMINI_API_KEY not found in .env file")
 
-# パスワードハッシュ化のためのコンテキスト
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+GEMINI_MODEL = 'gemini-2.0-flash-001'
+
+async def _call_gemini(contents):
+    client = genai.Client(api_key=API_KEY)
+    with metrics.timed("llm"):
+        return await client.aio.models.generate_content(model=GEMINI_MODEL, contents=contents)
+
+gemini_dedup = llm_dedup.ResponseDeduplicator(cache.namespace("gemini_responses"), GEMINI_MODEL)
+
+async def generate_gemini_content(contents, cache_ttl: float = 0):
+    """Gemini API の generate_content を呼び出す共通関数（所要時間を計測する）
+
+    同じプロンプトの同時の呼び出しは1回にまとめる。cache_ttl > 0 なら応答の本文をその秒数キャッシュする。
+    """
+    return await gemini_dedup.generate(_call_gemini, contents, cache_ttl)
 
 # JWT設定
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-super-secret-jwt-key") # 環境変数またはデフォルトを使用
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# アクセストークンは短命にし、期限切れ後は /api/token/refresh で更新する（ログインの bcrypt を毎回通さない）
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 
 def create_access_token(data: dict, expires_delta: timedelta | None = None):
     to_encode = data.copy()
@@ -137,55 +227,105 @@ def verify_access_token(token: str, credentials_exception):
     except JWTError:
         raise credentials_exception
 
-# 任意認証：ヘッダーからトークンを取得し、ユーザーオブジェクトを返す
-async def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> Optional[User]:
-    if authorization is None:
-        return None
-    
-    token_prefix = "Bearer "
-    if not authorization.startswith(token_prefix):
-        return None # スキームが不正
-        
-    token = authorization.split(" ")[1]
-
+# トークンからユーザー名を取り出す（不正・期限切れの場合は None）
+def get_username_from_token(token: str) -> Optional[str]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            return None
     except JWTError:
         return None
+    return payload.get("sub")
 
-    user = db.query(User).filter(User.username == username).first()
-    return user
-
-# 必須認証：トークンからユーザーオブジェクトを取得する
-def get_required_user(authorization: str = Header(...), db: Session = Depends(get_db)) -> User:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="無効な認証情報です",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    token_prefix = "Bearer "
-    if not authorization.startswith(token_prefix):
-        raise credentials_exception
-        
-    token = authorization.split(" ")[1]
-    
+# トークンからクレーム（ユーザーID・ユーザー名・所属チーム）を取り出す（不正・期限切れ・旧形式の場合は None）
+def get_claims_from_token(token: str) -> Optional[AccessClaims]:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        return None
+    user_id = payload.get("uid")
+    username = payload.get("sub")
+    if not isinstance(user_id, int) or username is None:
+        return None
+    return AccessClaims(
+        id=user_id,
+        username=username,
+        team_ids=[int(team_id) for team_id in payload.get("teams", [])],
+        session_id=payload.get("sid")
+    )
+
+def _bearer_token(authorization: Optional[str]) -> Optional[str]:
+    token_prefix = "Bearer "
+    if authorization is None or not authorization.startswith(token_prefix):
+        return None # スキームが不正
+    return authorization.split(" ")[1]
+
+# 必須認証（DB を引かない）：トークンのクレームだけで認可できるエンドポイント用
+def get_required_claims(authorization: str = Header(...)) -> AccessClaims:
+    token = _bearer_token(authorization)
+    claims = get_claims_from_token(token) if token else None
+    if claims is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="無効な認証情報です",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return claims
+
+# 任意認証：ヘッダーからトークンを取得し、ユーザーオブジェクトを返す
+async def get_current_user(authorization: Optional[str] = Header(None), db: Session = Depends(get_db)) -> Optional[User]:
+    token = _bearer_token(authorization)
+    claims = get_claims_from_token(token) if token else None
+    if claims is None:
+        return None
+    return db.query(User).filter(User.id == claims.id).first()
 
-    user = db.query(User).filter(User.username == username).first()
+# 必須認証：トークンからユーザーオブジェクトを取得する
+def get_required_user(claims: AccessClaims = Depends(get_required_claims), db: Session = Depends(get_db)) -> User:
+    user = db.query(User).filter(User.id == claims.id).first()
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="無効な認証情報です",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
+@dataclass
+class LlmAdmission:
+    """流量制限を通過したリクエスト（バッチの件数分など、追加のコストを charge() で取れる）"""
+    endpoint: str
+    client_key: str
+    client_ip: str
+
+    async def charge(self, cost: float):
+        try:
+            await rate_limits.llm_admission.charge(self.endpoint, self.client_key, self.client_ip, cost)
+        except rate_limits.AdmissionRejected as e:
+            raise _too_many_llm_requests(e)
+
+def _too_many_llm_requests(e: rate_limits.AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="リクエストが混み合っています。しばらくしてから再度お試しください",
+        headers={"Retry-After": e.retry_after_header}
+    )
+
+def llm_admission(endpoint: str, cost: float = 1):
+    """Gemini を呼び出すエンドポイント用の依存関係。ユーザー（未ログインは IP）・IP・全体の流量と同時実行数を制限する"""
+    async def dependency(http_request: Request, authorization: Optional[str] = Header(None)):
+        token = _bearer_token(authorization)
+        claims = get_claims_from_token(token) if token else None
+        client_ip = http_request.client.host if http_request.client else "unknown"
+        admission = LlmAdmission(endpoint, rate_limits.client_key_for(claims.id if claims else None, client_ip), client_ip)
+        try:
+            release = await rate_limits.llm_admission.acquire(endpoint, admission.client_key, client_ip, cost)
+        except rate_limits.AdmissionRejected as e:
+            raise _too_many_llm_requests(e)
+        try:
+            yield admission
+        finally:
+            release()
+    return dependency
+
 
 
 class ChatRequest(BaseModel):
@@ -200,6 +340,9 @@ class LoginRequest(BaseModel):
     username: str
     password: str
 
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
 class RegisterRequest(BaseModel):
     username: str
     password: str
@@ -256,6 +399,12 @@ class HistoryContentCreateRequest(BaseModel):
     ai_answer_text: Optional[str] = None # NEW FIELD
     user_provided_summary: Optional[str] = None # NEW FIELD: ユーザーが提供する要約
 
+# 質問ごとに Gemini を呼ぶので、件数分のトークンを1回で取れる数まで（LLM_BURST_PER_CLIENT が既定値なら10件）
+MAX_QUESTION_SUMMARY_BATCH = rate_limits.max_request_cost()
+
+class QuestionSummaryBatchRequest(BaseModel):
+    items: List[HistoryContentCreateRequest] = Field(..., max_length=MAX_QUESTION_SUMMARY_BATCH)
+
 class HistoryContentResponse(BaseModel):
     id: int
     summary_history_id: int
@@ -290,6 +439,12 @@ class SummaryListItemResponse(BaseModel):
             datetime: lambda dt: dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
         }
 
+class SearchResultResponse(SummaryListItemResponse):
+    score: float # 全文検索スコアとベクトル類似度の重み付き和
+    text_score: float
+    vector_score: float
+    matched_content_id: Optional[int] = None # 最も類似度の高かった HistoryContent の ID
+
 class SummaryHistoryDetailResponse(BaseModel):
     id: int
     user_id: int
@@ -322,6 +477,14 @@ class SharedFileResponse(BaseModel):
             datetime: lambda dt: dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
         }
 
+class SummaryJobResponse(BaseModel):
+    id: str
+    status: str # 'pending', 'running', 'succeeded', 'failed'
+    total_files: int
+    completed_files: int
+    error: Optional[str] = None
+    summary_details: Optional[Dict[str, Any]] = None # 完了時のみ
+
 class MessageCreateRequest(BaseModel):
     content: str
 
@@ -339,35 +502,6 @@ class MessageResponse(BaseModel):
             datetime: lambda dt: dt.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
         }
 
-class GraphNode(BaseModel):
-    id: str
-    label: str
-    type: str # 'summary', 'user_question', 'pdf_file', 'category'
-    summary_id: Optional[int] = None # For chat messages, links back to the summary
-    question_id: Optional[str] = None # For user question nodes, unique ID within the chat
-    ai_answer: Optional[str] = None # For user question nodes, stores the AI's answer
-    ai_answer_summary: Optional[str] = None # NEW FIELD: Stores the summarized AI answer
-    parent_summary_id: Optional[int] = None # NEW FIELD
-    question_created_at: Optional[datetime] = None # NEW FIELD
-    summary_created_at: Optional[datetime] = None # NEW FIELD
-    category: Optional[str] = None # NEW FIELD: Add category to GraphNode
-    history_content_id: Optional[int] = None # NEW FIELD: Reference to HistoryContent.id
-    original_summary_id: Optional[int] = None # NEW FIELD: 質問が紐づく元の要約ID
-    grouped_question_ids: Optional[List[str]] = None # NEW FIELD: 統合された質問ノードのIDリスト
-    original_questions_details: Optional[List[Dict[str, Any]]] = None # NEW FIELD: 統合された質問の詳細
-    file_id: Optional[int] = None # NEW FIELD: For PDF file nodes
-
-
-class GraphLink(BaseModel):
-    source: str
-    target: str
-    type: Optional[str] = None
-    directed: Optional[bool] = True # NEW FIELD: エッジの方向性を示す
-
-class GraphData(BaseModel):
-    nodes: List[GraphNode]
-    links: List[GraphLink]
-
 @app.post("/api/register")
 async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     """ユーザー登録エンドポイント"""
@@ -375,7 +509,7 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     if existing_user:
         raise HTTPException(status_code=400, detail="ユーザー名は既に存在します")
 
-    hashed_password = pwd_context.hash(request.password)
+    hashed_password = await passwords.hash_password(request.password)
     new_user = User(username=request.username, hashed_password=hashed_password)
     db.add(new_user)
     db.commit()
@@ -383,61 +517,172 @@ async def register(request: RegisterRequest, db: Session = Depends(get_db)):
     return {"message": "ユーザー登録成功！", "username": new_user.username}
 
 @app.post("/api/login")
-async def login(request: LoginRequest, db: Session = Depends(get_db)):
+async def login(request: LoginRequest, http_request: Request, db: Session = Depends(get_db)):
     """ユーザーログインエンドポイント"""
     user = db.query(User).filter(User.username == request.username).first()
     if not user:
         raise HTTPException(status_code=401, detail="無効な認証情報です")
 
-    if not pwd_context.verify(request.password, user.hashed_password):
+    client_ip = http_request.client.host if http_request.client else "unknown"
+    try:
+        async with passwords.login_limiter.slot(client_ip):
+            verified, new_hash = await passwords.verify_password(request.password, user.hashed_password)
+    except passwords.TooManyConcurrentLogins:
+        raise HTTPException(status_code=429, detail="ログインの試行が多すぎます。しばらくしてから再度お試しください")
+
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="無効な認証情報です",
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    # BCRYPT_ROUNDS を変更した場合は、ログインに成功したときに新しいコストでハッシュし直す
+    if new_hash is not None:
+        user.hashed_password = new_hash
+
+    session, refresh_token = auth_sessions.create_session(db, user.id)
+    tokens = _token_response(db, user, session.id, refresh_token)
+    db.commit()
+    return tokens
+
+def _access_token_response(db: Session, user: User, session_id: Optional[str]) -> Dict[str, Any]:
+    # 所属チームはクレームにも含める（要約の閲覧の認可は、脱退をすぐに反映するため team_members で行う）
+    team_ids = [team_id for (team_id,) in db.query(TeamMember.team_id).filter(TeamMember.user_id == user.id).all()]
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "uid": user.id, "teams": team_ids, "sid": session_id},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {
+        "access_token": access_token,
+        "token_type": "bearer",
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+    }
+
+def _token_response(db: Session, user: User, session_id: str, refresh_token: str) -> Dict[str, Any]:
+    return {**_access_token_response(db, user, session_id), "refresh_token": refresh_token}
+
+@app.post("/api/token/refresh")
+async def refresh_access_token(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """リフレッシュトークンを新しいアクセストークンとリフレッシュトークンに交換するエンドポイント"""
+    try:
+        session, refresh_token = auth_sessions.rotate_session(db, request.refresh_token)
+    except auth_sessions.RefreshTokenAlreadyRotated:
+        db.rollback()
+        raise HTTPException(status_code=409, detail="トークンは既に更新されています")
+    except auth_sessions.RefreshTokenInvalid:
+        db.commit() # 再利用を検知した場合のセッションの失効を確定させる
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="セッションの有効期限が切れました。再度ログインしてください",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    user = db.query(User).filter(User.id == session.user_id).first()
+    if user is None:
+        db.rollback()
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無効な認証情報です")
+    tokens = _token_response(db, user, session.id, refresh_token)
+    db.commit()
+    return tokens
+
+@app.post("/api/logout")
+async def logout(request: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """リフレッシュトークンのセッションを失効させるエンドポイント（発行済みのアクセストークンは期限まで有効）"""
+    auth_sessions.revoke_session(db, request.refresh_token)
+    db.commit()
+    return {"message": "ログアウトしました"}
+
+def _locked_user_session(db: Session, user_id: int) -> Optional[UserSession]:
+    # 同じユーザーの同時保存を直列化し、version の比較と更新の間に割り込まれないようにする
+    return db.query(UserSession).filter(UserSession.user_id == user_id).with_for_update().first()
+
+def _check_session_precondition(if_match: Optional[str], user_session: Optional[UserSession]):
+    current_version = user_session.version if user_session else 0
+    if if_match is not None and not http_cache.etag_matches(if_match, session_state.session_etag(current_version)):
+        raise HTTPException(
+            status_code=status.HTTP_412_PRECONDITION_FAILED,
+            detail="セッションデータが他で更新されています",
+            headers={"ETag": session_state.session_etag(current_version)}
+        )
+
+def _write_user_session(db: Session, user_id: int, user_session: Optional[UserSession], document: Any) -> int:
+    """スナップショットが変わった場合だけ保存して version を進め、現在の version を返す"""
+    snapshot = session_state.dump_snapshot(document)
+    if user_session is None:
+        user_session = UserSession(user_id=user_id, session_data=snapshot, version=1)
+        db.add(user_session)
+    elif user_session.session_data != snapshot:
+        user_session.session_data = snapshot
+        user_session.version += 1
+    db.commit()
+    return user_session.version
+
+def _session_saved_response(version: int) -> Response:
+    return ORJSONModelResponse(
+        {"message": "セッションデータが正常に保存されました", "version": version},
+        headers={"ETag": session_state.session_etag(version)}
     )
-    return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/api/session")
 async def save_user_session(
     request: SessionDataRequest,
-    current_user: User = Depends(get_required_user),
+    if_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db)
 ):
-    """ユーザーのセッションデータを保存または更新するエンドポイント"""
-    user_session = db.query(UserSession).filter(UserSession.user_id == current_user.id).first()
+    """ユーザーのセッションデータを丸ごと保存するエンドポイント（内容が変わらなければ書き込まない）"""
+    try:
+        document = json.loads(request.session_data)
+    except json.JSONDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="session_data が JSON ではありません")
+
+    user_session = _locked_user_session(db, current_user.id)
+    _check_session_precondition(if_match, user_session)
+    return _session_saved_response(_write_user_session(db, current_user.id, user_session, document))
+
+@app.patch("/api/session")
+async def patch_user_session(
+    operations: List[Dict[str, Any]] = Body(...),
+    if_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db)
+):
+    """セッションデータに JSON Patch（RFC 6902）の差分を適用するエンドポイント。If-Match で前回同期した ETag を指定する"""
+    if if_match is None:
+        raise HTTPException(status_code=status.HTTP_428_PRECONDITION_REQUIRED, detail="If-Match ヘッダーが必要です")
 
-    if user_session:
-        user_session.session_data = request.session_data
-    else:
-        user_session = UserSession(user_id=current_user.id, session_data=request.session_data)
-        db.add(user_session)
-    
-    db.commit()
-    db.refresh(user_session)
-    return {"message": "セッションデータが正常に保存されました"}
+    user_session = _locked_user_session(db, current_user.id)
+    _check_session_precondition(if_match, user_session)
+    current = session_state.load_snapshot(user_session.session_data if user_session else None)
+    try:
+        document = session_state.apply_patch(current, operations)
+    except session_state.JsonPatchInvalid as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    except session_state.JsonPatchConflict as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return _session_saved_response(_write_user_session(db, current_user.id, user_session, document))
 
 @app.get("/api/session")
 async def get_user_session(
-    current_user: User = Depends(get_required_user),
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db)
 ):
-    """ユーザーのセッションデータを取得するエンドポイント"""
+    """ユーザーのセッションデータを取得するエンドポイント（If-None-Match が現在の ETag と一致すれば 304）"""
     user_session = db.query(UserSession).filter(UserSession.user_id == current_user.id).first()
+    version = user_session.version if user_session else 0
+    etag = session_state.session_etag(version)
+    if http_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
 
-    if user_session:
-        return {"session_data": user_session.session_data}
-    else:
-        return {"session_data": "{}"} # データがない場合は空のJSONを返す
+    session_data = user_session.session_data if user_session else "{}" # データがない場合は空のJSONを返す
+    return ORJSONModelResponse({"session_data": session_data, "version": version}, headers={"ETag": etag})
 
 
 @app.post("/api/teams")
-async def create_team(request: TeamCreateRequest, current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
-    """チーム作成エンドポイント"""
+async def create_team(request: TeamCreateRequest, current_user: User = Depends(get_required_user), claims: AccessClaims = Depends(get_required_claims), db: Session = Depends(get_db)):
+    """チーム作成エンドポイント（作成者の所属チームが変わるので、新しいアクセストークンも返す）"""
     existing_team = db.query(Team).filter(Team.name == request.name).first()
     if existing_team:
         raise HTTPException(status_code=400, detail="チーム名は既に存在します")
@@ -450,9 +695,14 @@ async def create_team(request: TeamCreateRequest, current_user: User = Depends(g
     # チーム作成者を管理者として追加
     new_team_member = TeamMember(user_id=current_user.id, team_id=new_team.id, role="admin")
     db.add(new_team_member)
+    http_cache.bump(db, http_cache.user_teams_scope(current_user.id), http_cache.team_members_scope(new_team.id))
     db.commit()
+    await team_member_ids_cache.invalidate(str(new_team.id))
 
-    return {"message": "チームが正常に作成されました", "team_id": new_team.id, "team_name": new_team.name}
+    return {
+        "message": "チームが正常に作成されました", "team_id": new_team.id, "team_name": new_team.name,
+        **_access_token_response(db, current_user, claims.session_id)
+    }
 
 @app.post("/api/teams/{team_id}/members")
 async def add_team_member(team_id: int, member_username: str = Form(...), current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
@@ -486,13 +736,15 @@ async def add_team_member(team_id: int, member_username: str = Form(...), curren
     # メンバーを追加
     new_member = TeamMember(user_id=user_to_add.id, team_id=team_id, role="member")
     db.add(new_member)
+    http_cache.bump(db, http_cache.team_members_scope(team_id), http_cache.user_teams_scope(user_to_add.id))
     db.commit()
+    await team_member_ids_cache.invalidate(str(team_id))
 
     return {"message": f"{member_username}をチームに追加しました", "team_id": team_id, "user_id": user_to_add.id}
 
 @app.delete("/api/teams/{team_id}/members/{user_id}")
-async def remove_team_member(team_id: int, user_id: int, current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
-    """チームからメンバーを削除するエンドポイント"""
+async def remove_team_member(team_id: int, user_id: int, current_user: User = Depends(get_required_user), claims: AccessClaims = Depends(get_required_claims), db: Session = Depends(get_db)):
+    """チームからメンバーを削除するエンドポイント（自分自身を削除した場合は、新しいアクセストークンも返す）"""
     # チームが存在するか確認
     team = db.query(Team).filter(Team.id == team_id).first()
     if not team:
@@ -524,9 +776,14 @@ async def remove_team_member(team_id: int, user_id: int, current_user: User = De
             raise HTTPException(status_code=400, detail="最後の管理者を削除することはできません")
 
     db.delete(member_to_remove)
+    http_cache.bump(db, http_cache.team_members_scope(team_id), http_cache.user_teams_scope(user_id))
     db.commit()
+    await team_member_ids_cache.invalidate(str(team_id))
 
-    return {"message": "チームメンバーを削除しました", "team_id": team_id, "user_id": user_id}
+    response = {"message": "チームメンバーを削除しました", "team_id": team_id, "user_id": user_id}
+    if user_id == current_user.id:
+        response.update(_access_token_response(db, current_user, claims.session_id))
+    return response
 
 @app.put("/api/teams/{team_id}/members/{user_id}/role")
 async def update_team_member_role(team_id: int, user_id: int, new_role: str = Form(...), current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
@@ -566,38 +823,39 @@ async def update_team_member_role(team_id: int, user_id: int, new_role: str = Fo
             raise HTTPException(status_code=400, detail="最後の管理者を降格させることはできません")
 
     member_to_update.role = new_role
+    http_cache.bump(db, http_cache.team_members_scope(team_id), http_cache.user_teams_scope(user_id))
     db.commit()
 
     return {"message": f"{member_to_update.user_id}の役割を{new_role}に更新しました", "team_id": team_id, "user_id": user_id, "new_role": new_role}
 
 @app.get("/api/teams/{team_id}/members")
-async def get_team_members(team_id: int, current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
-    """チームのメンバーリストを取得するエンドポイント"""
-    # チームが存在するか確認
-    team = db.query(Team).filter(Team.id == team_id).first()
-    if not team:
-        raise HTTPException(status_code=404, detail="チームが見つかりません")
-
-    # 現在のユーザーがチームのメンバーであるか確認
-    current_user_membership = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
-    if not current_user_membership:
-        raise HTTPException(status_code=403, detail="このチームのメンバーではありません")
+async def get_team_members(
+    team_id: int,
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db)
+):
+    """チームのメンバーリストを取得するエンドポイント（ETag が一致すれば 304）"""
+    await _require_team_member(db, current_user, team_id, "このチームのメンバーではありません")
 
-    # チームメンバーとそのユーザー情報を取得
-    team_members = db.query(TeamMember, User).join(User).filter(
-        TeamMember.team_id == team_id
-    ).all()
+    scopes = [http_cache.team_members_scope(team_id)]
+    etag = http_cache.current_etag(db, scopes)
+    if http_cache.etag_matches(if_none_match, etag):
+        return http_cache.not_modified(etag)
 
-    # 必要な情報だけを抽出して返す
-    members_data = [
-        {"user_id": member.user_id, "username": user.username, "role": member.role}
-        for member, user in team_members
-    ]
+    def build():
+        # チームメンバーとそのユーザー名を取得
+        team_members = db.query(TeamMember.user_id, TeamMember.role, User.username).join(User).filter(
+            TeamMember.team_id == team_id
+        ).all()
 
-    return members_data
+        # 必要な情報だけを抽出して返す
+        members_data = [
+            {"user_id": member.user_id, "username": member.username, "role": member.role}
+            for member in team_members
+        ]
+        return members_data
+    return await http_cache.cached_json_response(f"team:{team_id}:members", etag, build)
 
 @app.get("/")
 async def root():
@@ -609,100 +867,179 @@ async def protected_route(token: str = Depends(verify_access_token)):
     """保護されたエンドポイント - JWT認証が必要"""
     return {"message": f"認証成功！ユーザー: {token}"}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 形式のメトリクス（ワーカープロセスごとの値）"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
 @app.get("/api/health")
 async def health_check():
     """ヘルスチェック用エンドポイント"""
     return {"status": "healthy", "message": "サーバーは正常に動作しています"}
 
+def _ingest_shared_file_chunks_sync(file_id: int):
+    """共有ファイルのテキストを抽出・分割・埋め込みして file_chunks に保存する（保存済みなら何もしない）
+
+    同じファイルを同時に処理しないよう SharedFile の行をロックする。ロックを握ったまま await しないよう、
+    ロックから保存までをこの関数（スレッドプール）の中で完結させる。他で処理中のファイルは読み飛ばす。
+    テキストを抽出できないファイルもチャンク0件で chunked_at を記録し、以後は PDF 全体を送る。
+    """
+    db = SessionLocal()
+    try:
+        shared_file = db.query(SharedFile).filter(SharedFile.id == file_id).with_for_update(skip_locked=True).first()
+        if not shared_file or shared_file.chunked_at is not None:
+            return
+
+        try:
+            chunks = pdf_chunks.chunk_file(shared_file.filename, shared_file.content)
+        except pdf_chunks.TextExtractionUnavailable as e:
+            logger.warning("Skipping text extraction for shared file %s: %s", file_id, e)
+            chunks = []
+        if chunks:
+            with metrics.timed("embedding"):
+                embeddings = _encode_texts_sync([chunk.text for chunk in chunks])
+        else:
+            embeddings = []
+        db.add_all([
+            FileChunk(
+                shared_file_id=shared_file.id,
+                chunk_index=chunk_index,
+                page_number=chunk.page_number,
+                content=chunk.text,
+                embedding=json.dumps(embedding.cpu().tolist())
+            )
+            for chunk_index, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+        ])
+        shared_file.chunked_at = datetime.now(timezone.utc)
+        db.commit()
+        logger.info("Chunked shared file %s into %s chunks", file_id, len(chunks))
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to chunk shared file %s: %s", file_id, e)
+    finally:
+        db.close()
+
+
+async def ingest_shared_file_chunks(file_id: int):
+    """アップロード後のバックグラウンドタスク。処理はスレッドプールで行う"""
+    await run_in_threadpool(_ingest_shared_file_chunks_sync, file_id)
+
+
+async def _build_file_context(db: Session, file_ids: List[Union[int, str]], question: str) -> Tuple[List[FileChunk], List[Dict[str, Any]]]:
+    """質問に関連するチャンクと、チャンクを使えないファイルの PDF パーツを返す
+
+    チャンクが保存されていないファイルは、今回は PDF 全体を送り、チャンクへの分割はバックグラウンドで行う。
+    テキストを抽出できなかったファイルは従来どおり PDF 全体を送る。
+    """
+    ids: List[int] = []
+    for fid in file_ids:
+        try:
+            if int(fid) not in ids:
+                ids.append(int(fid))
+        except (TypeError, ValueError):
+            logger.warning("Ignoring invalid shared file id: %s", fid)
+    if not ids:
+        return [], []
+
+    for file_id, chunked_at in db.query(SharedFile.id, SharedFile.chunked_at).filter(SharedFile.id.in_(ids)).all():
+        if chunked_at is None:
+            # 応答を待たせないよう、完了を待たない（処理中のファイルは _ingest_shared_file_chunks_sync が読み飛ばす）
+            asyncio.get_running_loop().run_in_executor(None, _ingest_shared_file_chunks_sync, file_id)
+
+    chunk_rows = db.query(FileChunk).filter(FileChunk.shared_file_id.in_(ids)).all()
+    chunked_file_ids = {row.shared_file_id for row in chunk_rows}
+
+    selected_chunks: List[FileChunk] = []
+    if chunk_rows:
+        try:
+            query_embedding = (await encode_texts([question]))[0]
+            selected_chunks = await run_in_threadpool(pdf_chunks.select_top_chunks, query_embedding, chunk_rows)
+        except Exception as e:
+            # 埋め込みが使えない場合は PDF 全体を送る
+            logger.warning("Chunk retrieval failed, sending whole files instead: %s", e)
+            chunked_file_ids = set()
+
+    pdf_parts = []
+    for fid in ids:
+        if fid in chunked_file_ids:
+            continue
+        sf = db.query(SharedFile).filter(SharedFile.id == fid).first()
+        if sf and sf.content:
+            # バイト列のまま渡す（base64 への変換は SDK がリクエストの送信時に行う）
+            pdf_parts.append({'inline_data': {'mime_type': 'application/pdf', 'data': sf.content}})
+            logger.debug("Using whole PDF content from DB: file_id=%s", fid)
+        else:
+            logger.warning("SharedFile not found or empty content: file_id=%s", fid)
+
+    return selected_chunks, pdf_parts
+
+
+async def _answer_with_files(db: Session, file_ids: List[Union[int, str]], summary_text: str, question: str, cache_ttl: float = 0) -> Optional[str]:
+    """ファイルの関連箇所と要約を使って質問に答える。参照できるファイルが無い場合は None"""
+    selected_chunks, pdf_parts = await _build_file_context(db, file_ids, question)
+    if not selected_chunks and not pdf_parts:
+        return None
+
+    filenames = dict(db.query(SharedFile.id, SharedFile.filename).filter(
+        SharedFile.id.in_(list({chunk.shared_file_id for chunk in selected_chunks}))
+    ).all()) if selected_chunks else {}
+    # 抜粋はファイル内の順番に並べる
+    excerpts = "\n\n".join(
+        f"[{filenames.get(chunk.shared_file_id, '')} p.{chunk.page_number}]\n{chunk.content}"
+        for chunk in sorted(selected_chunks, key=lambda chunk: (chunk.shared_file_id, chunk.chunk_index))
+    )
+    logger.debug("Chat context: %s chunks (%s chars), %s whole PDFs", len(selected_chunks), len(excerpts), len(pdf_parts))
+
+    prompt = "以下のPDFファイルの内容と要約を参考に質問に答えてください。より詳細な情報が必要な場合はPDFファイルの内容を優先してください。"
+    if excerpts:
+        prompt += f"\n\nPDFファイルから質問に関連する箇所を抜粋したもの:\n{excerpts}"
+    prompt += f"\n\n要約:\n{summary_text}\n\n質問:\n{question}"
+
+    response = await generate_gemini_content([{'parts': [{'text': prompt}] + pdf_parts}], cache_ttl)
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    elif hasattr(response, 'candidates') and response.candidates:
+        return response.candidates[0].content.parts[0].text
+    return None
+
+
 @app.post("/api/chat")
-async def chat(request: ChatRequest, db: Session = Depends(get_db)):
-    """チャットエンドポイント"""
+async def chat(request: ChatRequest, db: Session = Depends(get_db), _admission: LlmAdmission = Depends(llm_admission("chat")),
+               cache_control: Optional[str] = Header(None)):
+    """チャットエンドポイント
+
+    関連PDFがある場合は、質問に関連するチャンクだけを要約と一緒に送る（PDF全体は送らない）。
+    同じプロンプトの応答は GEMINI_CHAT_CACHE_TTL_SECONDS の間キャッシュする（Cache-Control: no-cache で使わない）。
+    """
+    cache_ttl = 0 if cache_control and "no-cache" in cache_control.lower() else llm_dedup.GEMINI_CHAT_CACHE_TTL_SECONDS
 
-    client = genai.Client(api_key=API_KEY)
     try:
         # summary_idが指定されていて、関連PDFをDBから参照する場合
         if request.summary_id:
             summary = db.query(SummaryHistory).filter(SummaryHistory.id == request.summary_id).first()
             if summary and summary.original_file_path:
-                logging.info(f"summary.original_file_path: {summary.original_file_path}")
+                logger.debug("summary.original_file_path: %s", summary.original_file_path)
                 try:
                     # original_file_pathをJSON文字列からリストに変換（SharedFileのIDの配列を想定）
                     file_ids = json.loads(summary.original_file_path)
                     if not isinstance(file_ids, list):
                         file_ids = [file_ids]
-                    logging.info(f"Deserialized file_ids: {file_ids}")
-
-                    pdf_parts = []
-                    for fid in file_ids:
-                        try:
-                            sf = db.query(SharedFile).filter(SharedFile.id == int(fid)).first()
-                            if sf and sf.content:
-                                base64_content = await run_in_threadpool(lambda: base64.b64encode(sf.content).decode('utf-8'))
-                                pdf_parts.append({'inline_data': {'mime_type': 'application/pdf', 'data': base64_content}})
-                                logging.info(f"Using PDF content from DB: file_id={fid}")
-                            else:
-                                logging.warning(f"SharedFile not found or empty content: file_id={fid}")
-                        except Exception as e:
-                            logging.warning(f"Failed to load SharedFile content for id={fid}: {e}")
-
-                    if pdf_parts:  # PDFファイルが1つ以上存在する場合
-                        contents_parts = [
-                            {'text': f"以下のPDFファイルの内容と要約を参考に質問に答えてください。より詳細な情報が必要な場合はPDFファイルの内容を優先してください。\n\n要約:\n{request.pdf_summary or summary.summary}\n\n質問:\n{request.message}"},
-                        ]
-                        contents_parts.extend(pdf_parts)  # PDFデータを追加
-
-                        response = await client.aio.models.generate_content(
-                            model='gemini-2.0-flash-001',
-                            contents=[
-                                {'parts': contents_parts}
-                            ]
-                        )
-
-                        if hasattr(response, 'text') and response.text:
-                            return {"reply": response.text}
-                        elif hasattr(response, 'candidates') and response.candidates:
-                            return {"reply": response.candidates[0].content.parts[0].text}
+                    logger.debug("Deserialized file_ids: %s", file_ids)
 
+                    reply = await _answer_with_files(db, file_ids, request.pdf_summary or summary.summary, request.message, cache_ttl)
+                    if reply:
+                        return {"reply": reply}
                 except Exception as pdf_error:
-                    logging.error(f"Error processing PDF file: {str(pdf_error)}")
+                    logger.error("Error processing PDF file: %s", pdf_error)
                     # PDFファイルの読み込みに失敗した場合は要約のみで処理
         elif request.original_file_paths: # original_file_paths が指定されている場合（SharedFileのIDの配列を想定）
-            logging.info(f"request.original_file_paths: {request.original_file_paths}")
+            logger.debug("request.original_file_paths: %s", request.original_file_paths)
             try:
-                file_ids = request.original_file_paths
-                pdf_parts = []
-                for fid in file_ids:
-                    try:
-                        sf = db.query(SharedFile).filter(SharedFile.id == int(fid)).first()
-                        if sf and sf.content:
-                            base64_content = await run_in_threadpool(lambda: base64.b64encode(sf.content).decode('utf-8'))
-                            pdf_parts.append({'inline_data': {'mime_type': 'application/pdf', 'data': base64_content}})
-                            logging.info(f"Using PDF content from DB (request): file_id={fid}")
-                        else:
-                            logging.warning(f"SharedFile not found or empty content (request): file_id={fid}")
-                    except Exception as e:
-                        logging.warning(f"Failed to load SharedFile content for id={fid} from request: {e}")
-
-                if pdf_parts: # PDFファイルが1つ以上存在する場合
-                    contents_parts = [
-                        {'text': f"以下のPDFファイルの内容と要約を参考に質問に答えてください。より詳細な情報が必要な場合はPDFファイルの内容を優先してください。\n\n要約:\n{request.pdf_summary or ''}\n\n質問:\n{request.message}"},
-                    ]
-                    contents_parts.extend(pdf_parts) # PDFデータを追加
-
-                    response = await client.aio.models.generate_content(
-                        model='gemini-2.0-flash-001',
-                        contents=[
-                            {'parts': contents_parts}
-                        ]
-                    )
-                
-                if hasattr(response, 'text') and response.text:
-                    return {"reply": response.text}
-                elif hasattr(response, 'candidates') and response.candidates:
-                    return {"reply": response.candidates[0].content.parts[0].text}
-            
+                reply = await _answer_with_files(db, request.original_file_paths, request.pdf_summary or '', request.message, cache_ttl)
+                if reply:
+                    return {"reply": reply}
             except Exception as pdf_error:
-                logging.error(f"Error processing PDF file from request.original_file_paths: {str(pdf_error)}")
+                logger.error("Error processing PDF file from request.original_file_paths: %s", pdf_error)
                 # PDFファイルの読み込みに失敗した場合は要約のみで処理
         
         # 従来の要約のみの処理
@@ -710,29 +1047,23 @@ async def chat(request: ChatRequest, db: Session = Depends(get_db)):
         if request.pdf_summary:
             full_content = f"以下のPDF要約を考慮して質問に答えてください。\n\nPDF要約:\n{request.pdf_summary}\n\n質問:\n{request.message}"
 
-        response = await client.aio.models.generate_content(
-            model='gemini-2.0-flash-001', contents=full_content
-        )
+        response = await generate_gemini_content(full_content, cache_ttl)
         
-        logging.info(f"Generated response using summary only")
+        logger.debug("Generated response using summary only")
         
         if not response or not response.text:
             return {"reply": "応答なし！"}
             
         return {"reply": response.text}
     except Exception as e:
-        logging.error(f"Error in chat endpoint: {str(e)}")
+        logger.error("Error in chat endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"AI応答エラー: {str(e)}")
 
 async def summarize_text_with_gemini(text: str) -> str:
     """Gemini APIを使用してテキストを要約する"""
-    client = genai.Client(api_key=API_KEY)
     try:
         prompt = f"以下のテキストを簡潔に要約してください。要点のみを抽出し、箇条書きで3点程度にまとめてください。\n\nテキスト:\n{text}"
-        response = await client.aio.models.generate_content(
-            model='gemini-2.0-flash-001',
-            contents=prompt
-        )
+        response = await generate_gemini_content(prompt, llm_dedup.GEMINI_CACHE_TTL_SECONDS)
         if hasattr(response, 'text') and response.text:
             return response.text
         elif hasattr(response, 'candidates') and response.candidates:
@@ -740,44 +1071,46 @@ async def summarize_text_with_gemini(text: str) -> str:
         else:
             return "要約の生成に失敗しました"
     except Exception as e:
-        logging.error(f"Error summarizing text with Gemini API: {str(e)}")
+        logger.error("Error summarizing text with Gemini API: %s", e)
         return "要約の生成中にエラーが発生しました"
 
 async def generate_category_with_gemini(question_text: str) -> str:
     """Gemini APIを使用して質問テキストからカテゴリを生成する"""
-    client = genai.Client(api_key=API_KEY)
     try:
         prompt = (
             f"以下の質問テキストに最も適したカテゴリ名を質問内容から簡潔に生成してください。\n"
             f"回答はカテゴリ名のみを返してください。\n\n質問テキスト:\n{question_text}"
         )
-        response = await client.aio.models.generate_content(
-            model='gemini-2.0-flash-001',
-            contents=prompt
-        )
+        response = await generate_gemini_content(prompt, llm_dedup.GEMINI_CACHE_TTL_SECONDS)
         if hasattr(response, 'text') and response.text:
             return response.text.strip()
         elif hasattr(response, 'candidates') and response.candidates:
             return response.candidates[0].content.parts[0].text.strip()
         else:
-            return "その他"
+            return category_resolver.DEFAULT_CATEGORY
     except Exception as e:
-        logging.error(f"Error generating category with Gemini API: {str(e)}")
-        return "その他"
+        logger.error("Error generating category with Gemini API: %s", e)
+        return category_resolver.DEFAULT_CATEGORY
+
+# 既存のカテゴリの重心に近い質問は Gemini を呼ばずに同じカテゴリにする
+question_categories = category_resolver.CategoryResolver(
+    cache.namespace("category_centroids"), encode_texts, generate_category_with_gemini)
 
 
 
 @app.post("/api/upload-pdf")
 async def upload_pdf(
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    _admission: LlmAdmission = Depends(llm_admission("upload-pdf", cost=3))
 ):
-    """PDF アップロードと要約生成エンドポイント（認証なし）"""
+    """PDF アップロードと要約生成エンドポイント（認証なし。流量は IP ごとに制限する）"""
     try:
         if not files:
             raise HTTPException(status_code=400, detail="ファイルが選択されていません")
 
-        all_base64_contents = []
+        summary_inputs: List[summarization.SummaryInput] = []
         all_filenames = []
         file_ids = []
         
@@ -785,18 +1118,17 @@ async def upload_pdf(
             if not file.filename.lower().endswith('.pdf'):
                 raise HTTPException(status_code=400, detail=f"'{file.filename}': PDFファイルのみアップロード可能です")
             
-            if file.size > 10 * 1024 * 1024:
-                raise HTTPException(status_code=400, detail=f"'{file.filename}': ファイルサイズが大きすぎます (10MB以下にしてください)")
-            
-            file_content = await file.read()
-            base64_content = await run_in_threadpool(lambda: base64.b64encode(file_content).decode('utf-8'))
-            all_base64_contents.append(base64_content)
+            try:
+                received = await uploads.read_upload(file, max_size=MAX_PDF_UPLOAD_SIZE)
+            except uploads.UploadTooLarge:
+                raise HTTPException(status_code=413, detail=f"'{file.filename}': ファイルサイズが大きすぎます ({MAX_PDF_UPLOAD_SIZE / (1024 * 1024):.0f}MB以下にしてください)")
+            summary_inputs.append(summarization.SummaryInput(filename=file.filename, content=received.content, sha256=received.sha256))
             all_filenames.append(file.filename)
 
             # PDFファイルをDBに保存（チャット時に参照するため）
             new_shared_file = SharedFile(
                 filename=file.filename,
-                content=file_content,
+                content=received.content,
                 team_id=None,
                 uploaded_by_user_id=None
             )
@@ -804,44 +1136,19 @@ async def upload_pdf(
             db.flush()
             file_ids.append(new_shared_file.id)
         
-        client = genai.Client(api_key=API_KEY)
-        
-        # Gemini APIへのプロンプトとコンテンツの構築
-        parts = [
-            {'text': '以下の複数のPDFファイルの内容を日本語で要約してください。要点をmarkdownを活用した箇条書きで整理し、わかりやすく説明してください。要約内容に合ったタグを少なくとも3つ生成してください。最大数は5個です．生成したタグに関しては，markdownで見出しなどをつけずにプレーンなテキスト [タグ: tag1, tag2, tag3...] の形式で文末に含めてください。タグが生成できない場合でも、必ず `[タグ: なし]` と記述してください。'},
-        ]
-        for base64_content in all_base64_contents:
-            parts.append({'inline_data': {'mime_type': 'application/pdf', 'data': base64_content}})
-
-        response = await client.aio.models.generate_content(
-            model='gemini-2.0-flash-001',
-            contents=[
-                {'parts': parts}
-            ]
-        )
-        
-        logging.info(f"Combined PDF summary generated for files: {', '.join(all_filenames)}")
-        
-        if hasattr(response, 'text') and response.text:
-            full_response_text = response.text
-        elif hasattr(response, 'candidates') and response.candidates:
-            full_response_text = response.candidates[0].content.parts[0].text
-        else:
-            full_response_text = "要約の生成に失敗しました"
-        
-        summary = full_response_text # 初期値はフルレスポンス
-        generated_tags = []
+        # ファイルごとに並列で要約し、統合する（要約済みのファイルはキャッシュを使う）
+        summary_result = await summarization.summarize_files(db, summary_inputs, generate_gemini_content)
+        summary = summary_result.summary
+        generated_tags = summary_result.tags
         
-        # タグを正規表現で抽出
-        tag_match = re.search(r'\[タグ:\s*(.*?)\s*\]', full_response_text)
-        if tag_match:
-            tags_str = tag_match.group(1)
-            generated_tags = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
-            # 要約からタグ部分を削除
-            summary = re.sub(r'\[タグ:\s*(.*?)\s*\]', '', full_response_text).strip()
+        logger.info("Combined PDF summary generated for files: %s", ', '.join(all_filenames))
         
         db.commit() # ここにdb.commit()を追加します
 
+        # チャットで関連箇所だけを参照できるよう、レスポンス後にテキストを抽出・分割しておく
+        for file_id in file_ids:
+            background_tasks.add_task(ingest_shared_file_chunks, file_id)
+
         return {
             "filename": ", ".join(all_filenames), # 複数のファイル名を結合
             "summary": summary,
@@ -854,7 +1161,7 @@ async def upload_pdf(
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error in upload_pdf endpoint: {str(e)}")
+        logger.error("Error in upload_pdf endpoint: %s", e)
         raise HTTPException(status_code=500, detail=f"PDF処理エラー: {str(e)}")
 
 @app.get("/api/hello/{name}")
@@ -862,141 +1169,195 @@ async def say_hello(name: str):
     """挨拶エンドポイント"""
     return {"message": f"こんにちは、{name}さん！"}
 
-@app.get("/api/summaries", response_model=List[SummaryListItemResponse])
-async def get_summaries(current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
-    """認証されたユーザーの要約履歴と、所属チームの共有要約を取得する"""
-    try:
-        # ユーザー自身の要約を取得
-        user_summaries_query = db.query(SummaryHistory, User.username, Team.name).outerjoin(Team, SummaryHistory.team_id == Team.id).join(User, SummaryHistory.user_id == User.id).filter(
-            SummaryHistory.user_id == current_user.id
-        ).order_by(SummaryHistory.created_at.desc())
-        
-        user_summaries_data = []
-        for summary, username, team_name in user_summaries_query.all():
-            # created_at を明示的にUTCに変換
-            if summary.created_at.tzinfo is None:
-                created_at_utc = summary.created_at.replace(tzinfo=timezone.utc)
-            else:
-                created_at_utc = summary.created_at.astimezone(timezone.utc)
-
-            user_summaries_data.append(SummaryListItemResponse(
-                id=summary.id,
-                filename=summary.filename,
-                summary=summary.summary,
-                created_at=created_at_utc,
-                team_id=summary.team_id,
-                username=username,
-                team_name=team_name,
-                tags=summary.tags.split(',') if summary.tags else [],
-                chat_history_id=summary.chat_history_id,
-                original_file_path=(
-                    json.loads(summary.original_file_path)
-                    if summary.original_file_path and summary.original_file_path.startswith('[')
-                    else ([summary.original_file_path] if summary.original_file_path else None)
-                ),
-                parent_summary_id=summary.parent_summary_id # NEW FIELD
-            ))
+def _summary_list_item(summary: SummaryHistory, username: Optional[str], team_name: Optional[str]) -> SummaryListItemResponse:
+    # created_at を明示的にUTCに変換
+    if summary.created_at.tzinfo is None:
+        created_at_utc = summary.created_at.replace(tzinfo=timezone.utc)
+    else:
+        created_at_utc = summary.created_at.astimezone(timezone.utc)
+
+    return SummaryListItemResponse(
+        id=summary.id,
+        filename=summary.filename,
+        summary=summary.summary,
+        created_at=created_at_utc,
+        team_id=summary.team_id,
+        username=username,
+        team_name=team_name,
+        tags=summary.tags.split(',') if summary.tags else [],
+        chat_history_id=summary.chat_history_id,
+        original_file_path=(
+            json.loads(summary.original_file_path)
+            if summary.original_file_path and summary.original_file_path.startswith('[')
+            else ([summary.original_file_path] if summary.original_file_path else None)
+        ),
+        parent_summary_id=summary.parent_summary_id # NEW FIELD
+    )
 
-        # ユーザーが所属するチームのIDを取得
-        user_team_ids = [tm.team_id for tm in db.query(TeamMember).filter(TeamMember.user_id == current_user.id).all()]
 
+def _accessible_summaries_filter(claims: AccessClaims):
+    """ユーザー自身の要約と、所属チームに共有された要約に絞り込む条件
 
-        # 所属チームに共有された要約を取得
-        shared_summaries_data = []
-        if user_team_ids:
-            shared_summaries_query = db.query(SummaryHistory, User.username, Team.name).join(User, SummaryHistory.user_id == User.id).join(Team, SummaryHistory.team_id == Team.id).filter(
-                SummaryHistory.team_id.in_(user_team_ids),
-                SummaryHistory.user_id != current_user.id # 自分の要約はuser_summariesに含まれるため除外
-            ).order_by(SummaryHistory.created_at.desc())
-            
-            shared_summaries_results = shared_summaries_query.all()
+    所属チームはトークンのクレームではなく team_members で判定する（同じクエリ内の副問い合わせ）。
+    トークンの発行後に加わったチームはすぐに見え、抜けたチームはすぐに見えなくなる。
+    """
+    return or_(
+        SummaryHistory.user_id == claims.id,
+        SummaryHistory.team_id.in_(select(TeamMember.team_id).where(TeamMember.user_id == claims.id))
+    )
 
-            for summary, username, team_name in shared_summaries_results:
-                # created_at を明示的にUTCに変換
-                if summary.created_at.tzinfo is None:
-                    created_at_utc = summary.created_at.replace(tzinfo=timezone.utc)
-                else:
-                    created_at_utc = summary.created_at.astimezone(timezone.utc)
-
-                shared_summaries_data.append(SummaryListItemResponse(
-                    id=summary.id,
-                    filename=summary.filename,
-                    summary=summary.summary,
-                    created_at=created_at_utc,
-                    team_id=summary.team_id,
-                    username=username,
-                    team_name=team_name,
-                    tags=summary.tags.split(',') if summary.tags else [],
-                    chat_history_id=summary.chat_history_id,
-                    original_file_path=(
-                        json.loads(summary.original_file_path)
-                        if summary.original_file_path and summary.original_file_path.startswith('[')
-                        else ([summary.original_file_path] if summary.original_file_path else None)
-                    ),
-                    parent_summary_id=summary.parent_summary_id # NEW FIELD
-                ))
 
-        # 両方のリストを結合して返す
-        all_summaries = user_summaries_data + shared_summaries_data
+@app.get("/api/summaries", response_model=List[SummaryListItemResponse])
+async def get_summaries(
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db),
+    limit: Optional[int] = Query(None, ge=1, le=500), # 指定しない場合は全件
+    offset: int = Query(0, ge=0),
+    if_none_match: Optional[str] = Header(None)
+):
+    """認証されたユーザーの要約履歴と、所属チームの共有要約を新しい順に取得する（ETag が一致すれば 304）"""
+    # 所属チームは _accessible_summaries_filter と同じく DB から取る（トークンの発行後の加入・脱退も ETag に反映する）
+    team_ids = sorted(team_id for (team_id,) in db.query(TeamMember.team_id).filter(TeamMember.user_id == current_user.id).all())
+    scopes = [http_cache.user_summaries_scope(current_user.id)] + [http_cache.team_summaries_scope(team_id) for team_id in team_ids]
+    try:
+        etag = http_cache.current_etag(db, scopes, limit, offset)
+        if http_cache.etag_matches(if_none_match, etag):
+            return http_cache.not_modified(etag)
+
+        def build():
+            summaries_query = db.query(SummaryHistory, User.username, Team.name).outerjoin(Team, SummaryHistory.team_id == Team.id).join(User, SummaryHistory.user_id == User.id).filter(
+                _accessible_summaries_filter(current_user)
+            ).order_by(SummaryHistory.created_at.desc(), SummaryHistory.id.desc()).offset(offset)
+            if limit is not None:
+                summaries_query = summaries_query.limit(limit)
+            return [_summary_list_item(summary, username, team_name) for summary, username, team_name in summaries_query.all()]
+
+        # 要約本文を含む大きなレスポンスなので、jsonable_encoder を通さず orjson で直接 JSON 化する
+        cache_key = f"summaries:{current_user.id}:{','.join(map(str, team_ids))}:{limit}:{offset}"
+        return await http_cache.cached_json_response(cache_key, etag, build)
+    except Exception as e:
+        logger.error("Error fetching summaries for user %s: %s", current_user.username, e)
+        raise HTTPException(status_code=500, detail=f"要約の取得中にエラーが発生しました: {str(e)}")
+
 
-        # 重複を排除し、作成日時でソート（必要であれば）
-        # ここでは単純に結合しているため、重複排除とソートはフロントエンドで行うか、
-        # より複雑なクエリを構築する必要があります。
-        # 例: set()を使って重複排除し、リストに変換後ソート
-        unique_summaries = list({s.id: s for s in all_summaries}.values())
-        unique_summaries.sort(key=lambda x: x.created_at, reverse=True)
+@app.get("/api/search", response_model=List[SearchResultResponse])
+async def search_summaries(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db)
+):
+    """
+    アクセスできる要約を、タイトル・タグ・本文の全文検索と、保存済みの質問の埋め込みとの類似度で検索する。
+    結果は両者を重み付けしたスコアの高い順に返す。
+    """
+    query_text = q.strip()
+    if not query_text:
+        raise HTTPException(status_code=400, detail="検索語を入力してください")
+    accessible = _accessible_summaries_filter(current_user)
+
+    # 全文検索（search_vector の GIN インデックスを使う）。ts_rank_cd の正規化 32 で 0〜1 に収める
+    ts_query = func.websearch_to_tsquery('simple', query_text)
+    text_rank = func.ts_rank_cd(SummaryHistory.search_vector, ts_query, 32)
+    text_scores = {
+        summary_id: float(rank)
+        for summary_id, rank in db.query(SummaryHistory.id, text_rank).filter(
+            accessible,
+            SummaryHistory.search_vector.op('@@')(ts_query)
+        ).order_by(text_rank.desc()).limit(search.SEARCH_TEXT_CANDIDATE_LIMIT).all()
+    }
 
-        return unique_summaries
+    # ベクトル検索（質問と回答から作られた埋め込みとの類似度）。埋め込みが使えない場合は全文検索のみ
+    # 比べる要約は全文検索の候補と新しいものに限る（入力のたびに全件の埋め込みを読んでデコードしない）
+    best_matches: Dict[int, Tuple[float, int]] = {}
+    try:
+        query_embedding = (await encode_texts([query_text]))[0]
+        vector_candidate_ids = set(text_scores) | {
+            summary_id for (summary_id,) in db.query(SummaryHistory.id).filter(accessible).order_by(
+                SummaryHistory.created_at.desc(), SummaryHistory.id.desc()
+            ).limit(search.SEARCH_VECTOR_RECENT_LIMIT).all()
+        }
+        stored_embeddings = db.query(HistoryContent.id, HistoryContent.summary_history_id, HistoryContent.embedding).filter(
+            HistoryContent.summary_history_id.in_(vector_candidate_ids),
+            HistoryContent.embedding.isnot(None)
+        ).all() if vector_candidate_ids else []
+        best_matches = await run_in_threadpool(search.vector_scores, query_embedding, stored_embeddings)
     except Exception as e:
-        logging.error(f"Error fetching summaries for user {current_user.username}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"要約の取得中にエラーが発生しました: {str(e)}")
+        logger.warning("Vector search unavailable, falling back to full-text search only: %s", e)
+
+    ranked = search.hybrid_rank(text_scores, {summary_id: match[0] for summary_id, match in best_matches.items()})
+    page = ranked[offset:offset + limit]
+    if not page:
+        return ORJSONModelResponse([])
+
+    rows = db.query(SummaryHistory, User.username, Team.name).outerjoin(Team, SummaryHistory.team_id == Team.id).join(User, SummaryHistory.user_id == User.id).filter(
+        SummaryHistory.id.in_([summary_id for summary_id, _, _, _ in page])
+    ).all()
+    items = {summary.id: _summary_list_item(summary, username, team_name) for summary, username, team_name in rows}
+
+    results = [
+        SearchResultResponse(
+            **items[summary_id].model_dump(),
+            score=score,
+            text_score=text_score,
+            vector_score=vector_score,
+            matched_content_id=best_matches[summary_id][1] if summary_id in best_matches else None
+        )
+        for summary_id, score, text_score, vector_score in page
+        if summary_id in items
+    ]
+    return ORJSONModelResponse(results)
+
+async def _can_read_summary(db: Session, claims: AccessClaims, owner_id: int, team_id: Optional[int]) -> bool:
+    return owner_id == claims.id or (team_id is not None and await _is_team_member(db, claims, team_id))
 
 @app.get("/api/summaries/{summary_id}", response_model=SummaryHistoryDetailResponse)
 async def get_summary_by_id(
     summary_id: int,
-    current_user: User = Depends(get_required_user),
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db)
 ):
-    """IDに基づいて特定の要約履歴とその関連コンテンツを取得するエンドポイント"""
-    summary_history = db.query(SummaryHistory).options(
-        joinedload(SummaryHistory.contents)
-    ).filter(SummaryHistory.id == summary_id).first()
-
-    if not summary_history:
+    """IDに基づいて特定の要約履歴とその関連コンテンツを取得するエンドポイント（ETag が一致すれば 304）"""
+    # 権限チェックに必要な列だけを先に読み、本文とコンテンツは ETag が変わった場合だけ読む
+    owner = db.query(SummaryHistory.user_id, SummaryHistory.team_id).filter(SummaryHistory.id == summary_id).first()
+    if not owner:
         raise HTTPException(status_code=404, detail="要約履歴が見つかりません")
+    if not await _can_read_summary(db, current_user, owner.user_id, owner.team_id):
+        raise HTTPException(status_code=403, detail="この履歴を閲覧する権限がありません")
 
-    # 権限チェック
-    is_owner = summary_history.user_id == current_user.id
-    is_team_member = False
-    if summary_history.team_id:
-        membership = db.query(TeamMember).filter(
-            TeamMember.team_id == summary_history.team_id,
-            TeamMember.user_id == current_user.id
-        ).first()
-        if membership:
-            is_team_member = True
+    scopes = [http_cache.summary_scope(summary_id)]
+    etag = http_cache.current_etag(db, scopes)
+    if http_cache.etag_matches(if_none_match, etag):
+        return http_cache.not_modified(etag)
 
-    if not is_owner and not is_team_member:
-        raise HTTPException(status_code=403, detail="この履歴を閲覧する権限がありません")
+    def build():
+        summary_history = db.query(SummaryHistory).options(
+            joinedload(SummaryHistory.contents)
+        ).filter(SummaryHistory.id == summary_id).first()
+        if not summary_history:
+            raise HTTPException(status_code=404, detail="要約履歴が見つかりません")
 
-    # original_file_pathをJSON文字列からリストに変換
-    deserialized_file_path = (
-        json.loads(summary_history.original_file_path)
-        if summary_history.original_file_path and summary_history.original_file_path.startswith('[')
-        else ([summary_history.original_file_path] if summary_history.original_file_path else None)
-    )
+        # original_file_pathをJSON文字列からリストに変換
+        deserialized_file_path = (
+            json.loads(summary_history.original_file_path)
+            if summary_history.original_file_path and summary_history.original_file_path.startswith('[')
+            else ([summary_history.original_file_path] if summary_history.original_file_path else None)
+        )
 
-    return SummaryHistoryDetailResponse(
-        id=summary_history.id,
-        user_id=summary_history.user_id,
-        team_id=summary_history.team_id,
-        filename=summary_history.filename,
-        summary=summary_history.summary,
-        created_at=summary_history.created_at.astimezone(timezone.utc) if summary_history.created_at.tzinfo is None else summary_history.created_at,
-        contents=summary_history.contents,
-        original_file_path=deserialized_file_path,
-        parent_summary_id=summary_history.parent_summary_id
-    )
+        return SummaryHistoryDetailResponse(
+            id=summary_history.id,
+            user_id=summary_history.user_id,
+            team_id=summary_history.team_id,
+            filename=summary_history.filename,
+            summary=summary_history.summary,
+            created_at=summary_history.created_at.astimezone(timezone.utc) if summary_history.created_at.tzinfo is None else summary_history.created_at,
+            contents=summary_history.contents,
+            original_file_path=deserialized_file_path,
+            parent_summary_id=summary_history.parent_summary_id
+        )
+    return await http_cache.cached_json_response(f"summary:{summary_id}", etag, build)
 
 @app.post("/api/comments")
 async def add_comment(request: CommentCreateRequest, current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
@@ -1169,218 +1530,131 @@ async def get_comments_for_summary(summary_id: int, current_user: User = Depends
     return comments_data
 
 @app.get("/api/users/me/teams")
-async def get_my_teams(current_user: User = Depends(get_required_user), db: Session = Depends(get_db)):
-    """現在のユーザーが所属するチームのリストを取得するエンドポイント"""
-    my_memberships = db.query(TeamMember).filter(TeamMember.user_id == current_user.id).all()
-    
-    teams_data = []
-    for membership in my_memberships:
-        team = db.query(Team).filter(Team.id == membership.team_id).first()
-        if team:
-            teams_data.append({
+async def get_my_teams(
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db)
+):
+    """現在のユーザーが所属するチームのリストを取得するエンドポイント（ETag が一致すれば 304）"""
+    scopes = [http_cache.user_teams_scope(current_user.id)]
+    etag = http_cache.current_etag(db, scopes)
+    if http_cache.etag_matches(if_none_match, etag):
+        return http_cache.not_modified(etag)
+
+    def build():
+        my_teams = db.query(TeamMember.role, Team).join(Team, Team.id == TeamMember.team_id).filter(
+            TeamMember.user_id == current_user.id
+        ).order_by(TeamMember.joined_at).all()
+        teams_data = [
+            {
                 "id": team.id,
                 "name": team.name,
-                "role": membership.role,
+                "role": role,
                 "created_by_user_id": team.created_by_user_id
-            })
-    return teams_data
+            }
+            for role, team in my_teams
+        ]
+        return teams_data
+    return await http_cache.cached_json_response(f"user:{current_user.id}:teams", etag, build)
 
 @app.post("/api/save-summary")
 async def save_summary(
     request: SaveSummaryRequest,
     current_user: User = Depends(get_required_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    _admission: LlmAdmission = Depends(llm_admission("save-summary", cost=2))
 ):
     """要約をデータベースに保存するエンドポイント"""
     try:
-        logging.info(f"SaveSummaryRequest received. team_id: {request.team_id}")
-        if request.team_id:
-            logging.info(f"Saving as team summary for team_id: {request.team_id}")
-            # チーム要約として保存 (1つのエントリ)
-            new_history = SummaryHistory(
-                user_id=current_user.id, # 保存を実行したユーザーのID
-                filename=request.filename,
-                summary=request.summary,
-                team_id=request.team_id, # リクエストで指定されたteam_idを使用
-                                tags=",".join(request.tags) if request.tags else None,
-                original_file_path=json.dumps(request.original_file_path) if request.original_file_path else None,
-                created_at=datetime.now(timezone.utc),
-                parent_summary_id=request.parent_summary_id # NEW FIELD
-            )
-            db.add(new_history)
-            db.flush() # IDを取得するためにflush
-            saved_summary_id = new_history.id
+        logger.debug("SaveSummaryRequest received. team_id: %s", request.team_id)
+        # AI Assistantのチャット履歴は HistoryContent として保存し、要約から ID で参照する
+        # （Gemini と埋め込みの計算は、DB への書き込みより前に済ませておく）
+        chat_rows = None
+        if request.ai_chat_history:
+            logger.debug("[save_summary] Received ai_chat_history: %.500s...", request.ai_chat_history) # Log first 500 chars
+            try:
+                chat_rows = await _prepare_chat_history_rows(
+                    request.ai_chat_history, request.summary,
+                    category_resolver.category_scope(current_user.id, request.team_id))
+            except json.JSONDecodeError as e:
+                logger.error("Failed to decode ai_chat_history JSON for user %s: %s", current_user.id, e)
+            except Exception as e:
+                logger.error("Error saving AI chat history for user %s: %s", current_user.id, e)
+
+        now = datetime.now(timezone.utc)
+        saved_summary_id = history_writes.insert_summary(db, {
+            "user_id": current_user.id, # 保存を実行したユーザーのID
+            "filename": request.filename,
+            "summary": request.summary,
+            "team_id": request.team_id or None, # 指定された場合はチーム要約として保存
+            "tags": ",".join(request.tags) if request.tags else None,
+            "original_file_path": json.dumps(request.original_file_path) if request.original_file_path else None,
+            "created_at": now,
+            "parent_summary_id": request.parent_summary_id
+        }, chat_rows, now)
+        http_cache.bump(db, *http_cache.summary_list_scopes(current_user.id, request.team_id or None))
+        db.commit()
 
-            # AI Assistantのチャット履歴をHistoryContentとして保存し、IDを参照する
-            if request.ai_chat_history:
-                logging.info(f"[save_summary] Received ai_chat_history (team): {request.ai_chat_history[:500]}...") # Log first 500 chars
-                try:
-                    chat_content_data = json.loads(request.ai_chat_history)
-                    # 各チャットメッセージにタイムスタンプを追加
-                    for message in chat_content_data:
-                        if "timestamp" not in message:
-                            message["timestamp"] = datetime.now(timezone.utc).isoformat()
-                    
-                    # ユーザーメッセージにカテゴリを追加 (AI生成)
-                    for message in chat_content_data:
-                        if message.get("sender") == "user" and "category" not in message:
-                            generated_category = await generate_category_with_gemini(message.get("text", ""))
-                            message["category"] = generated_category
-
-                    # ユーザーメッセージとAI回答、関連する要約を結合して埋め込みを計算
-                    combined_texts_for_embedding = []
-                    for i, message in enumerate(chat_content_data):
-                        if message.get("sender") == "user":
-                            user_question_text = message.get("text", "")
-                            ai_answer_text = ""
-                            # 次のメッセージがAIの回答であれば取得
-                            if i + 1 < len(chat_content_data) and chat_content_data[i+1].get("sender") == "ai":
-                                ai_answer_text = chat_content_data[i+1].get("text", "")
-                            
-                            # 関連する要約テキストを取得
-                            related_summary_text = new_history.summary # 現在保存しようとしている要約
-
-                            combined_text = f"質問: {user_question_text} 回答: {ai_answer_text} 要約: {related_summary_text}"
-                            combined_texts_for_embedding.append(combined_text)
-
-                    user_question_embeddings = None
-                    if combined_texts_for_embedding:
-                        model = get_embedding_model()
-                        embeddings_list = [model.encode(t, convert_to_tensor=True) for t in combined_texts_for_embedding]
-                        avg_embedding = sum([e.cpu().numpy() for e in embeddings_list]) / len(embeddings_list)
-                        user_question_embeddings = avg_embedding
-
-                    new_chat_history_content = HistoryContent(
-                        summary_history_id=new_history.id,
-                        section_type='ai_chat',
-                        content=json.dumps(chat_content_data), # JSON文字列として保存
-                        embedding=json.dumps(user_question_embeddings.tolist()) if user_question_embeddings is not None else None, # NEW: ユーザー質問の埋め込みを保存
-                        created_at=datetime.now(timezone.utc),
-                        updated_at=datetime.now(timezone.utc)
-                    )
-                    db.add(new_chat_history_content)
-                    db.flush()
-                    new_history.chat_history_id = new_chat_history_content.id
-
-                    # NEW: AI Assistantの回答を抽出し、要約してAiSummaryResponseに保存
-                    ai_responses = [msg["text"] for msg in chat_content_data if msg.get("sender") == "ai"]
-                    if ai_responses:
-                        combined_ai_response = "\n\n".join(ai_responses)
-                        summarized_ai_response = await summarize_text_with_gemini(combined_ai_response) # 新しい関数を呼び出す
-
-                        new_ai_summary_response = AiSummaryResponse(
-                            summary_history_id=new_history.id,
-                            original_history_content_id=new_chat_history_content.id,
-                            summarized_content=summarized_ai_response,
-                            created_at=datetime.now(timezone.utc)
-                        )
-                        db.add(new_ai_summary_response)
-
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to decode ai_chat_history JSON for team summary: {e}")
-                except Exception as e:
-                    logging.error(f"Error saving AI chat history for team summary: {e}")
-            db.commit()
+        if request.team_id:
             return {"message": "要約がチーム履歴として保存されました", "id": saved_summary_id}
-        else:
-            logging.info("Saving as personal summary for current user.")
-            # 従来の個人要約として保存
-            new_history = SummaryHistory(
-                user_id=current_user.id,
-                filename=request.filename,
-                summary=request.summary,
-                team_id=None, # 個人要約なのでteam_idはNone
-                tags=",".join(request.tags) if request.tags else None,
-                original_file_path=json.dumps(request.original_file_path) if request.original_file_path else None,
-                created_at=datetime.now(timezone.utc),
-                parent_summary_id=request.parent_summary_id # NEW FIELD
-            )
-            db.add(new_history)
-            db.flush()
-            saved_summary_id = new_history.id
-
-            # AI Assistantのチャット履歴をHistoryContentとして保存し、IDを参照する
-            if request.ai_chat_history:
-                logging.info(f"[save_summary] Received ai_chat_history (personal): {request.ai_chat_history[:500]}...") # Log first 500 chars
-                try:
-                    chat_content_data = json.loads(request.ai_chat_history)
-                    # 各チャットメッセージにタイムスタンプを追加
-                    for message in chat_content_data:
-                        if "timestamp" not in message:
-                            message["timestamp"] = datetime.now(timezone.utc).isoformat()
-                    
-                    # ユーザーメッセージにカテゴリを追加 (AI生成)
-                    for message in chat_content_data:
-                        if message.get("sender") == "user" and "category" not in message:
-                            generated_category = await generate_category_with_gemini(message.get("text", ""))
-                            message["category"] = generated_category
-
-                    # ユーザーメッセージとAI回答、関連する要約を結合して埋め込みを計算
-                    combined_texts_for_embedding = []
-                    for i, message in enumerate(chat_content_data):
-                        if message.get("sender") == "user":
-                            user_question_text = message.get("text", "")
-                            ai_answer_text = ""
-                            # 次のメッセージがAIの回答であれば取得
-                            if i + 1 < len(chat_content_data) and chat_content_data[i+1].get("sender") == "ai":
-                                ai_answer_text = chat_content_data[i+1].get("text", "")
-                            
-                            # 関連する要約テキストを取得
-                            related_summary_text = new_history.summary # 現在保存しようとしている要約
-
-                            combined_text = f"質問: {user_question_text} 回答: {ai_answer_text} 要約: {related_summary_text}"
-                            combined_texts_for_embedding.append(combined_text)
-
-                    user_question_embeddings = None
-                    if combined_texts_for_embedding:
-                        model = get_embedding_model()
-                        embeddings_list = [model.encode(t, convert_to_tensor=True) for t in combined_texts_for_embedding]
-                        avg_embedding = sum([e.cpu().numpy() for e in embeddings_list]) / len(embeddings_list)
-                        user_question_embeddings = avg_embedding
-
-                    new_chat_history_content = HistoryContent(
-                        summary_history_id=new_history.id,
-                        section_type='ai_chat',
-                        content=json.dumps(chat_content_data), # JSON文字列として保存
-                        embedding=json.dumps(user_question_embeddings.tolist()) if user_question_embeddings is not None else None, # NEW: ユーザー質問の埋め込みを保存
-                        created_at=datetime.now(timezone.utc),
-                        updated_at=datetime.now(timezone.utc)
-                    )
-                    db.add(new_chat_history_content)
-                    db.flush()
-                    new_history.chat_history_id = new_chat_history_content.id
-
-                    # NEW: AI Assistantの回答を抽出し、要約してAiSummaryResponseに保存
-                    ai_responses = [msg["text"] for msg in chat_content_data if msg.get("sender") == "ai"]
-                    if ai_responses:
-                        combined_ai_response = "\n\n".join(ai_responses)
-                        summarized_ai_response = await summarize_text_with_gemini(combined_ai_response) # 新しい関数を呼び出す
-
-                        new_ai_summary_response = AiSummaryResponse(
-                            summary_history_id=new_history.id,
-                            original_history_content_id=new_chat_history_content.id,
-                            summarized_content=summarized_ai_response,
-                            created_at=datetime.now(timezone.utc)
-                        )
-                        db.add(new_ai_summary_response)
-
-                except json.JSONDecodeError as e:
-                    logging.error(f"Failed to decode ai_chat_history JSON for user {current_user.id}: {e}")
-                except Exception as e:
-                    logging.error(f"Error saving AI chat history for user {current_user.id}: {e}")
-            db.commit()
-            return {"message": "要約が正常に保存されました", "id": saved_summary_id}
+        return {"message": "要約が正常に保存されました", "id": saved_summary_id}
     except Exception as e:
-        logging.error(f"Error saving summary via /api/save-summary: {str(e)}")
+        logger.error("Error saving summary via /api/save-summary: %s", e)
         raise HTTPException(status_code=500, detail=f"要約の保存中にエラーが発生しました: {str(e)}")
 
 
-@app.post("/api/teams/{team_id}/files")
+async def _prepare_chat_history_rows(ai_chat_history: str, summary_text: str, category_scope: str) -> history_writes.ChatHistoryRows:
+    """保存する ai_chat の履歴に、タイムスタンプ・カテゴリ・埋め込み・回答の要約・質問と回答のペアを付ける"""
+    chat_content_data = json.loads(ai_chat_history)
+    # 各チャットメッセージにタイムスタンプを追加
+    for message in chat_content_data:
+        if "timestamp" not in message:
+            message["timestamp"] = datetime.now(timezone.utc).isoformat()
+
+    # ユーザーメッセージにカテゴリを追加（既存のカテゴリに近くない質問だけ AI生成）
+    uncategorized = [message for message in chat_content_data if message.get("sender") == "user" and "category" not in message]
+    categories = await question_categories.resolve(category_scope, [message.get("text", "") for message in uncategorized])
+    for message, category in zip(uncategorized, categories):
+        message["category"] = category
+
+    # ユーザーメッセージとAI回答、関連する要約を結合して埋め込みを計算
+    combined_texts_for_embedding = []
+    for i, message in enumerate(chat_content_data):
+        if message.get("sender") == "user":
+            user_question_text = message.get("text", "")
+            ai_answer_text = ""
+            # 次のメッセージがAIの回答であれば取得
+            if i + 1 < len(chat_content_data) and chat_content_data[i+1].get("sender") == "ai":
+                ai_answer_text = chat_content_data[i+1].get("text", "")
+            combined_texts_for_embedding.append(f"質問: {user_question_text} 回答: {ai_answer_text} 要約: {summary_text}")
+
+    user_question_embeddings = None
+    if combined_texts_for_embedding:
+        embeddings = await encode_texts(combined_texts_for_embedding)
+        user_question_embeddings = embeddings.cpu().numpy().mean(axis=0)
+
+    # AI Assistantの回答を抽出し、要約してAiSummaryResponseに保存
+    summarized_ai_response = None
+    ai_responses = [msg["text"] for msg in chat_content_data if msg.get("sender") == "ai"]
+    if ai_responses:
+        summarized_ai_response = await summarize_text_with_gemini("\n\n".join(ai_responses))
+
+    return history_writes.ChatHistoryRows(
+        content=json.dumps(chat_content_data), # JSON文字列として保存
+        embedding=json.dumps(user_question_embeddings.tolist()) if user_question_embeddings is not None else None,
+        ai_summary=summarized_ai_response,
+        question_answer_pairs=_question_answer_pair_rows(chat_content_data)
+    )
+
+
+@app.post("/api/teams/{team_id}/files", status_code=202)
 async def upload_shared_file(
     team_id: int,
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
     current_user: User = Depends(get_required_user),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    _admission: LlmAdmission = Depends(llm_admission("team-files", cost=3))
 ):
     """チームにファイルをアップロードするエンドポイント"""
     # チームが存在するか確認
@@ -1405,14 +1679,14 @@ async def upload_shared_file(
         if file_extension not in [".pdf", ".txt", ".png", ".jpg", ".jpeg", ".gif"]:
             raise HTTPException(status_code=400, detail=f"'{file.filename}': 許可されていないファイル形式です。PDF, TXT, 画像ファイルのみアップロード可能です。")
 
-        MAX_FILE_SIZE = 50 * 1024 * 1024
-        file_content = await file.read()
-        if len(file_content) > MAX_FILE_SIZE:
-            raise HTTPException(status_code=400, detail=f"'{file.filename}': ファイルサイズが大きすぎます ({MAX_FILE_SIZE / (1024 * 1024):.0f}MB以下にしてください)")
+        try:
+            received = await uploads.read_upload(file, max_size=MAX_SHARED_FILE_UPLOAD_SIZE)
+        except uploads.UploadTooLarge:
+            raise HTTPException(status_code=413, detail=f"'{file.filename}': ファイルサイズが大きすぎます ({MAX_SHARED_FILE_UPLOAD_SIZE / (1024 * 1024):.0f}MB以下にしてください)")
 
         new_shared_file = SharedFile(
             filename=file.filename,
-            content=file_content,
+            content=received.content,
             team_id=team_id,
             uploaded_by_user_id=current_user.id
         )
@@ -1420,150 +1694,312 @@ async def upload_shared_file(
         db.flush() # Flush to get ID before commit for all files
         uploaded_files_info.append({"file_id": new_shared_file.id, "filename": new_shared_file.filename})
 
+    # 要約はバックグラウンドのジョブで行う（進捗は /api/jobs/{job_id} で確認する）
+    job = SummaryJob(
+        id=str(uuid.uuid4()),
+        team_id=team_id,
+        user_id=current_user.id,
+        file_ids=json.dumps([f["file_id"] for f in uploaded_files_info]),
+        status=summary_jobs.JOB_PENDING,
+        total_files=len(uploaded_files_info),
+        completed_files=0,
+        worker_id=summary_jobs.current_worker_id()
+    )
+    db.add(job)
+    http_cache.bump(db, http_cache.team_files_scope(team_id))
     db.commit() # Commit all changes at once
 
-    # Summarization logic (similar to /api/upload-pdf)
-    all_base64_contents = []
+    # チャットで関連箇所だけを参照できるよう、レスポンス後にテキストを抽出・分割しておく
     for file_info in uploaded_files_info:
-        sf = db.query(SharedFile).filter(SharedFile.id == file_info["file_id"]).first()
-        if not sf or not sf.content:
-            continue
-        all_base64_contents.append(await run_in_threadpool(lambda: base64.b64encode(sf.content).decode('utf-8')))
+        background_tasks.add_task(ingest_shared_file_chunks, file_info["file_id"])
 
-    client = genai.Client(api_key=API_KEY)
-    
-    parts = [
-        {'text': '以下の複数のPDFファイルの内容を日本語で要約してください。要点をmarkdownを活用した箇条書きで整理し、わかりやすく説明してください。要約内容に合ったタグを少なくとも3つ生成してください。最大数は5個です．生成したタグに関しては，markdownで見出しなどをつけずにプレーンなテキスト [タグ: tag1, tag2, tag3...] の形式で文末に含めてください。タグが生成できない場合でも、必ず `[タグ: なし]` と記述してください。'},
-    ]
-    for base64_content in all_base64_contents:
-        parts.append({'inline_data': {'mime_type': 'application/pdf', 'data': base64_content}})
+    summary_job_runner.submit(job.id, run_shared_file_summary_job, on_cancelled=_fail_interrupted_summary_job)
 
-    response = await client.aio.models.generate_content(
-        model='gemini-2.0-flash-001',
-        contents=[
-            {'parts': parts}
-        ]
+    return {
+        "message": "ファイルが正常にアップロードされました。要約を生成しています...",
+        "uploaded_files": uploaded_files_info,
+        "job_id": job.id,
+        "status": job.status
+    }
+
+
+def _summary_job_response(db: Session, job: SummaryJob) -> SummaryJobResponse:
+    summary_details = None
+    if job.status == summary_jobs.JOB_SUCCEEDED and job.summary_history_id is not None:
+        history = db.query(SummaryHistory).filter(SummaryHistory.id == job.summary_history_id).first()
+        if history:
+            summary_details = {
+                "summary": history.summary,
+                "filename": history.filename,
+                "tags": history.tags.split(',') if history.tags else [],
+                "file_path": json.loads(history.original_file_path) if history.original_file_path else [],
+                "summary_id": history.id
+            }
+    return SummaryJobResponse(
+        id=job.id,
+        status=job.status,
+        total_files=job.total_files,
+        completed_files=job.completed_files,
+        error=job.error,
+        summary_details=summary_details
     )
-    
-    logging.info(f"Combined PDF summary generated for shared files: {', '.join([f['filename'] for f in uploaded_files_info])}")
-    
-    if hasattr(response, 'text') and response.text:
-        full_response_text = response.text
-    elif hasattr(response, 'candidates') and response.candidates:
-        full_response_text = response.candidates[0].content.parts[0].text
-    else:
-        full_response_text = "要約の生成に失敗しました"
-    
-    summary_text = full_response_text # 初期値はフルレスポンス
-    generated_tags = []
-    
-    tag_match = re.search(r'\[タグ:\s*(.*?)\s*\]', full_response_text)
-    if tag_match:
-        tags_str = tag_match.group(1)
-        generated_tags = [tag.strip() for tag in tags_str.split(',') if tag.strip()]
-        summary_text = re.sub(r'\[タグ:\s*(.*?)\s*\]', '', full_response_text).strip()
-    
-    # Save summary to SummaryHistory
-    combined_filenames = ", ".join([f["filename"] for f in uploaded_files_info])
-    # Store related file IDs (as JSON string) in original_file_path field
-    combined_file_paths = json.dumps([f["file_id"] for f in uploaded_files_info])
-
-    # チームメンバー全員の個人要約として保存
-    team_members = db.query(TeamMember).filter(TeamMember.team_id == team_id).all()
-    if not team_members:
-        raise HTTPException(status_code=404, detail="指定されたチームのメンバーが見つかりません")
-
-    saved_summary_ids = []
-    dt = datetime.now(timezone.utc)
-    for member in team_members:
-        new_history = SummaryHistory(
-            user_id=member.user_id, # 各メンバーのuser_idを使用
-            filename=combined_filenames,
-            summary=summary_text,
-            team_id=None, # チーム要約ではなく個人要約として保存
-            tags=",".join(generated_tags) if generated_tags else None,
-            original_file_path=combined_file_paths,
-            created_at=dt
+
+
+def _publish_summary_job(db: Session, job: SummaryJob):
+    summary_job_runner.notify(job.id, _summary_job_response(db, job).model_dump())
+
+
+def _fail_summary_job(db: Session, job_id: str, error: str):
+    db.rollback()
+    job = db.query(SummaryJob).filter(SummaryJob.id == job_id).first()
+    if job is None:
+        return
+    job.status = summary_jobs.JOB_FAILED
+    job.error = error
+    db.commit()
+    _publish_summary_job(db, job)
+
+
+INTERRUPTED_SUMMARY_JOB_ERROR = "サーバーの停止により要約が中断されました"
+
+
+def _fail_interrupted_summary_job(job_id: str):
+    """順番待ちの間にサーバーの停止で中断されたジョブを failed として記録する"""
+    db = SessionLocal()
+    try:
+        _fail_summary_job(db, job_id, INTERRUPTED_SUMMARY_JOB_ERROR)
+    except Exception as e:
+        logger.error("Failed to record interrupted summary job %s: %s", job_id, e)
+    finally:
+        db.close()
+
+
+def _fail_orphaned_summary_jobs():
+    """終了したワーカー（クラッシュ・再起動）に残された pending / running のジョブを failed として記録する
+
+    別のホストのワーカーのジョブは生死を確認できないので対象にしない。
+    """
+    db = SessionLocal()
+    try:
+        jobs = db.query(SummaryJob).filter(
+            SummaryJob.status.in_([summary_jobs.JOB_PENDING, summary_jobs.JOB_RUNNING])
+        ).with_for_update(skip_locked=True).all()
+        orphaned = [job for job in jobs if job.worker_id is None or summary_jobs.is_worker_alive(job.worker_id) is False]
+        for job in orphaned:
+            job.status = summary_jobs.JOB_FAILED
+            job.error = INTERRUPTED_SUMMARY_JOB_ERROR
+        db.commit()
+        if orphaned:
+            logger.info("Marked %s orphaned summary jobs as failed", len(orphaned))
+    except Exception as e:
+        db.rollback()
+        logger.error("Failed to recover orphaned summary jobs: %s", e)
+    finally:
+        db.close()
+
+
+async def run_shared_file_summary_job(job_id: str):
+    """チームにアップロードされたファイルを要約し、チームの要約として保存する"""
+    db = SessionLocal()
+    try:
+        job = db.query(SummaryJob).filter(SummaryJob.id == job_id).first()
+        if job is None or job.status != summary_jobs.JOB_PENDING:
+            return
+        job.status = summary_jobs.JOB_RUNNING
+        db.commit()
+        _publish_summary_job(db, job)
+
+        file_ids = json.loads(job.file_ids)
+        files_by_id = {sf.id: sf for sf in db.query(SharedFile).filter(SharedFile.id.in_(file_ids)).all()}
+        shared_files = [files_by_id[file_id] for file_id in file_ids if file_id in files_by_id]
+
+        def report_progress(completed: int, total: int):
+            job.completed_files = completed
+            db.commit()
+            _publish_summary_job(db, job)
+
+        summary_result = await summarization.summarize_files(
+            db,
+            [summarization.SummaryInput(filename=sf.filename, content=sf.content) for sf in shared_files],
+            generate_gemini_content,
+            on_progress=report_progress
         )
-        db.add(new_history)
+        logger.info("Combined PDF summary generated for shared files: %s", ', '.join(sf.filename for sf in shared_files))
+
+        # チームの要約として1件だけ保存する（メンバーはチームの要約として参照する）
+        team_history = SummaryHistory(
+            user_id=job.user_id, # アップロードしたユーザーのID
+            filename=", ".join(sf.filename for sf in shared_files),
+            summary=summary_result.summary,
+            team_id=job.team_id,
+            tags=",".join(summary_result.tags) if summary_result.tags else None,
+            # Store related file IDs (as JSON string) in original_file_path field
+            original_file_path=json.dumps([sf.id for sf in shared_files]),
+            created_at=datetime.now(timezone.utc)
+        )
+        db.add(team_history)
         db.flush() # IDを取得するためにflush
-        saved_summary_ids.append(new_history.id)
-    db.commit() # 全ての変更をコミット
 
-    return {
-        "message": "ファイルが正常にアップロードされ、要約がチームメンバー全員の個人履歴に保存されました！",
-        "uploaded_files": uploaded_files_info,
-        "summary_details": {
-            "summary": summary_text,
-            "filename": combined_filenames,
-            "tags": generated_tags,
-            "file_path": json.loads(combined_file_paths), # Return as list
-            "summary_id": saved_summary_ids[0] if saved_summary_ids else None # Return the first ID, or None if no summaries saved
-        }
-    }
+        job.summary_history_id = team_history.id
+        job.completed_files = job.total_files
+        job.status = summary_jobs.JOB_SUCCEEDED
+        http_cache.bump(db, *http_cache.summary_list_scopes(job.user_id, job.team_id))
+        db.commit() # 全ての変更をコミット
+        _publish_summary_job(db, job)
+    except asyncio.CancelledError:
+        _fail_summary_job(db, job_id, INTERRUPTED_SUMMARY_JOB_ERROR)
+        raise
+    except Exception as e:
+        logger.error("Summary job %s failed: %s", job_id, e)
+        _fail_summary_job(db, job_id, "要約の生成中にエラーが発生しました")
+    finally:
+        db.close()
 
 
-@app.post("/api/save-question-summary")
-async def save_question_summary(
-    request: HistoryContentCreateRequest,
+def _get_accessible_summary_job(db: Session, job_id: str, user: User) -> SummaryJob:
+    job = db.query(SummaryJob).filter(SummaryJob.id == job_id).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません")
+    if job.user_id != user.id and not db.query(TeamMember).filter(
+        TeamMember.team_id == job.team_id,
+        TeamMember.user_id == user.id
+    ).first():
+        raise HTTPException(status_code=403, detail="このジョブを閲覧する権限がありません")
+    return job
+
+
+@app.get("/api/jobs/{job_id}", response_model=SummaryJobResponse)
+async def get_summary_job(
+    job_id: str,
     current_user: User = Depends(get_required_user),
     db: Session = Depends(get_db)
 ):
-    """質問と回答のペアを要約してデータベースに保存するエンドポイント"""
+    """要約ジョブの進捗と結果を返すエンドポイント（ポーリング用）"""
+    return _summary_job_response(db, _get_accessible_summary_job(db, job_id, current_user))
+
+
+def _load_summary_job_state(job_id: str) -> Optional[Dict[str, Any]]:
+    db = SessionLocal()
     try:
-        summary_history = db.query(SummaryHistory).filter(SummaryHistory.id == request.summary_history_id).first()
-        if not summary_history:
-            raise HTTPException(status_code=404, detail="指定された要約履歴が見つかりません")
-
-        # 権限チェック
-        is_owner = summary_history.user_id == current_user.id
-        is_team_member = False
-        if summary_history.team_id:
-            membership = db.query(TeamMember).filter(
-                TeamMember.team_id == summary_history.team_id,
-                TeamMember.user_id == current_user.id
-            ).first()
-            if membership:
-                is_team_member = True
-
-        if not is_owner and not is_team_member:
-            raise HTTPException(status_code=403, detail="このコンテンツを保存する権限がありません")
-
-        # 質問と回答のペアを要約 (AI生成)
-        combined_text = f"質問: {request.question_text}\n回答: {request.ai_answer_text}"
-        ai_generated_summary = await summarize_text_with_gemini(combined_text)
-
-        # ユーザーが提供した要約があればそれを使用、なければAI生成の要約を使用
-        final_content = request.user_provided_summary if request.user_provided_summary is not None else ai_generated_summary
-
-        new_history_content = HistoryContent(
-            summary_history_id=request.summary_history_id,
-            section_type='user_question_summary', # 質問単位の要約であることを示す
-            content=final_content, # ユーザー提供またはAI生成の要約を保存
-            question_text=request.question_text,
-            ai_answer_text=request.ai_answer_text,
-            created_at=datetime.now(timezone.utc),
-            updated_at=datetime.now(timezone.utc)
-        )
-        db.add(new_history_content)
-        db.flush()
+        job = db.query(SummaryJob).filter(SummaryJob.id == job_id).first()
+        return _summary_job_response(db, job).model_dump() if job else None
+    finally:
+        db.close()
 
-        # NEW: 質問と回答の要約をAiSummaryResponseに保存 (AI生成の要約を保存)
-        new_ai_summary_response = AiSummaryResponse(
-            summary_history_id=request.summary_history_id,
-            original_history_content_id=new_history_content.id,
-            summarized_content=ai_generated_summary, # AI生成の要約を保存
-            created_at=datetime.now(timezone.utc)
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_summary_job(job_id: str, token: str = Query(...)):
+    """要約ジョブの進捗を Server-Sent Events で配信する（EventSource はヘッダーを付けられないためトークンはクエリで受け取る）"""
+    username = get_username_from_token(token)
+    if username is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無効な認証情報です")
+
+    # ストリーム中ずっとDB接続を握らないよう、認可チェックの間だけセッションを使う
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="無効な認証情報です")
+        _get_accessible_summary_job(db, job_id, user)
+    finally:
+        db.close()
+
+    async def event_stream():
+        # 同じワーカーで実行中のジョブは通知を受けて即時に、それ以外は定期的に DB を読み直して送る
+        queue = summary_job_runner.subscribe(job_id)
+        try:
+            state = await run_in_threadpool(_load_summary_job_state, job_id)
+            last_sent = None
+            while state is not None:
+                if state != last_sent:
+                    yield f"event: progress\ndata: {json.dumps(state, ensure_ascii=False)}\n\n"
+                    last_sent = state
+                if state["status"] in summary_jobs.FINISHED_STATUSES:
+                    break
+                try:
+                    state = await asyncio.wait_for(queue.get(), timeout=summary_jobs.SUMMARY_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    state = await run_in_threadpool(_load_summary_job_state, job_id)
+        finally:
+            summary_job_runner.unsubscribe(job_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no" # nginx などのプロキシでバッファリングさせない
+    })
+
+
+async def _save_question_summaries(db: Session, user: User, items: List[HistoryContentCreateRequest]) -> List[int]:
+    """質問と回答のペアを要約して保存し、HistoryContent の ID を items の順で返す"""
+    summary_ids = {item.summary_history_id for item in items}
+    summaries = db.query(SummaryHistory.id, SummaryHistory.user_id, SummaryHistory.team_id).filter(SummaryHistory.id.in_(summary_ids)).all()
+    if len(summaries) != len(summary_ids):
+        raise HTTPException(status_code=404, detail="指定された要約履歴が見つかりません")
+
+    # 権限チェック（自身の要約、または所属チームの要約）
+    user_team_ids = {team_id for (team_id,) in db.query(TeamMember.team_id).filter(TeamMember.user_id == user.id).all()}
+    if any(summary.user_id != user.id and summary.team_id not in user_team_ids for summary in summaries):
+        raise HTTPException(status_code=403, detail="このコンテンツを保存する権限がありません")
+
+    # 質問と回答のペアを要約 (AI生成)
+    ai_generated_summaries = await asyncio.gather(*[
+        summarize_text_with_gemini(f"質問: {item.question_text}\n回答: {item.ai_answer_text}")
+        for item in items
+    ])
+
+    content_ids = history_writes.insert_question_summaries(db, [
+        history_writes.QuestionSummaryRows(
+            summary_history_id=item.summary_history_id,
+            # ユーザーが提供した要約があればそれを使用、なければAI生成の要約を使用
+            content=item.user_provided_summary if item.user_provided_summary is not None else ai_generated_summary,
+            question_text=item.question_text,
+            ai_answer_text=item.ai_answer_text,
+            ai_summary=ai_generated_summary # AiSummaryResponse には AI生成の要約を保存
         )
-        db.add(new_ai_summary_response)
+        for item, ai_generated_summary in zip(items, ai_generated_summaries)
+    ], datetime.now(timezone.utc))
+    http_cache.bump(db, *[http_cache.summary_scope(summary_id) for summary_id in summary_ids])
+    db.commit()
+    return content_ids
 
-        db.commit()
-        db.refresh(new_history_content)
 
-        return {"message": "質問単位の要約が正常に保存されました", "content_id": new_history_content.id}
+@app.post("/api/save-question-summary")
+async def save_question_summary(
+    request: HistoryContentCreateRequest,
+    current_user: User = Depends(get_required_user),
+    db: Session = Depends(get_db),
+    _admission: LlmAdmission = Depends(llm_admission("save-question-summary"))
+):
+    """質問と回答のペアを要約してデータベースに保存するエンドポイント"""
+    try:
+        content_ids = await _save_question_summaries(db, current_user, [request])
+        return {"message": "質問単位の要約が正常に保存されました", "content_id": content_ids[0]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Error saving question summary: %s", e)
+        raise HTTPException(status_code=500, detail=f"質問単位の要約保存中にエラーが発生しました: {str(e)}")
+
 
+@app.post("/api/save-question-summaries")
+async def save_question_summaries(
+    request: QuestionSummaryBatchRequest,
+    current_user: User = Depends(get_required_user),
+    db: Session = Depends(get_db),
+    admission: LlmAdmission = Depends(llm_admission("save-question-summaries"))
+):
+    """複数の質問と回答のペアをまとめて要約・保存するエンドポイント"""
+    if not request.items:
+        return {"message": "保存する質問がありません", "content_ids": []}
+    # 質問ごとに Gemini を呼び出すので、受け付け時の1件分に加えて残りの件数分のトークンを取る
+    await admission.charge(len(request.items) - 1)
+    try:
+        content_ids = await _save_question_summaries(db, current_user, request.items)
+        return {"message": f"{len(content_ids)}件の質問単位の要約が正常に保存されました", "content_ids": content_ids}
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error saving question summary: {str(e)}")
+        logger.error("Error saving question summaries: %s", e)
         raise HTTPException(status_code=500, detail=f"質問単位の要約保存中にエラーが発生しました: {str(e)}")
 
 @app.put("/api/history-contents")
@@ -1610,49 +2046,81 @@ async def upsert_history_content(
         )
         db.add(history_content)
         message = "コンテンツが作成されました"
-    
+
+    if request.section_type == 'ai_chat':
+        # グラフ表示用の質問と回答のペアも同じトランザクションで作り直す
+        db.flush()
+        _store_question_answer_pairs(db, history_content, _load_chat_history(history_content))
+
+    http_cache.bump(db, http_cache.summary_scope(summary_history.id))
     db.commit()
     db.refresh(history_content)
     return {"message": message, "content_id": history_content.id}
 
 
+# チームのメンバーの一覧（認可に使う）。redis:// なら変更は pub/sub ですぐ全ワーカーに反映され、
+# memory:// では他のワーカーには TTL の間だけ古い一覧が残る
+TEAM_MEMBERS_CACHE_TTL_SECONDS = float(os.getenv("TEAM_MEMBERS_CACHE_TTL_SECONDS", "30"))
+team_member_ids_cache = cache.namespace("team_member_ids", ttl=TEAM_MEMBERS_CACHE_TTL_SECONDS, local_ttl=5)
+
+async def _team_member_ids(db: Session, team_id: int) -> Optional[List[int]]:
+    """チームのメンバーの user_id（チームが無ければ None）。共有キャッシュに保存し、メンバーの変更時に無効化する"""
+    async def load():
+        if not db.query(exists().where(Team.id == team_id)).scalar():
+            return None
+        return [user_id for (user_id,) in db.query(TeamMember.user_id).filter(TeamMember.team_id == team_id).all()]
+    return await team_member_ids_cache.get_or_load(str(team_id), load)
+
+async def _is_team_member(db: Session, claims: AccessClaims, team_id: int) -> bool:
+    """所属チームかどうか。トークンのクレームではなく、メンバーの一覧（変更時に無効化される）で確認する"""
+    member_ids = await _team_member_ids(db, team_id)
+    return member_ids is not None and claims.id in member_ids
+
+async def _require_team_member(db: Session, claims: AccessClaims, team_id: int, forbidden_detail: str):
+    """チームの存在と、現在のユーザーがメンバーであることを確認する"""
+    member_ids = await _team_member_ids(db, team_id)
+    if member_ids is None:
+        raise HTTPException(status_code=404, detail="チームが見つかりません")
+    if claims.id not in member_ids:
+        raise HTTPException(status_code=403, detail=forbidden_detail)
+
 @app.get("/api/teams/{team_id}/files", response_model=List[SharedFileResponse])
 async def get_shared_files(
     team_id: int,
-    current_user: User = Depends(get_required_user),
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db)
 ):
-    """チームに共有されたファイルの一覧を取得するエンドポイント"""
-    # チームが存在するか確認
-    team = db.query(Team).filter(Team.id == team_id).first()
-    if not team:
-        raise HTTPException(status_code=404, detail="チームが見つかりません")
-
-    # ユーザーがチームのメンバーであることを確認
-    team_membership = db.query(TeamMember).filter(
-        TeamMember.user_id == current_user.id,
-        TeamMember.team_id == team_id
-    ).first()
-    if not team_membership:
-        raise HTTPException(status_code=403, detail="このチームのファイルリストを閲覧する権限がありません")
-
-    # チームに共有されたファイルを取得
-    shared_files = db.query(SharedFile, User.username).join(User, SharedFile.uploaded_by_user_id == User.id).filter(
-        SharedFile.team_id == team_id
-    ).order_by(SharedFile.uploaded_at.desc()).all()
-
-    # レスポンスモデルに合うようにデータを整形
-    files_data = []
-    for file, username in shared_files:
-        files_data.append(SharedFileResponse(
-            id=file.id,
-            filename=file.filename,
-            team_id=file.team_id,
-            uploaded_by_user_id=file.uploaded_by_user_id,
-            uploaded_by_username=username,
-            uploaded_at=file.uploaded_at
-        ))
-    return files_data
+    """チームに共有されたファイルの一覧を取得するエンドポイント（ETag が一致すれば 304）"""
+    await _require_team_member(db, current_user, team_id, "このチームのファイルリストを閲覧する権限がありません")
+
+    scopes = [http_cache.team_files_scope(team_id)]
+    etag = http_cache.current_etag(db, scopes)
+    if http_cache.etag_matches(if_none_match, etag):
+        return http_cache.not_modified(etag)
+
+    def build():
+        # チームに共有されたファイルを取得（ファイル本体の列は読まない）
+        shared_files = db.query(
+            SharedFile.id, SharedFile.filename, SharedFile.team_id, SharedFile.uploaded_by_user_id, SharedFile.uploaded_at, User.username
+        ).join(User, SharedFile.uploaded_by_user_id == User.id).filter(
+            SharedFile.team_id == team_id
+        ).order_by(SharedFile.uploaded_at.desc()).all()
+
+        # レスポンスモデルに合うようにデータを整形
+        files_data = [
+            SharedFileResponse(
+                id=file.id,
+                filename=file.filename,
+                team_id=file.team_id,
+                uploaded_by_user_id=file.uploaded_by_user_id,
+                uploaded_by_username=file.username,
+                uploaded_at=file.uploaded_at
+            )
+            for file in shared_files
+        ]
+        return files_data
+    return await http_cache.cached_json_response(f"team:{team_id}:files", etag, build)
 
 
 @app.get("/api/files/{file_id}")
@@ -1734,10 +2202,9 @@ async def send_message(
         created_at=datetime.now(timezone.utc)
     )
     db.add(new_message)
-    db.commit()
-    db.refresh(new_message)
+    db.flush()
 
-    return MessageResponse(
+    message_response = MessageResponse(
         id=new_message.id,
         team_id=new_message.team_id,
         user_id=new_message.user_id,
@@ -1745,15 +2212,22 @@ async def send_message(
         content=new_message.content,
         created_at=new_message.created_at
     )
+    # コミットと同時に、全ワーカーの WebSocket 接続へ配信される
+    team_chat_hub.publish(db, team_id, new_message.id, message_response.model_dump_json())
+    db.commit()
+
+    return message_response
 
 
 @app.get("/api/teams/{team_id}/messages", response_model=List[MessageResponse])
 async def get_messages(
     team_id: int,
+    before_id: Optional[int] = None, # このIDより古いメッセージを取得（ページング用）
+    limit: int = Query(50, ge=1, le=200),
     current_user: User = Depends(get_required_user),
     db: Session = Depends(get_db)
 ):
-    """チームのメッセージ履歴を取得するエンドポイント"""
+    """チームのメッセージ履歴を新しい順に limit 件取得し、古い順に並べて返すエンドポイント"""
     # チームが存在するか確認
     team = db.query(Team).filter(Team.id == team_id).first()
     if not team:
@@ -1767,12 +2241,15 @@ async def get_messages(
     if not team_membership:
         raise HTTPException(status_code=403, detail="このチームのメッセージを閲覧する権限がありません")
 
-    messages = db.query(Message, User.username).join(User, Message.user_id == User.id).filter(
+    messages_query = db.query(Message, User.username).join(User, Message.user_id == User.id).filter(
         Message.team_id == team_id
-    ).order_by(Message.created_at).all()
+    )
+    if before_id is not None:
+        messages_query = messages_query.filter(Message.id < before_id)
+    messages = messages_query.order_by(Message.id.desc()).limit(limit).all()
 
     messages_data = []
-    for message, username in messages:
+    for message, username in reversed(messages):
         messages_data.append(MessageResponse(
             id=message.id,
             team_id=message.team_id,
@@ -1781,18 +2258,281 @@ async def get_messages(
             content=message.content,
             created_at=message.created_at
         ))
-    return messages_data
+    return ORJSONModelResponse(messages_data)
+
+
+def _load_message_json(team_id: int, message_id: int) -> Optional[str]:
+    """NOTIFY に載せきれなかったメッセージをDBから読み直す（LISTEN スレッドから呼ばれる）"""
+    db = SessionLocal()
+    try:
+        row = db.query(Message, User.username).join(User, Message.user_id == User.id).filter(
+            Message.id == message_id,
+            Message.team_id == team_id
+        ).first()
+        if row is None:
+            return None
+        message, username = row
+        return MessageResponse(
+            id=message.id,
+            team_id=message.team_id,
+            user_id=message.user_id,
+            username=username,
+            content=message.content,
+            created_at=message.created_at
+        ).model_dump_json()
+    finally:
+        db.close()
+
+@app.on_event("startup")
+async def start_team_chat_listener():
+    team_chat_hub.start(asyncio.get_running_loop(), _load_message_json)
+
+@app.on_event("shutdown")
+async def stop_team_chat_listener():
+    team_chat_hub.stop()
+
+@app.on_event("startup")
+async def recover_summary_jobs():
+    await run_in_threadpool(_fail_orphaned_summary_jobs)
+
+@app.on_event("shutdown")
+async def stop_summary_jobs():
+    await summary_job_runner.shutdown()
+
+@app.on_event("startup")
+async def start_cache():
+    await cache.start()
+
+@app.on_event("shutdown")
+async def close_cache():
+    await cache.close()
+
+@app.websocket("/ws/teams/{team_id}/messages")
+async def team_messages_websocket(websocket: WebSocket, team_id: int, token: str = Query(...)):
+    """チームの新着メッセージをプッシュする WebSocket（ブラウザはヘッダーを付けられないためトークンはクエリで受け取る）"""
+    username = get_username_from_token(token)
+    if username is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    # 接続中ずっとDB接続を握らないよう、認可チェックの間だけセッションを使う
+    db = SessionLocal()
+    try:
+        user = db.query(User).filter(User.username == username).first()
+        is_member = user is not None and db.query(TeamMember).filter(
+            TeamMember.user_id == user.id,
+            TeamMember.team_id == team_id
+        ).first() is not None
+    finally:
+        db.close()
+    if not is_member:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    await team_chat_hub.connect(team_id, websocket)
+    try:
+        while True:
+            # クライアントからの受信内容は使わない（切断の検知とキープアライブのため）
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    finally:
+        team_chat_hub.disconnect(team_id, websocket)
+
+def _parse_chat_question_answers(chat_history_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """ai_chat のメッセージ列を質問と回答のペアに分解する（回答のない質問は answer が空文字）"""
+    questions_with_answers: List[Dict[str, Any]] = []
+    current_question_data: Optional[Dict[str, Any]] = None
+
+    for message in chat_history_data:
+        if not isinstance(message, dict):
+            continue
+        message_role = message.get('sender', 'unknown')
+        message_text = message.get('text', 'No text')
+        timestamp_str = message.get('timestamp')
+        message_timestamp = None
+        if timestamp_str:
+            try:
+                message_timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
+            except (ValueError, AttributeError):
+                logger.warning("Invalid timestamp format in chat history: %s", timestamp_str)
+
+        if message_role == "user":
+            if current_question_data is not None:
+                questions_with_answers.append({**current_question_data, "answer": ""})
+            current_question_data = {"question": message_text, "timestamp": message_timestamp, "category": message.get("category")}
+        elif message_role == "ai" and current_question_data is not None:
+            questions_with_answers.append({**current_question_data, "answer": message_text})
+            current_question_data = None
+
+    if current_question_data is not None:
+        questions_with_answers.append({**current_question_data, "answer": ""})
+    return questions_with_answers
+
+
+def _load_chat_history(history_content: HistoryContent) -> List[Dict[str, Any]]:
+    """ai_chat の content（JSON）を読み込む。壊れている場合は空リスト"""
+    try:
+        chat_history_data = json.loads(history_content.content)
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.error("Failed to decode chat history JSON for SummaryHistory ID %s, HistoryContent ID %s: %s", history_content.summary_history_id, history_content.id, e)
+        return []
+    if not isinstance(chat_history_data, list):
+        logger.warning("Chat history content for SummaryHistory ID %s, HistoryContent ID %s is not a list. Skipping.", history_content.summary_history_id, history_content.id)
+        return []
+    return chat_history_data
+
+
+def _question_answer_pair_rows(chat_history_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """question_answer_pairs の行（summary_history_id と history_content_id を除く）"""
+    return [
+        {
+            "position": position,
+            "question": str(qa_pair["question"]),
+            "answer": str(qa_pair["answer"] or ""),
+            "category": qa_pair.get("category"),
+            "asked_at": qa_pair["timestamp"]
+        }
+        for position, qa_pair in enumerate(_parse_chat_question_answers(chat_history_data))
+    ]
+
+
+def _store_question_answer_pairs(db: Session, history_content: HistoryContent, chat_history_data: List[Dict[str, Any]]):
+    """ai_chat の質問と回答のペアを question_answer_pairs に作り直す（history_content は flush 済みであること）"""
+    db.query(QuestionAnswerPair).filter(
+        QuestionAnswerPair.history_content_id == history_content.id
+    ).delete(synchronize_session=False)
+    history_writes.insert_rows(db, QuestionAnswerPair, [
+        {**row, "summary_history_id": history_content.summary_history_id, "history_content_id": history_content.id}
+        for row in _question_answer_pair_rows(chat_history_data)
+    ])
+    history_content.qa_extracted_at = datetime.now(timezone.utc)
+
+
+QA_BACKFILL_BATCH_SIZE = 200
+
+
+def _backfill_question_answer_pairs():
+    """ペアを抽出していない ai_chat（question_answer_pairs 導入前に保存されたもの）を抽出して保存する
+
+    起動時に一度だけ実行する。複数のワーカーが同時に実行しても同じチャットを処理しないよう、行をロックして読み飛ばす。
+    ペアが0件のチャットにも qa_extracted_at を付けるので、再び処理されることはない。
+    qa_extracted_at の導入前にペアを抽出済みのチャットは、読み直さずに印だけ付ける。
+    """
+    backfill_db = SessionLocal()
+    backfilled = 0
+    try:
+        while True:
+            missing_chats = backfill_db.query(HistoryContent).filter(
+                HistoryContent.section_type == 'ai_chat',
+                HistoryContent.qa_extracted_at == None
+            ).order_by(HistoryContent.id).limit(QA_BACKFILL_BATCH_SIZE).with_for_update(skip_locked=True).all()
+            if not missing_chats:
+                break
+            extracted_ids = {content_id for (content_id,) in backfill_db.query(QuestionAnswerPair.history_content_id).filter(
+                QuestionAnswerPair.history_content_id.in_([chat_content.id for chat_content in missing_chats])
+            ).distinct().all()}
+            for chat_content in missing_chats:
+                if chat_content.id in extracted_ids:
+                    chat_content.qa_extracted_at = datetime.now(timezone.utc)
+                else:
+                    _store_question_answer_pairs(backfill_db, chat_content, _load_chat_history(chat_content))
+            backfill_db.commit()
+            backfilled += len(missing_chats)
+        if backfilled:
+            logger.info("Backfilled question/answer pairs for %s chat histories", backfilled)
+    except Exception as e:
+        backfill_db.rollback()
+        logger.error("Failed to backfill question/answer pairs: %s", e)
+    finally:
+        backfill_db.close()
+
+
+@app.on_event("startup")
+async def start_question_answer_pair_backfill():
+    # 起動を待たせないよう、スレッドプールで実行する
+    asyncio.get_running_loop().run_in_executor(None, _backfill_question_answer_pairs)
+
+
+def _collect_questions_by_summary(db: Session, summary_ids: List[int]) -> Dict[int, Dict[Optional[str], List[Dict[str, Any]]]]:
+    """要約ごとに、紐づく質問と回答のペアをカテゴリ別・出現順で返す
+
+    グラフの質問ノード ID（question_{要約ID}_{カテゴリ}_{カテゴリ内の番号}）はこの順序に基づく。
+    質問要約（user_question_summary）が先、ai_chat から抽出した質問が後に並ぶ。
+    """
+    questions: Dict[int, Dict[Optional[str], List[Dict[str, Any]]]] = {summary_id: defaultdict(list) for summary_id in summary_ids}
+    if not summary_ids:
+        return questions
+
+    # 埋め込みなどの大きな列は読まない
+    user_question_summaries = db.query(
+        HistoryContent.id, HistoryContent.summary_history_id, HistoryContent.question_text,
+        HistoryContent.ai_answer_text, HistoryContent.content, HistoryContent.created_at
+    ).filter(
+        HistoryContent.summary_history_id.in_(summary_ids),
+        HistoryContent.section_type == 'user_question_summary'
+    ).order_by(HistoryContent.created_at).all()
+
+    for uqs_content in user_question_summaries:
+        questions[uqs_content.summary_history_id]["質問要約"].append({
+            "question": uqs_content.question_text or "",
+            "answer": uqs_content.ai_answer_text or "",
+            "timestamp": uqs_content.created_at,
+            "category": "質問要約", # デフォルトカテゴリ
+            "summarized_qa": uqs_content.content, # 質問と回答の要約
+            "history_content_id": uqs_content.id # HistoryContentのID
+        })
+
+    qa_pairs = db.query(QuestionAnswerPair).filter(
+        QuestionAnswerPair.summary_history_id.in_(summary_ids)
+    ).order_by(
+        QuestionAnswerPair.summary_history_id, QuestionAnswerPair.history_content_id, QuestionAnswerPair.position
+    ).all()
+
+    for qa_pair in qa_pairs:
+        questions[qa_pair.summary_history_id][qa_pair.category].append({
+            "question": qa_pair.question,
+            "answer": qa_pair.answer,
+            "timestamp": qa_pair.asked_at,
+            "category": qa_pair.category,
+            "history_content_id": qa_pair.history_content_id # ai_chatのHistoryContent IDを紐付け
+        })
+
+    return questions
+
+
+LEAN_GRAPH_NODE_EXCLUDE = {"ai_answer", "ai_answer_summary"}
+LEAN_QUESTION_DETAIL_FIELDS = ("id", "label", "question_id")
+
+
+def _lean_graph_payload(graph: GraphData) -> Dict[str, Any]:
+    """回答本文と未設定のフィールドを除いたグラフを返す（表示に必要な構造とラベルのみ）"""
+    nodes = []
+    for node in graph.nodes:
+        node_dict = node.model_dump(exclude=LEAN_GRAPH_NODE_EXCLUDE, exclude_none=True)
+        if node.original_questions_details:
+            node_dict["original_questions_details"] = [
+                {key: question[key] for key in LEAN_QUESTION_DETAIL_FIELDS if question.get(key) is not None}
+                for question in node.original_questions_details
+            ]
+        nodes.append(node_dict)
+    return {"nodes": nodes, "links": [link.model_dump(exclude_none=True) for link in graph.links]}
 
 
 @app.get("/api/summary-tree-graph", response_model=GraphData)
 async def get_summary_tree_graph(
-    current_user: User = Depends(get_required_user),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db),
     team_id: Optional[int] = None,  # Optional team ID for filtering
-    filter_type: Optional[str] = None # "personal" or "team"
+    filter_type: Optional[str] = None, # "personal" or "team"
+    detail: str = Query("full", pattern="^(full|lean)$") # "lean" の場合は回答本文を省き、構造とラベルのみ返す
 ):
     """
     ユーザーの要約履歴とそれに関連するAIチャット履歴、および関連PDFファイルをネットワークグラフ形式で取得するエンドポイント。
+
+    detail=lean ではノードの回答（ai_answer, ai_answer_summary）と統合ノード内の各質問の回答を省く。
+    回答は /api/graph/nodes で必要になったノードの分だけ取得する。
     """
     nodes: List[GraphNode] = []
     links: List[GraphLink] = []
@@ -1808,24 +2548,14 @@ async def get_summary_tree_graph(
         )
     elif filter_type == "team" and team_id is not None:
         # ユーザーが指定されたチームのメンバーであることを確認
-        team_membership = db.query(TeamMember).filter(
-            TeamMember.user_id == current_user.id,
-            TeamMember.team_id == team_id
-        ).first()
-        if not team_membership:
+        if not await _is_team_member(db, current_user, team_id):
             raise HTTPException(status_code=403, detail="You are not a member of this team.")
         
         summaries_query = summaries_query.filter(
             SummaryHistory.team_id == team_id
         )
     else: # デフォルトの動作: ユーザーがアクセスできるすべての要約を表示（個人用 + 所属するすべてのチーム）
-        user_team_ids = [tm.team_id for tm in db.query(TeamMember).filter(TeamMember.user_id == current_user.id).all()]
-        summaries_query = summaries_query.filter(
-            or_(
-                SummaryHistory.user_id == current_user.id,
-                SummaryHistory.team_id.in_(user_team_ids)
-            )
-        )
+        summaries_query = summaries_query.filter(_accessible_summaries_filter(current_user))
     
     summaries = summaries_query.order_by(SummaryHistory.created_at.desc()).all()
 
@@ -1838,7 +2568,7 @@ async def get_summary_tree_graph(
                 for fid in file_ids:
                     referenced_file_ids.add(int(fid))
             except (json.JSONDecodeError, ValueError) as e:
-                logging.warning(f"Failed to parse original_file_path for summary {summary.id}: {e}")
+                logger.warning("Failed to parse original_file_path for summary %s: %s", summary.id, e)
 
     # 参照されているSharedFileを取得
     shared_files_map: Dict[int, SharedFile] = {}
@@ -1857,6 +2587,8 @@ async def get_summary_tree_graph(
             file_id=sf.id
         ))
 
+    questions_by_summary = _collect_questions_by_summary(db, [summary.id for summary in summaries])
+
     for summary in summaries:
         summary_node_id = f"summary_{summary.id}"
         # created_at を明示的にUTCに変換
@@ -1883,105 +2615,14 @@ async def get_summary_tree_graph(
                         pdf_node_id = f"pdf_{int(fid)}"
                         links.append(GraphLink(source=pdf_node_id, target=summary_node_id, type="pdf_summary_link"))
             except (json.JSONDecodeError, ValueError) as e:
-                logging.warning(f"Failed to parse original_file_path for summary {summary.id} when creating PDF links: {e}")
+                logger.warning("Failed to parse original_file_path for summary %s when creating PDF links: %s", summary.id, e)
 
         # 親要約へのリンクを追加
         if summary.parent_summary_id:
             parent_node_id = f"summary_{summary.parent_summary_id}"
             links.append(GraphLink(source=parent_node_id, target=summary_node_id, type="parent_summary_link"))
 
-        # カテゴリごとの質問をグループ化するための辞書
-        questions_by_category: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
-
-        # この要約に関連するユーザー質問要約コンテンツを取得
-        user_question_summaries = db.query(HistoryContent).filter(
-            HistoryContent.summary_history_id == summary.id,
-            HistoryContent.section_type == 'user_question_summary'
-        ).order_by(HistoryContent.created_at).all()
-
-        for uqs_content in user_question_summaries:
-            qa_pair = {
-                "question": uqs_content.question_text or "",
-                "answer": uqs_content.ai_answer_text or "",
-                "timestamp": uqs_content.created_at,
-                "category": "質問要約", # デフォルトカテゴリ
-                "summarized_qa": uqs_content.content, # 質問と回答の要約
-                "history_content_id": uqs_content.id # HistoryContentのID
-            }
-            category = qa_pair.get("category", "未分類")
-            questions_by_category[category].append(qa_pair)
-
-        # 既存のai_chat履歴も処理（もしあれば）
-        ai_chat_content = db.query(HistoryContent).filter(
-            HistoryContent.summary_history_id == summary.id,
-            HistoryContent.section_type == 'ai_chat'
-        ).first()
-
-        if ai_chat_content:
-            try:
-                chat_history_data = json.loads(ai_chat_content.content)
-                if not isinstance(chat_history_data, list):
-                    logging.warning(f"Chat history content for SummaryHistory ID {summary.id}, HistoryContent ID {ai_chat_content.id} is not a list. Skipping.")
-                else:
-                    # ai_chat全体の要約を取得
-                    overall_chat_summary = None
-                    ai_summary_response = db.query(AiSummaryResponse).filter(
-                        AiSummaryResponse.original_history_content_id == ai_chat_content.id
-                    ).first()
-                    overall_chat_summary = ai_summary_response.summarized_content if ai_summary_response else None
-
-                    # チャット履歴を解析し、質問と回答のペアを抽出
-                    questions_with_answers: List[Dict[str, Any]] = []
-                    current_question_data: Optional[Dict[str, Any]] = None
-
-                    for i, message in enumerate(chat_history_data):
-                        message_role = message.get('sender', 'unknown')
-                        message_text = message.get('text', 'No text')
-                        timestamp_str = message.get('timestamp')
-                        message_timestamp = None
-                        if timestamp_str:
-                            try:
-                                message_timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-                            except ValueError:
-                                logging.warning(f"Invalid timestamp format in chat history: {timestamp_str}")
-
-                        if message_role == "user":
-                            if current_question_data is not None:
-                                questions_with_answers.append({
-                                    "question": current_question_data["question"],
-                                    "answer": "",
-                                    "timestamp": current_question_data["timestamp"],
-                                    "category": current_question_data.get("category")
-                                })
-                            current_question_data = {"question": message_text, "timestamp": message_timestamp, "category": message.get("category")}
-                        elif message_role == "ai" and current_question_data is not None:
-                            questions_with_answers.append({
-                                "question": current_question_data["question"],
-                                "answer": message_text,
-                                "timestamp": current_question_data["timestamp"],
-                                "category": current_question_data.get("category")
-                            })
-                            current_question_data = None
-
-                    if current_question_data is not None:
-                        questions_with_answers.append({
-                            "question": current_question_data["question"],
-                            "answer": "",
-                            "timestamp": current_question_data["timestamp"],
-                            "category": current_question_data.get("category")
-                        })
-                    
-                    # ai_chatから抽出した質問もカテゴリごとにグループ化
-                    for qa_pair in questions_with_answers:
-                        category = qa_pair.get("category", "未分類")
-                                            # ai_chatから抽出した質問には、全体の要約を紐付ける
-                                            #qa_pair["summarized_qa"] = overall_chat_summary # 全体の要約を個別の質問に紐付け
-                        qa_pair["history_content_id"] = ai_chat_content.id # ai_chatのHistoryContent IDを紐付け
-                        questions_by_category[category].append(qa_pair)
-            except json.JSONDecodeError as e:
-                logging.error(f"Failed to decode chat history JSON for SummaryHistory ID {summary.id}, HistoryContent ID {ai_chat_content.id}: {e}")
-            except Exception as e:
-                logging.error(f"Error processing chat history for SummaryHistory ID {summary.id}, HistoryContent ID {ai_chat_content.id}: {e}")
+        questions_by_category = questions_by_summary[summary.id]
 
         # カテゴリノードと質問ノード、およびリンクを構築
         for category_name, qa_pairs in questions_by_category.items():
@@ -2028,49 +2669,41 @@ async def get_summary_tree_graph(
     # 埋め込みベクトルを生成
     embeddings = {}
     history_content_embeddings_map = {}
-    history_content_ids = [node.history_content_id for node in question_nodes_data if node.history_content_id is not None]
+    history_content_ids = {node.history_content_id for node in question_nodes_data if node.history_content_id is not None}
     if history_content_ids:
-        db_history_contents = db.query(HistoryContent).filter(HistoryContent.id.in_(history_content_ids)).all()
+        db_history_contents = db.query(HistoryContent.id, HistoryContent.embedding).filter(HistoryContent.id.in_(list(history_content_ids))).all()
         for hc in db_history_contents:
             if hc.embedding:
                 try:
                     history_content_embeddings_map[hc.id] = json.loads(hc.embedding)
                 except json.JSONDecodeError:
-                    logging.warning(f"Failed to decode embedding for HistoryContent ID {hc.id}")
+                    logger.warning("Failed to decode embedding for HistoryContent ID %s", hc.id)
 
+    nodes_to_encode: List[GraphNode] = []
+    embedding_dimension = None
+    if question_nodes_data:
+        embedding_dimension = await run_in_threadpool(lambda: get_embedding_model().get_sentence_embedding_dimension())
     for node in question_nodes_data:
         q_id = node.id
-        q_text = node.label
-        
+
         embedding = None
         if node.history_content_id and node.history_content_id in history_content_embeddings_map:
             embedding_list = history_content_embeddings_map[node.history_content_id]
             embedding = torch.tensor(embedding_list)
-            model = get_embedding_model()
-            if embedding.shape[-1] != model.get_sentence_embedding_dimension():
-                logging.warning(f"Embedding dimension mismatch for HistoryContent ID {node.history_content_id}. Expected {model.get_sentence_embedding_dimension()}, got {embedding.shape[-1]}. Regenerating embedding.")
+            if embedding.shape[-1] != embedding_dimension:
+                logger.warning("Embedding dimension mismatch for HistoryContent ID %s. Expected %s, got %s. Regenerating embedding.", node.history_content_id, embedding_dimension, embedding.shape[-1])
                 embedding = None
 
         if embedding is None:
-            model = get_embedding_model()
-            embedding = model.encode(q_text, convert_to_tensor=True)
-        
-        if embedding is not None:
+            nodes_to_encode.append(node)
+        else:
             embeddings[q_id] = embedding
 
-    def calculate_cosine_similarity(vec1, vec2):
-        if vec1.dim() == 1:
-            vec1 = vec1.unsqueeze(0)
-        if vec2.dim() == 1:
-            vec2 = vec2.unsqueeze(0)
-        cosine_scores = util.cos_sim(vec1, vec2)
-        return cosine_scores.item()
-
-    SIMILARITY_THRESHOLD = 0.85
-
-    # 類似ノードをグループ化するロジック
-    node_to_group_map = {}
-    groups = [] # 各グループはノードIDのリスト
+    # 保存済みの埋め込みがない質問はまとめて1回で埋め込む
+    if nodes_to_encode:
+        encoded = await encode_texts([node.label for node in nodes_to_encode])
+        for node, embedding in zip(nodes_to_encode, encoded):
+            embeddings[node.id] = embedding
 
     # 質問ノードをcreated_atでソートし、古いものから順に処理することで、代表ノードの選出を安定させる
     # ソート前にquestion_created_atがoffset-awareであることを保証
@@ -2080,120 +2713,76 @@ async def get_summary_tree_graph(
         elif node.question_created_at is None:
             node.question_created_at = datetime.min.replace(tzinfo=timezone.utc) # Noneの場合は最小値のUTC aware datetimeを設定
 
-    sorted_question_nodes_data = sorted(question_nodes_data, key=lambda x: x.question_created_at)
-    sorted_question_ids = [node.id for node in sorted_question_nodes_data]
+    sorted_question_ids = [node.id for node in sorted(question_nodes_data, key=lambda x: x.question_created_at)]
 
-    for q_id1 in sorted_question_ids:
-        if q_id1 not in embeddings:
-            continue
+    # 類似ノードをグループ化し、統合ノードに置き換えたグラフを組み立てる
+    groups = await run_in_threadpool(cluster_similar_questions, sorted_question_ids, embeddings)
+    graph = assemble_graph(nodes, links, groups).to_graph_data()
+    final_nodes = graph.nodes
 
-        if q_id1 in node_to_group_map:
-            continue
+    logger.debug("Generated final nodes count: %s", len(final_nodes))
+    if logger.isEnabledFor(logging.DEBUG):
+        # ノードごとのログは件数が多いので間引いて出力する
+        node_log_sampler = LogSampler(first=20, every=100)
+        for node in final_nodes:
+            if node_log_sampler.sample():
+                logger.debug("  Node: id=%s, label=%s, type=%s, grouped_question_ids=%s", node.id, node.label, node.type, node.grouped_question_ids)
 
-        current_group = [q_id1]
-        node_to_group_map[q_id1] = current_group
-
-        for q_id2 in sorted_question_ids:
-            if q_id1 == q_id2 or q_id2 not in embeddings:
-                continue
-            
-            if q_id2 in node_to_group_map:
-                continue
+    if detail == "lean":
+        return ORJSONModelResponse(_lean_graph_payload(graph))
+    return ORJSONModelResponse(graph)
+MAX_GRAPH_NODE_DETAIL_IDS = 200
+QUESTION_NODE_ID_PATTERN = re.compile(r"^question_(\d+)_(.*)_(\d+)$")
 
-            vec1_tensor = embeddings[q_id1]
-            vec2_tensor = embeddings[q_id2]
-            
-            sim = calculate_cosine_similarity(vec1_tensor, vec2_tensor)
-            if sim >= SIMILARITY_THRESHOLD:
-                current_group.append(q_id2)
-                node_to_group_map[q_id2] = current_group
-        
-        groups.append(current_group)
 
-    # 統合されたノードとリンクを生成
-    final_nodes: List[GraphNode] = []
-    final_links: List[GraphLink] = []
-    
-    # 統合された質問ノードのIDと、それが置き換える元の質問ノードIDのマップ
-    integrated_node_replacements: Dict[str, str] = {} # {元の質問ノードID: 統合ノードID}
-
-    for group_index, group in enumerate(groups):
-        if len(group) > 1: # 類似ノードが複数ある場合のみ統合
-            # 代表ノードを選出 (ここではグループ内の最も古いノードを代表とする)
-            representative_node_id = group[0] # ソート済みリストから取得した最初のノード
-            representative_node_data = next(node for node in question_nodes_data if node.id == representative_node_id)
-            
-            integrated_label = f"類似質問 ({len(group)}件): {representative_node_data.label}"
-            integrated_node_id = f"integrated_question_group_{representative_node_data.summary_id}_{group_index}"
-            
-            original_questions_details_list = []
-            for original_q_id in group:
-                original_node = next(node for node in question_nodes_data if node.id == original_q_id)
-                original_questions_details_list.append({
-                    "id": original_node.id,
-                    "label": original_node.label,
-                    "question_id": original_node.question_id,
-                    "ai_answer": original_node.ai_answer, # Add AI answer
-                    "ai_answer_summary": original_node.ai_answer_summary # Add summarized AI answer
-                })
-
-            integrated_node = GraphNode(
-                id=integrated_node_id,
-                label=integrated_label,
-                type="user_question_group",
-                summary_id=representative_node_data.summary_id,
-                question_id=integrated_node_id,
-                ai_answer=representative_node_data.ai_answer, # Use representative node's AI answer
-                ai_answer_summary=representative_node_data.ai_answer_summary, # Use representative node's summarized AI answer
-                question_created_at=representative_node_data.question_created_at,
-                category=representative_node_data.category,
-                history_content_id=None,
-                original_summary_id=representative_node_data.original_summary_id,
-                grouped_question_ids=group,
-                original_questions_details=original_questions_details_list
-            )
-            final_nodes.append(integrated_node)
-
-            for original_q_id in group:
-                integrated_node_replacements[original_q_id] = integrated_node_id
-        else: # 類似ノードがない単独の質問ノードはそのまま追加
-            q_id = group[0]
-            node = next(node for node in question_nodes_data if node.id == q_id)
-            final_nodes.append(node)
-
-    # 元のノードリストから質問ノード以外のノードをfinal_nodesに追加
-    for node in nodes:
-        if node.type != "user_question":
-            final_nodes.append(node)
-    
-
-
-    # その他のリンクを処理
-    for link in links:
-
-
-        source_id = link.source
-        target_id = link.target
+@app.get("/api/graph/nodes", response_model=List[GraphNodeDetail])
+async def get_graph_node_details(
+    ids: str = Query(..., description="カンマ区切りの質問ノード ID（question_{要約ID}_{カテゴリ}_{番号}）"),
+    current_user: AccessClaims = Depends(get_required_claims),
+    db: Session = Depends(get_db)
+):
+    """
+    lean モードのグラフで省いた質問ノードの回答をまとめて取得するエンドポイント。
+    統合ノードの回答は grouped_question_ids の各 ID を指定して取得する。
+    """
+    requested_ids = list(dict.fromkeys(node_id.strip() for node_id in ids.split(",") if node_id.strip()))
+    if len(requested_ids) > MAX_GRAPH_NODE_DETAIL_IDS:
+        raise HTTPException(status_code=400, detail=f"一度に取得できるノードは {MAX_GRAPH_NODE_DETAIL_IDS} 件までです")
+
+    # 要約ごとにまとめ、要約1件につき1回だけ質問を読み出す
+    ids_by_summary: Dict[int, List[Tuple[str, str, int]]] = defaultdict(list)
+    for node_id in requested_ids:
+        match = QUESTION_NODE_ID_PATTERN.match(node_id)
+        if match:
+            ids_by_summary[int(match.group(1))].append((node_id, match.group(2), int(match.group(3))))
+    if not ids_by_summary:
+        return ORJSONModelResponse([])
+
+    summaries = db.query(SummaryHistory).filter(
+        SummaryHistory.id.in_(list(ids_by_summary.keys())),
+        _accessible_summaries_filter(current_user)
+    ).all()
 
-        # リンクのソースまたはターゲットが統合された質問ノードの場合、統合ノードIDに置き換える
-        if source_id in integrated_node_replacements:
-            source_id = integrated_node_replacements[source_id]
-        if target_id in integrated_node_replacements:
-            target_id = integrated_node_replacements[target_id]
-        
-        # 統合された質問ノードへのリンクで、ソースとターゲットが同じになる場合は追加しない
-        if source_id == target_id:
-            continue
+    questions_by_summary = _collect_questions_by_summary(db, [summary.id for summary in summaries])
+    details: List[GraphNodeDetail] = []
+    for summary in summaries:
+        questions_by_category = {str(category): qa_pairs for category, qa_pairs in questions_by_summary[summary.id].items()}
+        for node_id, category_name, index in ids_by_summary[summary.id]:
+            qa_pairs = questions_by_category.get(category_name)
+            if qa_pairs is None or index >= len(qa_pairs):
+                continue
+            qa_pair = qa_pairs[index]
+            details.append(GraphNodeDetail(
+                id=node_id,
+                label=qa_pair["question"],
+                ai_answer=qa_pair["answer"],
+                ai_answer_summary=qa_pair.get("summarized_qa"),
+                history_content_id=qa_pair.get("history_content_id")
+            ))
 
-        # 既に同じリンクが存在しないかチェック (特に統合ノードへのリンクで重複が発生しやすいため)
-        if not any(fl.source == source_id and fl.target == target_id and fl.type == link.type for fl in final_links):
-            final_links.append(GraphLink(source=source_id, target=target_id, type=link.type, directed=link.directed))
+    return ORJSONModelResponse(details)
 
-    logging.info(f"Generated final nodes count: {len(final_nodes)}")
-    for node in final_nodes:
-        logging.info(f"  Node: id={node.id}, label={node.label}, type={node.type}, grouped_question_ids={node.grouped_question_ids}")
 
-    return GraphData(nodes=final_nodes, links=final_links)
 async def get_summary_detail(
     summary_id: int,
     current_user: User = Depends(get_required_user),
@@ -2259,7 +2848,7 @@ async def update_summary_tags(
     # タグリストをカンマ区切りの文字列に変換
     tags_str = ",".join(request.tags)
     summary.tags = tags_str
-    
+    http_cache.bump(db, http_cache.summary_scope(summary.id), *http_cache.summary_list_scopes(summary.user_id, summary.team_id))
     db.commit()
     db.refresh(summary)
 
@@ -2282,59 +2871,57 @@ async def update_summary_title(
         raise HTTPException(status_code=403, detail="この要約のタイトルを編集する権限がありません")
 
     summary.filename = request.filename
-    
+    http_cache.bump(db, http_cache.summary_scope(summary.id), *http_cache.summary_list_scopes(summary.user_id, summary.team_id))
     db.commit()
     db.refresh(summary)
 
     return {"message": "タイトルが正常に更新されました", "summary_id": summary.id, "filename": request.filename}
 
 @app.get("/api/users/me")
-async def read_users_me(current_user: User = Depends(get_required_user)):
-    """現在のユーザー情報を取得するエンドポイント"""
+async def read_users_me(current_user: AccessClaims = Depends(get_required_claims)):
+    """現在のユーザー情報を取得するエンドポイント（トークンのクレームから返す）"""
     return {"username": current_user.username, "id": current_user.id}
 
 @app.get("/api/history-contents/{content_id}")
 async def get_history_content_by_id(
     content_id: int,
-    current_user: User = Depends(get_required_user),
+    if_none_match: Optional[str] = Header(None),
+    current_user: AccessClaims = Depends(get_required_claims),
     db: Session = Depends(get_db)
 ):
-    """IDに基づいて履歴コンテンツを取得するエンドポイント"""
-    history_content = db.query(HistoryContent).filter(HistoryContent.id == content_id).first()
-
-    if not history_content:
-        raise HTTPException(status_code=404, detail="履歴コンテンツが見つかりません")
-
+    """IDに基づいて履歴コンテンツを取得するエンドポイント（ETag が一致すれば 304）"""
     # 権限チェック：関連する要約履歴の所有者またはチームメンバーかを確認
-    summary_history = db.query(SummaryHistory).filter(SummaryHistory.id == history_content.summary_history_id).first()
-    if not summary_history:
+    owner = db.query(HistoryContent.summary_history_id, SummaryHistory.user_id, SummaryHistory.team_id).outerjoin(
+        SummaryHistory, HistoryContent.summary_history_id == SummaryHistory.id
+    ).filter(HistoryContent.id == content_id).first()
+    if not owner:
+        raise HTTPException(status_code=404, detail="履歴コンテンツが見つかりません")
+    if owner.user_id is None:
         raise HTTPException(status_code=404, detail="関連する要約履歴が見つかりません")
-
-    is_owner = summary_history.user_id == current_user.id
-    is_team_member = False
-    if summary_history.team_id:
-        membership = db.query(TeamMember).filter(
-            TeamMember.team_id == summary_history.team_id,
-            TeamMember.user_id == current_user.id
-        ).first()
-        if membership:
-            is_team_member = True
-
-    if not is_owner and not is_team_member:
+    if not await _can_read_summary(db, current_user, owner.user_id, owner.team_id):
         raise HTTPException(status_code=403, detail="この履歴コンテンツを閲覧する権限がありません")
 
-    return HistoryContentResponse(
-        id=history_content.id,
-        summary_history_id=history_content.summary_history_id,
-        section_type=history_content.section_type,
-        content=history_content.content,
-        created_at=history_content.created_at,
-        updated_at=history_content.updated_at
-    )
+    # 履歴コンテンツの変更は要約の scope で管理している
+    scopes = [http_cache.summary_scope(owner.summary_history_id)]
+    etag = http_cache.current_etag(db, scopes, content_id)
+    if http_cache.etag_matches(if_none_match, etag):
+        return http_cache.not_modified(etag)
+
+    def build():
+        history_content = db.query(HistoryContent).filter(HistoryContent.id == content_id).first()
+        if not history_content:
+            raise HTTPException(status_code=404, detail="履歴コンテンツが見つかりません")
+
+        return HistoryContentResponse(
+            id=history_content.id,
+            summary_history_id=history_content.summary_history_id,
+            section_type=history_content.section_type,
+            content=history_content.content,
+            created_at=history_content.created_at,
+            updated_at=history_content.updated_at
+        )
+    return await http_cache.cached_json_response(f"history_content:{content_id}", etag, build)
 
 if __name__ == "__main__":
-    # CPUコア数の半分に基づいてワーカー数を設定（最低1ワーカー）
-    num_workers = max(1, (os.cpu_count() or 1) // 2)
-    config = uvicorn.Config("main:app", host="0.0.0.0", port=8000, reload=True, workers=num_workers)
-    server = uvicorn.Server(config)
-    server.run()
+    # 開発用（reload は1ワーカーでしか動かない）。本番は start_server.py（gunicorn）で起動する
+    uvicorn.run("main:app", host="0.0.0.0", port=int(os.getenv("PORT", "8000")), reload=True)
@@ -0,0 +1,259 @@
+"""リクエスト計測（レイテンシヒストグラム、実行中リクエスト数、DBクエリ数、Gemini・埋め込みの所要時間）
+
+値はワーカープロセスごとに保持され、/metrics は Prometheus のテキスト形式で、
+各レスポンスの Server-Timing ヘッダーはそのリクエストの内訳を返す。
+"""
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import event
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベルごとに [各バケットの件数..., +Inf の件数], 合計値
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[index] += 1
+            self._sums[key] += value
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+http_request_duration = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")))
+http_requests_in_flight = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being processed", ("method", "route")))
+http_request_db_queries = REGISTRY.register(Histogram(
+    "http_request_db_queries", "Number of DB queries issued per HTTP request", ("method", "route"), buckets=COUNT_BUCKETS))
+db_query_duration = REGISTRY.register(Histogram(
+    "db_query_duration_seconds", "Duration of individual DB queries"))
+gemini_request_duration = REGISTRY.register(Histogram(
+    "gemini_request_duration_seconds", "Duration of Gemini generate_content calls", ("outcome",)))
+embedding_encode_duration = REGISTRY.register(Histogram(
+    "embedding_encode_duration_seconds", "Duration of embedding encode calls", ("outcome",)))
+admission_decisions = REGISTRY.register(Counter(
+    "llm_admission_decisions_total", "Admission decisions for LLM-backed endpoints (scope is the limiting bucket)", ("endpoint", "outcome", "scope")))
+admission_queue_wait = REGISTRY.register(Histogram(
+    "llm_admission_queue_wait_seconds", "Time admitted LLM-backed requests waited for tokens and a concurrency slot", ("endpoint",)))
+llm_requests_in_flight = REGISTRY.register(Gauge(
+    "llm_requests_in_flight", "LLM-backed requests currently holding a concurrency slot", ("endpoint",)))
+gemini_dedup_outcomes = REGISTRY.register(Counter(
+    "gemini_dedup_outcomes_total", "Gemini calls by dedup outcome (hit: response cache, coalesced: joined an identical in-flight call)", ("outcome",)))
+category_resolutions = REGISTRY.register(Counter(
+    "category_resolutions_total", "Question categories by source (matched: existing centroid, grouped: shared a generated label, generated: Gemini call)", ("outcome",)))
+
+# Server-Timing に出す区分と、それぞれの区分を記録するヒストグラム
+_PHASE_HISTOGRAMS = {
+    "llm": gemini_request_duration,
+    "embedding": embedding_encode_duration,
+}
+
+
+class RequestTimings:
+    """1リクエスト内の区分ごとの所要時間（秒）と DB クエリ数"""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self.db_queries = 0
+
+    def add(self, phase: str, seconds: float):
+        self.durations[phase] = self.durations.get(phase, 0.0) + seconds
+
+    def server_timing(self, total_seconds: float) -> str:
+        entries = [f"app;dur={total_seconds * 1000:.1f}"]
+        for phase, seconds in self.durations.items():
+            if phase == "db":
+                entries.append(f'db;dur={seconds * 1000:.1f};desc="{self.db_queries} queries"')
+            else:
+                entries.append(f"{phase};dur={seconds * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+
+def start_request() -> RequestTimings:
+    timings = RequestTimings()
+    _current_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[RequestTimings]:
+    return _current_timings.get()
+
+
+@contextmanager
+def timed(phase: str) -> Iterator[None]:
+    """処理時間を現在のリクエストの区分 phase に加算し、対応するヒストグラムにも記録する"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "success"
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add(phase, elapsed)
+        histogram = _PHASE_HISTOGRAMS.get(phase)
+        if histogram is not None:
+            histogram.observe(elapsed, outcome=outcome)
+
+
+def instrument_engine(engine):
+    """SQLAlchemy エンジンの全クエリを計測対象にする"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_times"].pop()
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed)
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.add("db", elapsed)
+            timings.db_queries += 1
+
+    @event.listens_for(engine, "handle_error")
+    def _handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start_times"):
+            conn.info["query_start_times"].pop()
+
+
+def render_prometheus() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,68 @@
+"""パスワードのハッシュ化と照合（イベントループを止めないよう専用のスレッドプールで実行する）
+
+bcrypt は意図的に遅い（1回 100ms 以上）ため、async のエンドポイントで直接呼ぶとその間ワーカーの他のリクエストがすべて止まる。
+bcrypt の計算中は GIL が解放されるので、スレッドプールで並列に実行できる。プールは他の同期処理（run_in_threadpool）と
+分け、同時実行数を PASSWORD_HASH_WORKERS に制限する。同じ IP からのログインの同時実行数も制限する。
+
+ログイン時に、保存済みのハッシュのコスト（rounds）が BCRYPT_ROUNDS と異なる場合は新しいコストでハッシュし直す。
+"""
+import asyncio
+import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 同じ IP から同時に処理するログインの数（超えた分は 429）
+LOGIN_MAX_CONCURRENCY_PER_IP = int(os.getenv("LOGIN_MAX_CONCURRENCY_PER_IP", "2"))
+
+# min_rounds / max_rounds と異なるコストのハッシュは needs_update の対象になる
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+
+
+async def hash_password(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(_executor, pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """パスワードを照合し、(一致したか, 保存し直すハッシュ) を返す。ハッシュし直す必要がなければ None"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, pwd_context.verify_and_update, password, hashed_password)
+
+
+class TooManyConcurrentLogins(Exception):
+    """同じ IP からのログインが同時実行数の上限に達している"""
+
+
+class LoginConcurrencyLimiter:
+    """IP ごとに実行中のログインの数を数え、上限を超えたログインはすぐに拒否する（ワーカーごと）"""
+
+    def __init__(self, max_per_ip: int = LOGIN_MAX_CONCURRENCY_PER_IP):
+        self.max_per_ip = max_per_ip
+        self._in_flight: Dict[str, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def slot(self, client_ip: str) -> AsyncIterator[None]:
+        if self._in_flight[client_ip] >= self.max_per_ip:
+            raise TooManyConcurrentLogins(client_ip)
+        self._in_flight[client_ip] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[client_ip] -= 1
+            if self._in_flight[client_ip] <= 0:
+                del self._in_flight[client_ip]
+
+
+login_limiter = LoginConcurrencyLimiter()
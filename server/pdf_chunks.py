@@ -0,0 +1,117 @@
+"""共有ファイルのテキスト抽出とチャンク分割、チャットで参照するチャンクの選択
+
+PDF のテキスト抽出には pypdf を使う。pypdf が無い環境や、テキストを含まない PDF（スキャン画像など）は
+チャンクを作れないため、呼び出し側で PDF をそのまま送る方法にフォールバックする。
+"""
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Any, List, Sequence
+
+import torch
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # pypdf が無い環境ではテキスト抽出を行わない
+    PdfReader = None
+
+logger = logging.getLogger(__name__)
+
+# チャンクの長さと重なり（文字数）。日本語は1文字あたり概ね1トークン前後
+PDF_CHUNK_SIZE = int(os.getenv("PDF_CHUNK_SIZE", "1200"))
+PDF_CHUNK_OVERLAP = int(os.getenv("PDF_CHUNK_OVERLAP", "200"))
+# チャットの1回の質問で送るチャンク数
+CHAT_CONTEXT_CHUNKS = int(os.getenv("CHAT_CONTEXT_CHUNKS", "8"))
+
+# チャンクの区切りとして優先する位置（段落 > 文末）
+_BOUNDARY_PATTERN = re.compile(r"\n\s*\n|[。．！？!?]|\.\s")
+_SPACES_PATTERN = re.compile(r"[ \t　]+")
+
+
+class TextExtractionUnavailable(Exception):
+    """テキスト抽出に必要なライブラリが無い"""
+
+
+@dataclass
+class TextChunk:
+    page_number: int # 1始まり
+    text: str
+
+
+def extract_pages(filename: str, content: bytes) -> List[str]:
+    """ファイルのページごとのテキストを返す。テキストを持たない形式は空リスト"""
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".txt":
+        return [content.decode("utf-8", errors="replace")]
+    if extension != ".pdf":
+        return []
+    if PdfReader is None:
+        raise TextExtractionUnavailable("pypdf is not installed")
+
+    reader = PdfReader(BytesIO(content))
+    pages = []
+    for page_index, page in enumerate(reader.pages):
+        try:
+            pages.append(page.extract_text() or "")
+        except Exception as e:
+            logger.warning("Failed to extract text from page %s of %s: %s", page_index + 1, filename, e)
+            pages.append("")
+    return pages
+
+
+def split_into_chunks(pages: Sequence[str], chunk_size: int = PDF_CHUNK_SIZE, overlap: int = PDF_CHUNK_OVERLAP) -> List[TextChunk]:
+    """ページごとに、chunk_size 文字以内のチャンクに分割する（隣り合うチャンクは overlap 文字重なる）
+
+    チャンクの末尾は、後半 3 割の範囲にある段落や文の区切りに合わせる。チャンクはページをまたがない。
+    """
+    chunks: List[TextChunk] = []
+    for page_number, page_text in enumerate(pages, start=1):
+        text = _SPACES_PATTERN.sub(" ", page_text).strip()
+        start = 0
+        while start < len(text):
+            end = min(start + chunk_size, len(text))
+            if end < len(text):
+                boundary = None
+                for match in _BOUNDARY_PATTERN.finditer(text, start + int(chunk_size * 0.7), end):
+                    boundary = match.end()
+                if boundary is not None:
+                    end = boundary
+            chunk_text = text[start:end].strip()
+            if chunk_text:
+                chunks.append(TextChunk(page_number=page_number, text=chunk_text))
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+    return chunks
+
+
+def chunk_file(filename: str, content: bytes) -> List[TextChunk]:
+    return split_into_chunks(extract_pages(filename, content))
+
+
+def select_top_chunks(query_embedding: torch.Tensor, chunk_rows: Sequence[Any], k: int = CHAT_CONTEXT_CHUNKS) -> List[Any]:
+    """質問の埋め込みとのコサイン類似度が高い順に k 件のチャンクを返す
+
+    chunk_rows は embedding 属性（JSON 文字列）を持つ行。埋め込みが無い、または次元の合わない行は使わない。
+    """
+    query = torch.nn.functional.normalize(query_embedding.reshape(1, -1).float().cpu(), p=2, dim=1)
+    rows = []
+    vectors = []
+    for row in chunk_rows:
+        try:
+            vector = json.loads(row.embedding) if row.embedding else None
+        except json.JSONDecodeError:
+            vector = None
+        if isinstance(vector, list) and len(vector) == query.shape[1]:
+            rows.append(row)
+            vectors.append(vector)
+    if not rows:
+        return []
+
+    matrix = torch.nn.functional.normalize(torch.tensor(vectors, dtype=torch.float32), p=2, dim=1)
+    scores = (matrix @ query.T).flatten()
+    top_indexes = torch.topk(scores, min(k, len(rows))).indices.tolist()
+    return [rows[index] for index in top_indexes]
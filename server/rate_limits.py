@@ -0,0 +1,160 @@
+"""Gemini を呼び出すエンドポイントの流量制限と同時実行数の制限（アドミッション制御）
+
+リクエストごとに「コスト」分のトークンを、次の3つのトークンバケットから同時に取る。
+- クライアントごと（ログイン中はユーザー、未ログインは IP）
+- IP ごと（1つの IP から複数のアカウントで送られる分もまとめて制限する）
+- 全体（Gemini の API クォータを守る）
+
+トークンが足りない場合は、補充されるまで待つ（待ち行列）。待ち時間が LLM_ADMISSION_MAX_WAIT_SECONDS を超える
+リクエストは待たせずにすぐ 429（Retry-After 付き）で断る。トークンを取れたリクエストも、同時に実行できるのは
+LLM_MAX_CONCURRENCY 件までで、締め切りまでに空きが出なければ 429 を返す。
+
+バケットはワーカーごとに持つため、全体の上限はワーカー数倍になる（LLM_GLOBAL_RATE はワーカー1つあたりの値）。
+"""
+import asyncio
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import metrics
+
+# クライアント（ユーザーまたは IP）ごと: 1秒あたりのトークン数と、溜められる上限（バースト）
+LLM_RATE_PER_CLIENT = float(os.getenv("LLM_RATE_PER_CLIENT", "0.5"))
+LLM_BURST_PER_CLIENT = float(os.getenv("LLM_BURST_PER_CLIENT", "10"))
+LLM_RATE_PER_IP = float(os.getenv("LLM_RATE_PER_IP", "1"))
+LLM_BURST_PER_IP = float(os.getenv("LLM_BURST_PER_IP", "20"))
+LLM_GLOBAL_RATE = float(os.getenv("LLM_GLOBAL_RATE", "10"))
+LLM_GLOBAL_BURST = float(os.getenv("LLM_GLOBAL_BURST", "30"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_ADMISSION_MAX_WAIT_SECONDS = float(os.getenv("LLM_ADMISSION_MAX_WAIT_SECONDS", "5"))
+# 使われていないバケットを捨てるまでの時間（満タンに戻っていればいつ捨てても同じ）
+IDLE_BUCKET_SECONDS = 600
+
+
+class TokenBucket:
+    """トークンバケット。wait_time() で使えるようになるまでの秒数を求め、reserve() で先に取る（待つ分は負になる）"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, cost: float, now: float) -> float:
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def reserve(self, cost: float, now: float):
+        self._refill(now)
+        self.tokens -= cost
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionRejected(Exception):
+    """流量制限により受け付けられない。retry_after 秒後に再試行できる"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(scope)
+        self.scope = scope
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+@dataclass
+class _Bucket:
+    scope: str
+    bucket: TokenBucket
+
+
+class AdmissionController:
+    def __init__(self):
+        self._clients: Dict[str, TokenBucket] = {}
+        self._ips: Dict[str, TokenBucket] = {}
+        self._global = TokenBucket(LLM_GLOBAL_RATE, LLM_GLOBAL_BURST)
+        self._slots = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+        self._last_sweep = time.monotonic()
+
+    def _buckets(self, client_key: str, client_ip: str, now: float) -> List[_Bucket]:
+        if now - self._last_sweep > IDLE_BUCKET_SECONDS:
+            for buckets in (self._clients, self._ips):
+                for key in [key for key, bucket in buckets.items() if bucket.is_idle(now)]:
+                    del buckets[key]
+            self._last_sweep = now
+        client = self._clients.get(client_key)
+        if client is None:
+            client = self._clients[client_key] = TokenBucket(LLM_RATE_PER_CLIENT, LLM_BURST_PER_CLIENT)
+        ip = self._ips.get(client_ip)
+        if ip is None:
+            ip = self._ips[client_ip] = TokenBucket(LLM_RATE_PER_IP, LLM_BURST_PER_IP)
+        return [_Bucket("client", client), _Bucket("ip", ip), _Bucket("global", self._global)]
+
+    def _reserve(self, endpoint: str, client_key: str, client_ip: str, cost: float) -> float:
+        """3つのバケットからトークンを取り、待つ秒数を返す。締め切りに間に合わなければ何も取らずに断る"""
+        now = time.monotonic()
+        buckets = self._buckets(client_key, client_ip, now)
+        waits: List[Tuple[float, str]] = [(entry.bucket.wait_time(cost, now), entry.scope) for entry in buckets]
+        wait, scope = max(waits)
+        if wait > LLM_ADMISSION_MAX_WAIT_SECONDS:
+            metrics.admission_decisions.inc(endpoint=endpoint, outcome="rejected", scope=scope)
+            raise AdmissionRejected(scope, wait)
+        for entry in buckets:
+            entry.bucket.reserve(cost, now)
+        metrics.admission_decisions.inc(endpoint=endpoint, outcome="queued" if wait > 0 else "admitted", scope=scope if wait > 0 else "")
+        return wait
+
+    async def _take_tokens(self, endpoint: str, client_key: str, client_ip: str, cost: float) -> float:
+        wait = self._reserve(endpoint, client_key, client_ip, cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    async def charge(self, endpoint: str, client_key: str, client_ip: str, cost: float):
+        """受け付け後に追加のコスト（バッチの件数分など）を取る。待ちが長すぎれば AdmissionRejected"""
+        if cost > 0:
+            metrics.admission_queue_wait.observe(await self._take_tokens(endpoint, client_key, client_ip, cost), endpoint=endpoint)
+
+    async def acquire(self, endpoint: str, client_key: str, client_ip: str, cost: float = 1) -> Callable[[], None]:
+        """トークンと同時実行の枠を取り、枠を返す関数を返す。どちらも締め切りまでに取れなければ AdmissionRejected"""
+        started = time.monotonic()
+        await self._take_tokens(endpoint, client_key, client_ip, cost)
+        remaining = LLM_ADMISSION_MAX_WAIT_SECONDS - (time.monotonic() - started)
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=max(0.0, remaining))
+        except asyncio.TimeoutError:
+            metrics.admission_decisions.inc(endpoint=endpoint, outcome="rejected", scope="concurrency")
+            raise AdmissionRejected("concurrency", LLM_ADMISSION_MAX_WAIT_SECONDS)
+        metrics.admission_queue_wait.observe(time.monotonic() - started, endpoint=endpoint)
+        metrics.llm_requests_in_flight.inc(endpoint=endpoint)
+
+        def release():
+            metrics.llm_requests_in_flight.dec(endpoint=endpoint)
+            self._slots.release()
+        return release
+
+
+llm_admission = AdmissionController()
+
+
+def max_request_cost() -> int:
+    """1リクエストで取れるトークンの上限（どのバケットも満タンなら待たずに取れる量）。バッチの件数の上限に使う"""
+    return max(1, int(min(LLM_BURST_PER_CLIENT, LLM_BURST_PER_IP, LLM_GLOBAL_BURST)))
+
+
+def client_key_for(user_id: Optional[int], client_ip: str) -> str:
+    return f"user:{user_id}" if user_id is not None else f"ip:{client_ip}"
@@ -0,0 +1,186 @@
+"""レスポンスのエンコード（orjson による高速な JSON 化と gzip / brotli 圧縮）"""
+import zlib
+from datetime import datetime, timezone
+from typing import Any, List, Optional
+
+import orjson
+from pydantic import BaseModel
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli が無い環境では gzip のみ
+    brotli = None
+
+
+def _default(obj: Any):
+    if isinstance(obj, datetime):
+        # 既存レスポンスモデルの json_encoders と同じ形式（UTC、末尾 Z）
+        if obj.tzinfo is None:
+            obj = obj.replace(tzinfo=timezone.utc)
+        return obj.astimezone(timezone.utc).isoformat().replace('+00:00', 'Z')
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONModelResponse(JSONResponse):
+    """Pydantic モデル（またはそのリスト）を jsonable_encoder を通さずに orjson で直接 JSON 化する
+
+    response_model の検証とエンコードを省くため、エンドポイントはこのレスポンスを直接返す。
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# --- 圧縮 ---
+
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        # wbits=31 で gzip 形式のストリームを生成する
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Accept-Encoding から使う圧縮方式を選ぶ（br を優先、q=0 は除外）"""
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name] = quality
+    candidates: List[str] = (["br"] if brotli is not None else []) + ["gzip"]
+    for encoding in candidates:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+class CompressionMiddleware:
+    """Accept-Encoding に応じて brotli または gzip でレスポンスを圧縮する
+
+    minimum_size 未満の単発レスポンス、圧縮済み・非テキストのレスポンス、SSE は圧縮しない。
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = _CompressionResponder(self, encoding, send)
+        await self.app(scope, receive, responder.send)
+
+
+class _CompressionResponder:
+    def __init__(self, middleware: CompressionMiddleware, encoding: str, send: Send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self.downstream_send = send
+        self.start_message: Optional[Message] = None
+        self.compressor = None
+        self.passthrough = False
+
+    def _make_compressor(self):
+        if self.encoding == "br":
+            return _BrotliCompressor(self.middleware.brotli_quality)
+        return _GzipCompressor(self.middleware.gzip_level)
+
+    def _should_compress(self, headers: MutableHeaders, body: bytes, more_body: bool) -> bool:
+        if "content-encoding" in headers:
+            return False
+        content_type = headers.get("content-type", "")
+        if content_type.startswith("text/event-stream"):
+            return False
+        if not any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_CONTENT_TYPES):
+            return False
+        return more_body or len(body) >= self.middleware.minimum_size
+
+    async def send(self, message: Message):
+        message_type = message["type"]
+        if message_type == "http.response.start":
+            # 最初の本文を見てから圧縮するかを決めるため、ヘッダーの送信を保留する
+            self.start_message = message
+            return
+        if message_type != "http.response.body":
+            await self.downstream_send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+        if self.start_message is not None:
+            start_message, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start_message["headers"])
+            if not self._should_compress(headers, body, more_body):
+                self.passthrough = True
+                await self.downstream_send(start_message)
+                await self.downstream_send(message)
+                return
+
+            self.compressor = self._make_compressor()
+            headers["Content-Encoding"] = self.encoding
+            headers.add_vary_header("Accept-Encoding")
+            if more_body:
+                del headers["Content-Length"]
+                data = self.compressor.compress(body) + self.compressor.flush()
+            else:
+                data = self.compressor.compress(body) + self.compressor.finish()
+                headers["Content-Length"] = str(len(data))
+            await self.downstream_send(start_message)
+            await self.downstream_send({"type": "http.response.body", "body": data, "more_body": more_body})
+            return
+
+        if self.passthrough:
+            await self.downstream_send(message)
+            return
+
+        data = self.compressor.compress(body)
+        data += self.compressor.flush() if more_body else self.compressor.finish()
+        await self.downstream_send({"type": "http.response.body", "body": data, "more_body": more_body})
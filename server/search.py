@@ -0,0 +1,73 @@
+"""要約と Q&A 履歴のハイブリッド検索（全文検索のスコアと埋め込みベクトルの類似度の組み合わせ）"""
+import json
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+# スコア = TEXT_WEIGHT * 全文検索スコア + VECTOR_WEIGHT * ベクトル類似度（どちらも 0〜1）
+SEARCH_TEXT_WEIGHT = float(os.getenv("SEARCH_TEXT_WEIGHT", "0.4"))
+SEARCH_VECTOR_WEIGHT = float(os.getenv("SEARCH_VECTOR_WEIGHT", "0.6"))
+# 全文検索に一致しない要約は、類似度がこの値以上の場合のみ結果に含める
+SEARCH_MIN_VECTOR_SIMILARITY = float(os.getenv("SEARCH_MIN_VECTOR_SIMILARITY", "0.35"))
+# 全文検索で候補にする最大件数（ts_rank の上位から）
+SEARCH_TEXT_CANDIDATE_LIMIT = 500
+# ベクトル検索で埋め込みを比べる要約は、全文検索の候補と、新しい順にこの件数まで（全件の埋め込みを毎回デコードしない）
+SEARCH_VECTOR_RECENT_LIMIT = int(os.getenv("SEARCH_VECTOR_RECENT_LIMIT", "1000"))
+
+
+def vector_scores(query_embedding: torch.Tensor,
+                  stored_embeddings: Iterable[Tuple[int, int, str]]) -> Dict[int, Tuple[float, int]]:
+    """要約ごとに、保存済みの埋め込みとクエリのコサイン類似度の最大値と、その HistoryContent ID を返す
+
+    stored_embeddings は (HistoryContent ID, 要約ID, 埋め込みの JSON) の列。次元の合わない埋め込みは無視する。
+    """
+    query = torch.nn.functional.normalize(query_embedding.reshape(1, -1).float().cpu(), p=2, dim=1)
+    dimension = query.shape[1]
+
+    content_ids: List[int] = []
+    summary_ids: List[int] = []
+    vectors: List[List[float]] = []
+    for content_id, summary_id, embedding_json in stored_embeddings:
+        try:
+            vector = json.loads(embedding_json)
+        except (json.JSONDecodeError, TypeError):
+            logger.warning("Failed to decode embedding for HistoryContent ID %s", content_id)
+            continue
+        if not isinstance(vector, list) or len(vector) != dimension:
+            continue
+        content_ids.append(content_id)
+        summary_ids.append(summary_id)
+        vectors.append(vector)
+    if not vectors:
+        return {}
+
+    matrix = torch.nn.functional.normalize(torch.tensor(vectors, dtype=torch.float32), p=2, dim=1)
+    similarities = (matrix @ query.T).flatten().tolist()
+
+    best: Dict[int, Tuple[float, int]] = {}
+    for content_id, summary_id, similarity in zip(content_ids, summary_ids, similarities):
+        if summary_id not in best or similarity > best[summary_id][0]:
+            best[summary_id] = (similarity, content_id)
+    return best
+
+
+def hybrid_rank(text_scores: Dict[int, float], similarities: Dict[int, float],
+                min_vector_similarity: Optional[float] = None) -> List[Tuple[int, float, float, float]]:
+    """(要約ID, スコア, 全文検索スコア, ベクトル類似度) をスコアの高い順に返す"""
+    if min_vector_similarity is None:
+        min_vector_similarity = SEARCH_MIN_VECTOR_SIMILARITY
+    candidate_ids = set(text_scores) | {
+        summary_id for summary_id, similarity in similarities.items() if similarity >= min_vector_similarity
+    }
+    ranked = []
+    for summary_id in candidate_ids:
+        text_score = text_scores.get(summary_id, 0.0)
+        similarity = max(similarities.get(summary_id, 0.0), 0.0)
+        ranked.append((summary_id, SEARCH_TEXT_WEIGHT * text_score + SEARCH_VECTOR_WEIGHT * similarity, text_score, similarity))
+    # 同点の場合は新しい要約（IDの大きい方）を先にする
+    ranked.sort(key=lambda item: (item[1], item[0]), reverse=True)
+    return ranked
@@ -0,0 +1,144 @@
+"""作業状態（/api/session）の差分同期
+
+user_sessions.session_data には常に最新の状態のスナップショット（空白を除いた JSON）を保存し、version を保存のたびに1増やす。
+クライアントは前回同期した version を ETag として持ち、変更点だけを JSON Patch（RFC 6902）で送る（If-Match で競合を検知）。
+パッチを当てた結果が変わらない場合は書き込まない。
+"""
+import copy
+import json
+from typing import Any, List, Optional
+
+
+class JsonPatchInvalid(Exception):
+    """パッチの形式が不正（未知の op、パスの形式など）"""
+
+
+class JsonPatchConflict(Exception):
+    """パッチを現在の状態に適用できない（パスが存在しない、test が一致しない）"""
+
+
+def session_etag(version: int) -> str:
+    return f'"session-{version}"'
+
+
+def dump_snapshot(document: Any) -> str:
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+
+
+def load_snapshot(session_data: Optional[str]) -> Any:
+    if not session_data:
+        return {}
+    try:
+        return json.loads(session_data)
+    except json.JSONDecodeError:
+        return {}
+
+
+def _parse_pointer(pointer: Any) -> List[str]:
+    if not isinstance(pointer, str) or (pointer and not pointer.startswith("/")):
+        raise JsonPatchInvalid(f"不正なパス: {pointer!r}")
+    if pointer == "":
+        return []
+    return [token.replace("~1", "/").replace("~0", "~") for token in pointer[1:].split("/")]
+
+
+def _array_index(container: list, token: str, allow_end: bool) -> int:
+    if allow_end and token == "-":
+        return len(container)
+    if not token.isdigit() or (len(token) > 1 and token.startswith("0")):
+        raise JsonPatchConflict(f"不正な配列のインデックス: {token}")
+    index = int(token)
+    if index > len(container) or (index == len(container) and not allow_end):
+        raise JsonPatchConflict(f"配列のインデックスが範囲外です: {token}")
+    return index
+
+
+def _resolve_parent(document: Any, tokens: List[str]):
+    target = document
+    for token in tokens[:-1]:
+        if isinstance(target, dict):
+            if token not in target:
+                raise JsonPatchConflict(f"パスが存在しません: {token}")
+            target = target[token]
+        elif isinstance(target, list):
+            target = target[_array_index(target, token, allow_end=False)]
+        else:
+            raise JsonPatchConflict(f"パスが存在しません: {token}")
+    return target, tokens[-1]
+
+
+def _get(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        return document
+    parent, key = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchConflict(f"パスが存在しません: {key}")
+        return parent[key]
+    if isinstance(parent, list):
+        return parent[_array_index(parent, key, allow_end=False)]
+    raise JsonPatchConflict(f"パスが存在しません: {key}")
+
+
+def _add(document: Any, tokens: List[str], value: Any) -> Any:
+    if not tokens:
+        return value
+    parent, key = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        parent[key] = value
+    elif isinstance(parent, list):
+        parent.insert(_array_index(parent, key, allow_end=True), value)
+    else:
+        raise JsonPatchConflict(f"パスが存在しません: {key}")
+    return document
+
+
+def _remove(document: Any, tokens: List[str]) -> Any:
+    if not tokens:
+        raise JsonPatchInvalid("ルートは削除できません")
+    parent, key = _resolve_parent(document, tokens)
+    if isinstance(parent, dict):
+        if key not in parent:
+            raise JsonPatchConflict(f"パスが存在しません: {key}")
+        del parent[key]
+    elif isinstance(parent, list):
+        del parent[_array_index(parent, key, allow_end=False)]
+    else:
+        raise JsonPatchConflict(f"パスが存在しません: {key}")
+    return document
+
+
+def apply_patch(document: Any, operations: List[Any]) -> Any:
+    """JSON Patch（add / remove / replace / move / copy / test）を適用した新しい文書を返す（元の文書は変更しない）"""
+    document = copy.deepcopy(document)
+    for operation in operations:
+        if not isinstance(operation, dict) or "op" not in operation or "path" not in operation:
+            raise JsonPatchInvalid("各操作には op と path が必要です")
+        op = operation["op"]
+        tokens = _parse_pointer(operation["path"])
+        if op in ("add", "replace", "test") and "value" not in operation:
+            raise JsonPatchInvalid(f"{op} には value が必要です")
+
+        if op == "add":
+            document = _add(document, tokens, copy.deepcopy(operation["value"]))
+        elif op == "remove":
+            document = _remove(document, tokens)
+        elif op == "replace":
+            _get(document, tokens)
+            if tokens:
+                document = _remove(document, tokens)
+            document = _add(document, tokens, copy.deepcopy(operation["value"]))
+        elif op in ("move", "copy"):
+            from_tokens = _parse_pointer(operation.get("from"))
+            value = copy.deepcopy(_get(document, from_tokens))
+            if op == "move":
+                if tokens[:len(from_tokens)] == from_tokens and tokens != from_tokens:
+                    raise JsonPatchInvalid("自身の子には移動できません")
+                document = _remove(document, from_tokens)
+            document = _add(document, tokens, value)
+        elif op == "test":
+            if _get(document, tokens) != operation["value"]:
+                raise JsonPatchConflict(f"test が一致しません: {operation['path']}")
+        else:
+            raise JsonPatchInvalid(f"未対応の op: {op}")
+    return document
@@ -1,16 +1,70 @@
 import os
+import secrets
+import sys
+import tempfile
+import time
+import multiprocessing
 import uvicorn
 import logging
 
+from embedding_server import run_embedding_server
+from logging_config import configure_logging
+
 # ログ設定
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def start_embedding_server() -> multiprocessing.Process:
+    """全ワーカーで共有する埋め込みサーバーを別プロセスで起動し、ソケットが開くまで待つ"""
+    socket_path = os.getenv("EMBEDDING_SERVER_SOCKET") or os.path.join(tempfile.gettempdir(), f"team20-embedding-{os.getpid()}.sock")
+    # ワーカーは環境変数を引き継ぐので、ここで設定すれば main.py がクライアントとして接続する
+    os.environ["EMBEDDING_SERVER_SOCKET"] = socket_path
+    os.environ.setdefault("EMBEDDING_SERVER_AUTHKEY", secrets.token_hex(16))
+
+    process = multiprocessing.Process(target=run_embedding_server, args=(socket_path,), name="embedding-server", daemon=True)
+    process.start()
+
+    deadline = time.monotonic() + 30
+    while not os.path.exists(socket_path) and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if not os.path.exists(socket_path):
+        logger.warning("Embedding server socket %s did not appear; workers will load the model in-process.", socket_path)
+    return process
+
+
+def run_gunicorn(port: int) -> bool:
+    """gunicorn.conf.py の設定で gunicorn を起動する。gunicorn が使えない環境（Windows など）では False を返す
+
+    埋め込みサーバーは呼び出す前に起動しておく（preload 時は gunicorn のフックより前に main.py が import されるため）。
+    """
+    try:
+        from gunicorn.app.wsgiapp import run
+    except ImportError:
+        return False
+    os.environ.setdefault("PORT", str(port))
+    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn.conf.py")
+    sys.argv = ["gunicorn", "--config", config_path, "main:app"]
+    run()
+    return True
+
 
 if __name__ == "__main__":
-    # CPUコア数の半分に基づいてワーカー数を設定（最低1ワーカー）
-    num_workers = max(1, (os.cpu_count() or 1) // 2)
-    logging.info(f"Starting Uvicorn with {num_workers} workers (half of CPU cores).")
-    
-    # main.py の app オブジェクトを直接参照
     # Use PORT env var if provided (Cloud Run/other envs); default to 8000 for local
     port = int(os.getenv("PORT", "8000"))
-    uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True, workers=num_workers)
+
+    # 埋め込みモデルはワーカーごとではなく1プロセスにだけロードする（ソケットのパスは環境変数でワーカーに伝わる）
+    if os.getenv("EMBEDDING_SERVER_ENABLED", "1") == "1":
+        start_embedding_server()
+
+    if os.getenv("SERVER_RELOAD", "0") == "1":
+        # 開発用: ファイルの変更を監視して再起動する（reload は1ワーカーでしか動かない）
+        logger.info("Starting Uvicorn with reload (single worker).")
+        uvicorn.run("main:app", host="0.0.0.0", port=port, reload=True)
+    elif not run_gunicorn(port):
+        # gunicorn が無い場合は uvicorn のマルチワーカーで起動する（max-requests などの設定は効かない）
+        num_workers = int(os.getenv("WEB_CONCURRENCY", "0")) or max(1, (os.cpu_count() or 1) // 2)
+        logger.info("gunicorn is not available; starting Uvicorn with %s workers.", num_workers)
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=num_workers,
+                    timeout_keep_alive=int(os.getenv("GUNICORN_KEEPALIVE", "75")),
+                    backlog=int(os.getenv("GUNICORN_BACKLOG", "2048")))
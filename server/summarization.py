@@ -0,0 +1,213 @@
+"""アップロードされたファイルの要約（ファイルごとに並列で要約し、最後に統合する map-reduce）
+
+- map:    ファイルごとに要約とタグを生成する。テキストが長いファイルはチャンクごとに要約してからまとめる
+- reduce: 複数ファイルの要約とタグを1つに統合する（1ファイルのみの場合は map の結果をそのまま使う）
+
+ファイルごとの結果と統合結果は内容のハッシュをキーに file_summaries に保存し、同じファイルの再アップロードや
+ファイルの追加時には変わった部分だけを要約する。1ファイルの失敗で全体が失敗しないよう、失敗したファイルは除いて統合する。
+"""
+import asyncio
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+import pdf_chunks
+from database import FileSummary
+
+logger = logging.getLogger(__name__)
+
+# Gemini への同時リクエスト数の上限（1回のアップロード内、プロセス全体で共有）
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+# 抽出したテキストがこの文字数を超えるファイルはチャンクに分けて要約する
+SUMMARY_CHUNK_THRESHOLD_CHARS = int(os.getenv("SUMMARY_CHUNK_THRESHOLD_CHARS", "60000"))
+SUMMARY_CHUNK_SIZE = int(os.getenv("SUMMARY_CHUNK_SIZE", "12000"))
+# プロンプトを変えたらキャッシュを使わないよう、キャッシュキーに含める
+SUMMARY_PROMPT_VERSION = "v1"
+
+SUMMARY_FAILED_TEXT = "要約の生成に失敗しました"
+
+TAG_INSTRUCTION = (
+    "要約内容に合ったタグを少なくとも3つ生成してください。最大数は5個です．生成したタグに関しては，markdownで見出しなどをつけずに"
+    "プレーンなテキスト [タグ: tag1, tag2, tag3...] の形式で文末に含めてください。タグが生成できない場合でも、必ず `[タグ: なし]` と記述してください。"
+)
+FILE_PROMPT = "以下のファイルの内容を日本語で要約してください。要点をmarkdownを活用した箇条書きで整理し、わかりやすく説明してください。" + TAG_INSTRUCTION
+CHUNK_PROMPT = "以下は「{filename}」の一部（{index}/{total}）から抽出したテキストです。この部分の要点を日本語の箇条書きで簡潔にまとめてください。\n\n{text}"
+FILE_REDUCE_PROMPT = (
+    "以下は「{filename}」を分割してそれぞれ要約したものです。ファイル全体の要約として日本語で統合してください。"
+    "要点をmarkdownを活用した箇条書きで整理し、わかりやすく説明してください。" + TAG_INSTRUCTION + "\n\n{partials}"
+)
+BUNDLE_REDUCE_PROMPT = (
+    "以下は複数のファイルそれぞれの要約とタグです。全体を1つの要約として日本語で統合してください。"
+    "要点をmarkdownを活用した箇条書きで整理し、わかりやすく説明してください。" + TAG_INSTRUCTION + "\n\n{partials}"
+)
+
+_TAG_PATTERN = re.compile(r'\[タグ:\s*(.*?)\s*\]')
+
+GenerateContent = Callable[[Any], Awaitable[Any]]
+ProgressCallback = Callable[[int, int], None]
+
+_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(SUMMARY_MAX_CONCURRENCY)
+    return _semaphore
+
+
+@dataclass
+class SummaryInput:
+    filename: str
+    content: bytes
+    sha256: Optional[str] = None # 受信時に計算済みのハッシュ（無ければここで計算する）
+
+
+@dataclass
+class SummaryResult:
+    summary: str
+    tags: List[str]
+
+
+def split_summary_and_tags(text: str) -> Tuple[str, List[str]]:
+    """応答から [タグ: ...] を取り出し、タグを除いた要約とタグのリストを返す"""
+    tag_match = _TAG_PATTERN.search(text)
+    if not tag_match:
+        return text, []
+    tags = [tag.strip() for tag in tag_match.group(1).split(',') if tag.strip()]
+    return _TAG_PATTERN.sub('', text).strip(), tags
+
+
+def _response_text(response: Any) -> Optional[str]:
+    if hasattr(response, 'text') and response.text:
+        return response.text
+    elif hasattr(response, 'candidates') and response.candidates:
+        return response.candidates[0].content.parts[0].text
+    return None
+
+
+async def _generate_text(generate: GenerateContent, contents: Any) -> str:
+    async with _get_semaphore():
+        text = _response_text(await generate(contents))
+    if not text:
+        raise ValueError("empty response from Gemini")
+    return text
+
+
+def _cache_key(kind: str, digest: str) -> str:
+    return f"{kind}:{SUMMARY_PROMPT_VERSION}:{digest}"
+
+
+def _load_cached(db: Session, cache_key: str) -> Optional[SummaryResult]:
+    cached = db.query(FileSummary).filter(FileSummary.cache_key == cache_key).first()
+    if cached is None:
+        return None
+    return SummaryResult(summary=cached.summary, tags=cached.tags.split(',') if cached.tags else [])
+
+
+def _store_cached(db: Session, cache_key: str, result: SummaryResult):
+    # 同じファイルが同時にアップロードされても失敗しないよう、既にあれば何もしない
+    db.execute(insert(FileSummary).values(
+        cache_key=cache_key,
+        summary=result.summary,
+        tags=",".join(result.tags) if result.tags else None
+    ).on_conflict_do_nothing(index_elements=["cache_key"]))
+
+
+async def _summarize_file(generate: GenerateContent, item: SummaryInput) -> SummaryResult:
+    """1ファイルを要約する。長いテキストはチャンクごとに要約してから統合する"""
+    try:
+        pages = await run_in_threadpool(pdf_chunks.extract_pages, item.filename, item.content)
+    except Exception as e:
+        logger.debug("Text extraction unavailable for %s, sending the whole file: %s", item.filename, e)
+        pages = []
+
+    if sum(len(page) for page in pages) > SUMMARY_CHUNK_THRESHOLD_CHARS:
+        chunks = pdf_chunks.split_into_chunks(pages, chunk_size=SUMMARY_CHUNK_SIZE, overlap=0)
+        partials = await asyncio.gather(*[
+            _generate_text(generate, CHUNK_PROMPT.format(filename=item.filename, index=index, total=len(chunks), text=chunk.text))
+            for index, chunk in enumerate(chunks, start=1)
+        ])
+        logger.info("Summarized %s in %s chunks", item.filename, len(chunks))
+        text = await _generate_text(generate, FILE_REDUCE_PROMPT.format(
+            filename=item.filename,
+            partials="\n\n".join(f"## 部分 {index}\n{partial}" for index, partial in enumerate(partials, start=1))
+        ))
+    else:
+        mime_type = mimetypes.guess_type(item.filename)[0] or 'application/pdf'
+        text = await _generate_text(generate, [{'parts': [{'text': FILE_PROMPT}, {'inline_data': {'mime_type': mime_type, 'data': item.content}}]}])
+
+    summary, tags = split_summary_and_tags(text)
+    return SummaryResult(summary=summary, tags=tags)
+
+
+async def summarize_files(db: Session, items: List[SummaryInput], generate: GenerateContent,
+                          on_progress: Optional[ProgressCallback] = None) -> SummaryResult:
+    """ファイルごとに並列で要約し（キャッシュ済みのファイルは再利用）、結果を統合して返す
+
+    on_progress にはファイルの要約が1件終わる（失敗を含む）たびに (終わったファイル数, ファイル数) を渡す。
+    """
+    digests = [item.sha256 or hashlib.sha256(item.content).hexdigest() for item in items]
+
+    results: List[Optional[SummaryResult]] = [_load_cached(db, _cache_key("file", digest)) for digest in digests]
+    pending = [index for index, result in enumerate(results) if result is None]
+    logger.info("Summarizing %s files (%s cached)", len(items), len(items) - len(pending))
+
+    completed = len(items) - len(pending)
+    if on_progress is not None:
+        on_progress(completed, len(items))
+
+    async def summarize_and_report(item: SummaryInput) -> SummaryResult:
+        nonlocal completed
+        try:
+            return await _summarize_file(generate, item)
+        finally:
+            completed += 1
+            if on_progress is not None:
+                on_progress(completed, len(items))
+
+    outcomes = await asyncio.gather(*[summarize_and_report(items[index]) for index in pending], return_exceptions=True)
+    for index, outcome in zip(pending, outcomes):
+        if isinstance(outcome, BaseException):
+            logger.error("Failed to summarize %s: %s", items[index].filename, outcome)
+            continue
+        results[index] = outcome
+        _store_cached(db, _cache_key("file", digests[index]), outcome)
+
+    succeeded = [(item, result) for item, result in zip(items, results) if result is not None]
+    if not succeeded:
+        return SummaryResult(summary=SUMMARY_FAILED_TEXT, tags=[])
+    if len(succeeded) == 1:
+        return succeeded[0][1]
+
+    # 統合結果は、統合したファイルの組み合わせ（順序を含む）ごとにキャッシュする
+    bundle_key = _cache_key("bundle", hashlib.sha256(":".join(
+        digest for digest, result in zip(digests, results) if result is not None
+    ).encode()).hexdigest())
+    cached = _load_cached(db, bundle_key)
+    if cached is not None:
+        return cached
+
+    partials = "\n\n".join(
+        f"## {item.filename}\n{result.summary}\nタグ: {', '.join(result.tags) or 'なし'}"
+        for item, result in succeeded
+    )
+    try:
+        summary, tags = split_summary_and_tags(await _generate_text(generate, BUNDLE_REDUCE_PROMPT.format(partials=partials)))
+    except Exception as e:
+        # 統合に失敗した場合はファイルごとの要約を並べて返す
+        logger.error("Failed to merge partial summaries: %s", e)
+        merged_tags = list(dict.fromkeys(tag for _, result in succeeded for tag in result.tags))[:5]
+        return SummaryResult(summary="\n\n".join(f"## {item.filename}\n{result.summary}" for item, result in succeeded), tags=merged_tags)
+
+    result = SummaryResult(summary=summary, tags=tags)
+    _store_cached(db, bundle_key, result)
+    return result
@@ -0,0 +1,108 @@
+"""アップロード後の要約ジョブの実行と進捗の通知
+
+ジョブの状態は summary_jobs テーブルに保存し、実行はジョブを受け付けたワーカープロセスのイベントループ上で、
+SUMMARY_JOB_CONCURRENCY 件までに制限して行う。進捗は同じワーカーの購読者（SSE）へ即時に通知し、
+別のワーカーで購読している場合や通知を取りこぼした場合も、購読側が定期的に DB を読み直すことで追従する。
+ジョブには実行するワーカー（ホスト名:PID）を記録し、起動時に終了済みのワーカーに残されたジョブを失敗として記録する。
+"""
+import asyncio
+import logging
+import os
+import socket
+from collections import defaultdict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_JOB_CONCURRENCY = int(os.getenv("SUMMARY_JOB_CONCURRENCY", "2"))
+# SSE の購読側が通知を待たずに DB を読み直す間隔（秒）
+SUMMARY_JOB_POLL_SECONDS = 2.0
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+FINISHED_STATUSES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+def current_worker_id() -> str:
+    """このプロセスの識別子（preload では fork 前に import されるので、呼び出し時に求める）"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def is_worker_alive(worker_id: Optional[str]) -> Optional[bool]:
+    """ワーカーのプロセスが残っているか。別のホストのワーカーは確認できないので None"""
+    host, _, pid = (worker_id or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SummaryJobRunner:
+    """ジョブを同時実行数を制限して実行し、進捗をジョブの購読者に配信する"""
+
+    def __init__(self, concurrency: int = SUMMARY_JOB_CONCURRENCY):
+        self._concurrency = concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # 実行中のタスクへの参照（保持しないとガベージコレクションで中断されることがある）
+        self._tasks: Set[asyncio.Task] = set()
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = defaultdict(set)
+
+    def submit(self, job_id: str, run: Callable[[str], Awaitable[None]],
+               on_cancelled: Optional[Callable[[str], None]] = None) -> asyncio.Task:
+        """ジョブを実行する。on_cancelled は、順番待ちの間に中断された（run が呼ばれなかった）場合に呼ばれる"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self._concurrency)
+        task = asyncio.create_task(self._run(job_id, run, on_cancelled), name=f"summary-job-{job_id}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, job_id: str, run: Callable[[str], Awaitable[None]],
+                   on_cancelled: Optional[Callable[[str], None]]):
+        try:
+            await self._semaphore.acquire()
+        except asyncio.CancelledError:
+            if on_cancelled is not None:
+                on_cancelled(job_id)
+            raise
+        try:
+            await run(job_id)
+        except Exception:
+            # run 側で失敗を記録する。ここでは他のジョブに影響させないよう握りつぶす
+            logger.exception("Summary job %s raised", job_id)
+        finally:
+            self._semaphore.release()
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers[job_id].add(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(job_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            self._subscribers.pop(job_id, None)
+
+    def notify(self, job_id: str, state: Dict[str, Any]):
+        for queue in list(self._subscribers.get(job_id, ())):
+            queue.put_nowait(state)
+
+    async def shutdown(self):
+        """実行中・順番待ちのジョブを中断する（中断されたジョブは run か on_cancelled で failed として記録される）"""
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+summary_job_runner = SummaryJobRunner()
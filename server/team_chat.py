@@ -0,0 +1,128 @@
+"""チームチャットのリアルタイム配信（WebSocket + PostgreSQL LISTEN/NOTIFY）
+
+send_message はメッセージの INSERT と同じトランザクションで pg_notify を発行する。
+各 uvicorn ワーカーは LISTEN 専用の接続を1本持ち、通知を受けると自分に接続している
+そのチームの WebSocket クライアントへ配信する。これによりワーカーをまたいでも配信される。
+"""
+import asyncio
+import json
+import logging
+import select
+import threading
+from collections import defaultdict
+from typing import Callable, Dict, Optional, Set
+
+from fastapi import WebSocket
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database import engine
+
+logger = logging.getLogger(__name__)
+
+TEAM_MESSAGES_CHANNEL = "team_messages"
+# pg_notify のペイロード上限は 8000 バイト。超える場合は ID だけ送り、受信側で読み直す
+MAX_NOTIFY_PAYLOAD_BYTES = 7000
+LISTEN_POLL_SECONDS = 5.0
+RECONNECT_DELAY_SECONDS = 3.0
+
+
+class TeamChatHub:
+    """ワーカー内の WebSocket 接続をチームごとに管理し、NOTIFY を受けて配信する"""
+
+    def __init__(self):
+        self._connections: Dict[int, Set[WebSocket]] = defaultdict(set)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop = threading.Event()
+        self._listener_thread: Optional[threading.Thread] = None
+        # 大きすぎて NOTIFY に載らなかったメッセージを (team_id, message_id) から JSON に復元する関数
+        self._load_message: Optional[Callable[[int, int], Optional[str]]] = None
+
+    async def connect(self, team_id: int, websocket: WebSocket):
+        self._connections[team_id].add(websocket)
+
+    def disconnect(self, team_id: int, websocket: WebSocket):
+        sockets = self._connections.get(team_id)
+        if sockets is None:
+            return
+        sockets.discard(websocket)
+        if not sockets:
+            self._connections.pop(team_id, None)
+
+    async def broadcast(self, team_id: int, message_json: str):
+        for websocket in list(self._connections.get(team_id, ())):
+            try:
+                await websocket.send_text(message_json)
+            except Exception:
+                # 切断済みのクライアントは外す
+                self.disconnect(team_id, websocket)
+
+    def publish(self, db: Session, team_id: int, message_id: int, message_json: str):
+        """メッセージの保存と同じトランザクションで NOTIFY を発行する（コミット時に配信される）"""
+        payload = json.dumps({"team_id": team_id, "id": message_id, "message": message_json}, ensure_ascii=False)
+        if len(payload.encode("utf-8")) > MAX_NOTIFY_PAYLOAD_BYTES:
+            payload = json.dumps({"team_id": team_id, "id": message_id})
+        db.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": TEAM_MESSAGES_CHANNEL, "payload": payload})
+
+    def start(self, loop: asyncio.AbstractEventLoop, load_message: Callable[[int, int], Optional[str]]):
+        if self._listener_thread is not None:
+            return
+        self._loop = loop
+        self._load_message = load_message
+        self._stop.clear()
+        self._listener_thread = threading.Thread(target=self._listen_forever, name="team-chat-listener", daemon=True)
+        self._listener_thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._listener_thread = None
+
+    def _listen_forever(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.warning("Team chat LISTEN connection failed: %s; reconnecting", e)
+                self._stop.wait(RECONNECT_DELAY_SECONDS)
+
+    def _listen(self):
+        pooled = engine.raw_connection()
+        # LISTEN 用の接続はプールに返さず、このスレッド専用にする
+        pooled.detach()
+        conn = pooled.dbapi_connection
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {TEAM_MESSAGES_CHANNEL}")
+            logger.info("Listening for team chat notifications on channel '%s'", TEAM_MESSAGES_CHANNEL)
+
+            while not self._stop.is_set():
+                if select.select([conn], [], [], LISTEN_POLL_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    self._dispatch(conn.notifies.pop(0).payload)
+        finally:
+            conn.close()
+
+    def _dispatch(self, raw_payload: str):
+        try:
+            payload = json.loads(raw_payload)
+            team_id = int(payload["team_id"])
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Ignoring malformed team chat notification")
+            return
+
+        # このワーカーにそのチームの接続がなければ何もしない
+        if not self._connections.get(team_id) or self._loop is None:
+            return
+
+        message_json = payload.get("message")
+        if message_json is None and self._load_message is not None:
+            message_json = self._load_message(team_id, int(payload["id"]))
+        if message_json is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.broadcast(team_id, message_json), self._loop)
+
+
+team_chat_hub = TeamChatHub()
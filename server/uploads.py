@@ -0,0 +1,114 @@
+"""アップロードされたファイルの受信（チャンク単位の読み込み、ハッシュ計算、サイズ超過の早期拒否）
+
+- RequestSizeLimitMiddleware: Content-Length が上限を超えるリクエストは本文を読む前に 413 で拒否し、
+  Content-Length の無いリクエストも受信した本文が上限を超えた時点で打ち切る
+- read_upload: multipart のパーサーが一時ファイルに書き出したファイルを UPLOAD_READ_CHUNK_SIZE ずつ読みながら
+  sha256 を計算し、ファイルごとの上限を超えた時点で読み込みをやめる
+"""
+import hashlib
+import os
+from dataclasses import dataclass
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, UploadFile
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+UPLOAD_READ_CHUNK_SIZE = 1024 * 1024
+# アップロード1リクエストあたりの本文の上限（複数ファイルの合計、multipart のヘッダーを含む）
+UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("UPLOAD_MAX_REQUEST_MB", "200")) * 1024 * 1024
+
+
+class UploadTooLarge(Exception):
+    """ファイルがサイズの上限を超えている"""
+
+    def __init__(self, filename: Optional[str], max_size: int):
+        super().__init__(f"{filename}: larger than {max_size} bytes")
+        self.filename = filename
+        self.max_size = max_size
+
+
+@dataclass
+class ReceivedFile:
+    filename: str
+    content: bytearray
+    sha256: str
+
+    @property
+    def size(self) -> int:
+        return len(self.content)
+
+
+async def read_upload(file: UploadFile, max_size: int, chunk_size: int = UPLOAD_READ_CHUNK_SIZE) -> ReceivedFile:
+    """アップロードされたファイルをチャンク単位で読み込み、内容と sha256 を返す
+
+    サイズが分かっている場合は読む前に、分からない場合も max_size を超えた時点で UploadTooLarge を送出する。
+    内容は1つの bytearray に追記するため、読み込み中に複製は作らない。
+    """
+    if file.size is not None and file.size > max_size:
+        raise UploadTooLarge(file.filename, max_size)
+
+    digest = hashlib.sha256()
+    content = bytearray()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if len(content) + len(chunk) > max_size:
+            raise UploadTooLarge(file.filename, max_size)
+        digest.update(chunk)
+        content += chunk
+    return ReceivedFile(filename=file.filename, content=content, sha256=digest.hexdigest())
+
+
+class RequestSizeLimitMiddleware:
+    """paths（パステンプレート）に一致する POST リクエストの本文のサイズを max_body_size 以下に制限する"""
+
+    def __init__(self, app: ASGIApp, max_body_size: int, paths: Sequence[str]):
+        self.app = app
+        self.max_body_size = max_body_size
+        self.paths = tuple(paths)
+
+    def _applies_to(self, scope: Scope) -> bool:
+        if scope["type"] != "http" or scope["method"] != "POST":
+            return False
+        return any(_matches_template(template, scope["path"]) for template in self.paths)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if not self._applies_to(scope):
+            await self.app(scope, receive, send)
+            return
+
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            response = JSONResponse(status_code=413, content={"detail": _too_large_detail(self.max_body_size)})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive() -> Message:
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    # フォームの解析中に送出され、FastAPI の例外ハンドラーで 413 のレスポンスになる
+                    raise HTTPException(status_code=413, detail=_too_large_detail(self.max_body_size))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _matches_template(template: str, path: str) -> bool:
+    """/api/teams/{team_id}/files のようなテンプレートとパスが一致するか"""
+    template_parts = template.strip("/").split("/")
+    path_parts = path.strip("/").split("/")
+    if len(template_parts) != len(path_parts):
+        return False
+    return all(t == p or (t.startswith("{") and t.endswith("}") and p) for t, p in zip(template_parts, path_parts))
+
+
+def _too_large_detail(max_size: int) -> str:
+    return f"アップロードするファイルの合計サイズが大きすぎます ({max_size / (1024 * 1024):.0f}MB以下にしてください)"